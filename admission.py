@@ -0,0 +1,70 @@
+import math
+import os
+import threading
+import time
+
+# --- Admission Control ---
+# When storage or the SMS gateway slows down, hops take longer, requests pile
+# up and eventually every session times out. Instead this worker turns away
+# *new* sessions (the empty-text first hop) with a quick "busy" message while
+# it is overloaded, and keeps serving sessions that are already under way, as
+# those users have already typed several answers.
+#
+# Overload is judged per worker process on two signals:
+#   * hops in flight in this process, above ADMISSION_MAX_IN_FLIGHT;
+#   * recent hop latency, a moving average over roughly the last ten hops,
+#     above ADMISSION_MAX_LATENCY_MS. Waiting on a slow database or gateway
+#     shows up here before threads run out. The average also decays toward
+#     zero over ADMISSION_WINDOW_SECONDS while no hops complete, so shedding
+#     stops by itself.
+# Set a threshold to 0 to turn that signal off.
+
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_MAX_LATENCY_MS = float(os.environ.get("ADMISSION_MAX_LATENCY_MS", "1000"))
+ADMISSION_WINDOW_SECONDS = float(os.environ.get("ADMISSION_WINDOW_SECONDS", "5"))
+
+LATENCY_WEIGHT = 0.1
+
+IN_FLIGHT = "in_flight"
+LATENCY = "latency"
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_latency=ADMISSION_MAX_LATENCY_MS / 1000,
+                 window=ADMISSION_WINDOW_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.max_latency = max_latency
+        self.window = window
+        self.in_flight = 0
+        self._latency = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def leave(self, elapsed=None):
+        """Marks a hop done; `elapsed` (seconds) feeds the latency average unless None."""
+        with self._lock:
+            self.in_flight -= 1
+            if elapsed is not None:
+                now = time.monotonic()
+                current = self._latency * math.exp((self._updated - now) / self.window)
+                self._latency = current + (elapsed - current) * LATENCY_WEIGHT
+                self._updated = now
+
+    def latency(self):
+        """Recent average hop latency, decayed toward zero for the time since the last hop."""
+        return self._latency * math.exp((self._updated - time.monotonic()) / self.window)
+
+    def overloaded(self):
+        """Returns the reason new sessions should be turned away, or None."""
+        if self.max_in_flight and self.in_flight > self.max_in_flight:
+            return IN_FLIGHT
+        if self.max_latency and self.latency() > self.max_latency:
+            return LATENCY
+        return None
+
+
+controller = AdmissionController()
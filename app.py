@@ -1,97 +1,63 @@
-from flask import Flask, request
+from flask import Flask, Response, request, jsonify, abort, stream_with_context
+from functools import wraps
 import datetime
-import random
-import re
+import hmac
+import json
+import time
+import os
 import logging
 
-# --- Logging Configuration ---
-# Sets up basic logging to the console.
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-
-# --- Dummy Database & Data Structures (Replace with real DB and APIs) ---
-
-# A simple dictionary to act as our in-memory database.
-registrations_db = {}
-
-# Data structure for Ghana's regions and districts with their codes.
-REGIONS_DISTRICTS = {
-    "1": {
-        "name": "Greater Accra", "code": "01",
-        "districts": [
-            {"name": "Accra Metropolis", "code": "027"},
-            {"name": "Tema Metropolis", "code": "001"},
-            {"name": "Ga East Municipal", "code": "024"},
-        ]
-    },
-    "2": {
-        "name": "Ashanti", "code": "02",
-        "districts": [
-            {"name": "Kumasi Metropolis", "code": "101"},
-            {"name": "Obuasi Municipal", "code": "102"},
-            {"name": "Asante Akim Central", "code": "105"},
-        ]
-    },
-    "3": {"name": "Western", "code": "03", "districts": [{"name": "Sekondi-Takoradi Metropolis", "code": "211"}, {"name": "Tarkwa-Nsuaem Municipal", "code": "203"},]},
-    "4": {"name": "Central", "code": "04", "districts": [{"name": "Cape Coast Metropolis", "code": "301"}]},
-    "5": {"name": "Eastern", "code": "05", "districts": [{"name": "New Juaben South", "code": "401"}]},
-    "6": {"name": "Volta", "code": "06", "districts": [{"name": "Ho Municipal", "code": "501"}]},
-    "7": {"name": "Northern", "code": "07", "districts": [{"name": "Tamale Metropolis", "code": "601"}]},
-    "8": {"name": "Upper East", "code": "08", "districts": [{"name": "Bolgatanga Municipal", "code": "701"}]},
-    "9": {"name": "Upper West", "code": "09", "districts": [{"name": "Wa Municipal", "code": "801"}]},
-    "10": {"name": "Bono", "code": "10", "districts": [{"name": "Sunyani Municipal", "code": "901"}]},
-    "11": {"name": "Bono East", "code": "11", "districts": [{"name": "Techiman Municipal", "code": "911"}]},
-    "12": {"name": "Ahafo", "code": "12", "districts": [{"name": "Asunafo North", "code": "921"}]},
-    "13": {"name": "Western North", "code": "13", "districts": [{"name": "Sefwi Wiawso", "code": "231"}]},
-    "14": {"name": "Oti", "code": "14", "districts": [{"name": "Krachi East", "code": "521"}]},
-    "15": {"name": "North East", "code": "15", "districts": [{"name": "East Mamprusi", "code": "621"}]},
-    "16": {"name": "Savannah", "code": "16", "districts": [{"name": "West Gonja", "code": "631"}]},
-}
-
-
-# --- Input Validation Functions ---
+import admission
+import bulk_upload
+import duplicates
+import idempotency
+import metrics
+import name_search
+import nin_verification
+import profiler
+import rate_limit
+import reference_data
+import slow_hops
+import storage
+import tracing
+from validators import (validate_name, validate_date_of_birth, validate_sex_selection, validate_nin,
+                        validate_optional_nin, validate_ubrn)
+from log_config import setup_logging, sample_access
+from recorder import recorder
+import sms_gateway
+from sms_outbox import outbox, ingestor, PENDING_STATUS, FAILED_STATUS
 
-def validate_name(name):
-    if name == '0': return True
-    if not name: return False
-    clean_name = name.strip()
-    if not (2 <= len(clean_name) <= 50): return False
-    return bool(re.match(r"^[a-zA-Z\s'-]+$", clean_name))
-
-def validate_date_of_birth(dob):
-    if not dob or len(dob) != 8 or not dob.isdigit(): return False
-    try:
-        day, month, year = int(dob[:2]), int(dob[2:4]), int(dob[4:])
-        current_year = datetime.datetime.now().year
-        if not (1 <= day <= 31 and 1 <= month <= 12 and (current_year - 10) <= year <= current_year): return False
-        datetime.datetime(year, month, day)
-        return True
-    except (ValueError, TypeError): return False
+# --- Logging Configuration ---
+# Records go through a queue to a background listener (see log_config.py).
+setup_logging()
+access_log = logging.getLogger("ussd.access")
+flow_log = logging.getLogger("ussd.flow")
+db_log = logging.getLogger("ussd.db")
+sms_log = logging.getLogger("ussd.sms")
 
-def validate_sex_selection(sex_input):
-    return sex_input in ['1', '2']
 
-def validate_nin(nin):
-    if not nin: return False
-    return bool(re.match(r'^GHA-\d{9}-[\dA-Z]$', nin.upper()))
+# --- Database & Data Structures ---
 
-def validate_optional_nin(nin):
-    if nin == '0': return True
-    return validate_nin(nin)
+# Registrations and UBRN sequences live in the storage backend (see storage.py).
+db = storage.backend
+db_log.info("DATABASE: Using %s storage.", db.name)
 
-def validate_ubrn(ubrn):
-    if not ubrn: return False
-    return bool(re.match(r'^GHA-\d{2}-\d{3}-\d{5}-\d{4}-[\dX]$', ubrn.upper()))
+# Ghana's regions and districts with their codes come from a versioned data
+# file, reloaded when it changes (see reference_data.py).
+flow_log.info("REFERENCE DATA: %d regions and %d districts, version %s.",
+              len(reference_data.store.current.region_names), len(reference_data.store.current.district_names),
+              reference_data.store.current.version)
 
 
 # --- UBRN Generation & DB Functions ---
 
-def get_next_sequence_for_district_day(region_code, district_code, julian_day):
-    return random.randint(1, 99)
+MAX_SEQUENCE = 9999
+
+def get_next_sequence_for_district_day(region_code, district_code, day):
+    sequence = db.next_sequence(region_code, district_code, day)
+    if sequence > MAX_SEQUENCE:
+        raise ValueError(f"UBRN sequence exhausted for district {region_code}-{district_code} on day {day}")
+    return sequence
 
 def calculate_check_digit(number_string):
     digits = [int(d) for d in number_string if d.isdigit()]
@@ -102,167 +68,764 @@ def calculate_check_digit(number_string):
     check_digit = (11 - remainder) % 11
     return str(check_digit) if check_digit < 10 else 'X'
 
-def generate_robust_ubrn(region_code, district_code):
-    now = datetime.datetime.now()
-    year_short, julian_day = now.strftime('%y'), now.strftime('%j')
-    sequence = get_next_sequence_for_district_day(region_code, district_code, julian_day)
+def format_ubrn(region_code, district_code, day, sequence):
+    """The UBRN for a district, day ("yyddd") and sequence number, with its check digit."""
     sequence_str = f"{sequence:04d}"
-    base_ubrn_numeric_part = f"{region_code}{district_code}{year_short}{julian_day}{sequence_str}"
+    base_ubrn_numeric_part = f"{region_code}{district_code}{day}{sequence_str}"
     check_digit = calculate_check_digit(base_ubrn_numeric_part)
-    return f"GHA-{region_code}-{district_code}-{year_short}{julian_day}-{sequence_str}-{check_digit}"
-
-def save_registration(details):
-    """Saves registration details to the DB and returns the UBRN."""
-    ubrn = generate_robust_ubrn(details["region_code"], details["district_code"])
+    return f"GHA-{region_code}-{district_code}-{day}-{sequence_str}-{check_digit}"
+
+def generate_robust_ubrn(region_code, district_code, now=None):
+    now = now or datetime.datetime.now()
+    day = now.strftime('%y%j')
+    sequence = get_next_sequence_for_district_day(region_code, district_code, day)
+    return format_ubrn(region_code, district_code, day, sequence)
+
+def save_registration(details, now=None):
+    """Saves registration details to the DB and returns the UBRN (dated `now`, default today)."""
+    started = time.perf_counter()
+    ubrn = generate_robust_ubrn(details["region_code"], details["district_code"], now)
     details["ubrn"] = ubrn
-    registrations_db[ubrn] = details
-    logging.info(f"DATABASE: Saved record with UBRN {ubrn}. Details: {details}")
+    with db.transaction():
+        db.insert_registration(details)
+        name_search.index.add(ubrn, details["baby_name"])
+    elapsed = time.perf_counter() - started
+    metrics.STORAGE_LATENCY.observe(elapsed, ("save",))
+    tracing.add_storage_time(elapsed)
+    metrics.UBRNS_ISSUED.inc((details["region_code"],))
+    db_log.info("DATABASE: Saved record with UBRN %s.", ubrn)
+    db_log.debug("DATABASE: Record %s details: %s", ubrn, details)
     return ubrn
 
+def save_registrations(batch, now=None):
+    """Saves many registrations in one transaction and returns their UBRNs, in order.
+
+    Sequence numbers are reserved a block per district instead of one at a
+    time. An entry whose district has run out of numbers for the day is not
+    saved and gets None instead of a UBRN.
+    """
+    started = time.perf_counter()
+    day = (now or datetime.datetime.now()).strftime('%y%j')
+    by_district = {}
+    for i, details in enumerate(batch):
+        by_district.setdefault((details["region_code"], details["district_code"]), []).append(i)
+    ubrns = [None] * len(batch)
+    saved = []
+    with db.transaction():
+        for (region_code, district_code), indices in by_district.items():
+            first = db.next_sequence(region_code, district_code, day, len(indices))
+            for sequence, i in zip(range(first, MAX_SEQUENCE + 1), indices):
+                ubrns[i] = batch[i]["ubrn"] = format_ubrn(region_code, district_code, day, sequence)
+                saved.append(batch[i])
+            if first + len(indices) - 1 > MAX_SEQUENCE:
+                db_log.warning("DATABASE: UBRN sequence exhausted for district %s-%s on day %s; %d records not saved.",
+                               region_code, district_code, day, min(len(indices), first + len(indices) - 1 - MAX_SEQUENCE))
+        db.insert_registrations(saved)
+        name_search.index.add_many((details["ubrn"], details["baby_name"]) for details in saved)
+    metrics.STORAGE_LATENCY.observe(time.perf_counter() - started, ("save_batch",))
+    for details in saved:
+        metrics.UBRNS_ISSUED.inc((details["region_code"],))
+    db_log.info("DATABASE: Saved %d records in one transaction.", len(saved))
+    return ubrns
+
+def check_duplicate(details):
+    """Looks for an earlier registration of the same child (see duplicates.py).
+
+    Returns the response turning the registration away, or None to save it;
+    a flagged duplicate has its status changed in `details`.
+    """
+    if duplicates.DUPLICATE_MODE == "off": return None
+    started = time.perf_counter()
+    record = duplicates.find_duplicate(db, details)
+    elapsed = time.perf_counter() - started
+    metrics.STORAGE_LATENCY.observe(elapsed, ("find_duplicate",))
+    tracing.add_storage_time(elapsed)
+    if record is None: return None
+    if duplicates.DUPLICATE_MODE == "reject":
+        metrics.DUPLICATE_REGISTRATIONS.inc(("rejected",))
+        db_log.warning("DUPLICATES: Turned away a registration matching UBRN %s.", record["ubrn"])
+        return (f"END This birth is already registered with UBRN {record['ubrn']}. "
+                f"Choose option 2 from the main menu to check its status.")
+    metrics.DUPLICATE_REGISTRATIONS.inc(("flagged",))
+    db_log.warning("DUPLICATES: Flagging a registration that matches UBRN %s.", record["ubrn"])
+    details["status"] = duplicates.DUPLICATE_STATUS
+    return None
+
 def find_registration_by_ubrn(ubrn):
     """Finds a registration by UBRN from the DB."""
-    logging.info(f"DATABASE: Searching for UBRN '{ubrn.upper()}'")
-    return registrations_db.get(ubrn.upper())
+    started = time.perf_counter()
+    ubrn = ubrn.upper()
+    db_log.debug("DATABASE: Searching for UBRN '%s'", ubrn)
+    record = db.get_registration(ubrn)
+    elapsed = time.perf_counter() - started
+    metrics.STORAGE_LATENCY.observe(elapsed, ("find",))
+    tracing.add_storage_time(elapsed)
+    return record
 
 def send_sms(phone_number, message):
-    """Simulates sending an SMS via an API gateway."""
-    logging.info(f"SMS GATEWAY: Sending SMS to {phone_number}. Message: '{message}'")
-    return True
+    """Sends an SMS through the gateway and returns its message ID.
+
+    A gateway failure does not fail the registration: the message is kept in
+    the outbox as failed so it shows up in /sms/undelivered for resending.
+    """
+    started = time.perf_counter()
+    try:
+        message_id, status = sms_gateway.send(phone_number, message), PENDING_STATUS
+    except sms_gateway.SmsGatewayError as e:
+        sms_log.error("SMS GATEWAY: Sending failed: %s", e, extra={"phone": phone_number})
+        message_id, status = sms_gateway.local_message_id(), FAILED_STATUS
+    return record_sent_sms(phone_number, message, message_id, status, started)
+
+def send_registration_sms(phone_number, ubrn):
+    """Sends the UBRN to the parent once the registration is saved.
+
+    The registration stands whatever happens here, so a failure to send or
+    to record the message is logged rather than raised.
+    """
+    try:
+        send_sms(phone_number, registration_sms(ubrn))
+    except Exception as e:
+        sms_log.error("SMS GATEWAY: Registration %s saved but its SMS failed: %s", ubrn, e,
+                      exc_info=e, extra={"phone": phone_number})
+
+def record_sent_sms(phone_number, message, message_id, status, started):
+    """Adds a sent message to the outbox and records how long sending took."""
+    outbox.record(phone_number, message, message_id, status)
+    elapsed = time.perf_counter() - started
+    metrics.SMS_LATENCY.observe(elapsed)
+    tracing.add_sms_time(elapsed)
+    sms_log.info("SMS GATEWAY: Sending SMS %s.", message_id, extra={"phone": phone_number})
+    sms_log.debug("SMS GATEWAY: Message %s: '%s'", message_id, message)
+    return message_id
+
+
+# --- Flow Steps ---
+# Names for each hop of the menu flows, used in logs and diagnostics.
+
+REGISTRATION_STEPS = {
+    1: "register.start", 2: "register.child_name", 3: "register.dob", 4: "register.sex",
+    5: "register.region", 6: "register.district", 7: "register.mother_nin",
+    8: "register.father_nin", 9: "register.confirm",
+}
+VERIFICATION_STEPS = {1: "verify.start", 2: "verify.ubrn"}
+
+def step_name(text, inputs):
+    if text == "": return "main_menu"
+    if inputs[0] == "1": return REGISTRATION_STEPS.get(len(inputs), "register.invalid")
+    if inputs[0] == "2": return VERIFICATION_STEPS.get(len(inputs), "verify.invalid")
+    return "invalid"
+
+# Registration answers at these positions come from a paged menu: the region
+# menu, then the region's district menu.
+REGISTRATION_MENUS = (4, 5)
+
+def menu_answers(inputs, reference=None):
+    """Takes the paging answers ("98" More, "0" Back) out of a registration's inputs.
+
+    Returns (answers, page): the inputs with only the real answers, so each
+    step is at its usual position, and the page of the menu to show next.
+    The answers do not depend on `reference`; the page does, as paging stops
+    at the first and last pages of the session's menus.
+    """
+    if inputs[0] != "1" or len(inputs) <= REGISTRATION_MENUS[0]: return inputs, 0
+    answers, page = inputs[:REGISTRATION_MENUS[0]], 0
+    for value in inputs[REGISTRATION_MENUS[0]:]:
+        if len(answers) in REGISTRATION_MENUS and value in (reference_data.MORE_OPTION, reference_data.BACK_OPTION):
+            if value == reference_data.BACK_OPTION:
+                page = max(page - 1, 0)
+            elif reference is None:
+                page += 1
+            else:
+                screens = (reference.region_menu if len(answers) == REGISTRATION_MENUS[0] else
+                           reference.district_menus.get(answers[-1], ()))
+                page = min(page + 1, max(len(screens) - 1, 0))
+            continue
+        answers.append(value)
+        page = 0
+    return answers, page
+
+
+# --- USSD Flow Engine ---
+# The menu logic does no I/O. The hops that need storage, the SMS gateway or
+# the NIA identity API return an effect instead of a response, and the driver
+# carries it out: handle_ussd() below with blocking calls, or the asyncio
+# driver in asgi.py. Both share the menus, validators and instrumentation.
+
+SUBMIT_REGISTRATION = "submit_registration"
+VERIFY_REGISTRATION = "verify_registration"
+# Argument (nin, response): start looking up the mother's Ghana Card, then send the response.
+PREFETCH_MOTHER_NIN = "prefetch_mother_nin"
+
+SUBMITTED_RESPONSE = "END Thank you! You will receive an SMS with the UBRN shortly."
+ERROR_RESPONSE = "END A system error occurred. Please try again later."
+BUSY_RESPONSE = "END The service is busy. Please try again in a few minutes."
+THROTTLED_RESPONSE = "END Too many requests from this number. Please try again later."
+# Sent to a gateway resend of the confirm hop while the original is still being saved.
+IN_PROGRESS_RESPONSE = "END Your registration is being processed. You will receive an SMS with the UBRN shortly."
+
+def render_hop(text, inputs, page=0, reference=None):
+    """Returns (response, effect) for one hop; effect is None or (kind, argument).
+
+    `inputs` are the answers from menu_answers(), `page` the page of a paged
+    menu to show and `reference` the session's region and district data
+    (default: the current version).
+    """
+    response = ""
+    reference = reference or reference_data.store.current
+
+    # ================== MAIN MENU ==================
+    if text == "":
+        metrics.SESSIONS_STARTED.inc()
+        response = "CON Welcome to the Ghana e-Birth Service:\n1. Register a New Birth\n2. Verify Registration Status"
+
+    # ================== REGISTRATION FLOW (Option 1) ==================
+    elif inputs[0] == "1":
+        if len(inputs) == 1:
+            response = "CON Enter Child's Full Name (or enter 0 to skip)"
+        elif len(inputs) == 2:
+            if not validate_name(inputs[1]):
+                metrics.VALIDATION_FAILURES.inc(("child_name",))
+                response = "END Invalid Name. Please enter alphabetic characters only."
+            else:
+                response = "CON Enter Date of Birth (DDMMYYYY)"
+        elif len(inputs) == 3:
+            if not validate_date_of_birth(inputs[2]):
+                metrics.VALIDATION_FAILURES.inc(("dob",))
+                response = "END Invalid Date of Birth. Format must be DDMMYYYY and a valid date."
+            else:
+                response = "CON Select Sex:\n1. Male\n2. Female"
+        elif len(inputs) == 4:
+            if not validate_sex_selection(inputs[3]):
+                metrics.VALIDATION_FAILURES.inc(("sex",))
+                response = "END Invalid selection for sex. Please restart."
+            else:
+                response = reference.region_menu[page]
+        elif len(inputs) == 5:
+            region_selection = inputs[4]
+            if reference.region(region_selection) is None:
+                metrics.VALIDATION_FAILURES.inc(("region",))
+                response = "END Invalid region selection. Please restart."
+            else:
+                response = reference.district_menus[region_selection][page]
+        elif len(inputs) == 6:
+            region_selection = inputs[4]
+            if reference.region(region_selection) is None:
+                 metrics.VALIDATION_FAILURES.inc(("region",))
+                 response = "END Session error. Invalid region. Please restart."
+            elif reference.district(region_selection, inputs[5]) is None:
+                metrics.VALIDATION_FAILURES.inc(("district",))
+                response = "END Invalid district selection. Please restart."
+            else:
+                response = "CON Enter Mother's Ghana Card Number (e.g. GHA-123456789-0)"
+        elif len(inputs) == 7:
+            if not validate_nin(inputs[6]):
+                metrics.VALIDATION_FAILURES.inc(("mother_nin",))
+                response = "END Invalid Mother's Ghana Card Number. Please restart."
+            else:
+                response = "CON Enter Father's Ghana Card Number (or enter 0 to skip)"
+                if nin_verification.verifier.enabled:
+                    return None, (PREFETCH_MOTHER_NIN, (inputs[6], response))
+        elif len(inputs) == 8:
+            if not validate_optional_nin(inputs[7]):
+                metrics.VALIDATION_FAILURES.inc(("father_nin",))
+                response = "END Invalid Father's Ghana Card Number. Please restart."
+            else:
+                child_name_raw, dob_raw, sex_code, region_sel, district_sel, mother_nin, father_nin_raw = inputs[1:8]
+                child_name = "N/A" if child_name_raw == '0' else child_name_raw
+                dob_display = f"{dob_raw[:2]}/{dob_raw[2:4]}/{dob_raw[4:]}"
+                sex_display = "Male" if sex_code == '1' else "Female"
+                region_name = reference.region(region_sel)['name']
+                district_name = reference.district(region_sel, district_sel)['name']
+                father_nin = "N/A" if father_nin_raw == '0' else father_nin_raw
+
+                summary = (f"Confirm Details:\nName: {child_name}\nDOB: {dob_display}\nSex: {sex_display}\n"
+                           f"Region: {region_name}\nDistrict: {district_name}\nMother NIN: {mother_nin}\n"
+                           f"Father NIN: {father_nin}\n\n1. Confirm & Submit\n2. Cancel")
+                response = f"CON {summary}"
+                if nin_verification.verifier.enabled:
+                    return None, (PREFETCH_MOTHER_NIN, (mother_nin, response))
+        elif len(inputs) == 9:
+            if inputs[8] == '1':
+                region_code = reference.region(inputs[4])['code']
+                district_code = reference.district(inputs[4], inputs[5])['code']
+                details = {
+                    "baby_name": "N/A" if inputs[1] == '0' else inputs[1],
+                    "dob": f"{inputs[2][:2]}/{inputs[2][2:4]}/{inputs[2][4:]}",
+                    "sex": "Male" if inputs[3] == '1' else "Female",
+                    "region_code": region_code, "district_code": district_code,
+                    "mother_nin": inputs[6],
+                    "father_nin": "N/A" if inputs[7] == '0' else inputs[7],
+                    "status": "Provisionally Registered"
+                }
+                return None, (SUBMIT_REGISTRATION, details)
+            else:
+                response = "END Registration cancelled. Thank you."
+
+    # ================== VERIFICATION FLOW (Option 2) ==================
+    elif inputs[0] == "2":
+        if len(inputs) == 1:
+            response = "CON Please enter the complete UBRN to verify (e.g., GHA-01-027-25213-0001-5)."
+        elif len(inputs) == 2:
+            ubrn_to_check = inputs[1].strip()
+            if not validate_ubrn(ubrn_to_check):
+                metrics.VALIDATION_FAILURES.inc(("ubrn",))
+                response = "END Invalid UBRN format. Please dial code to start again."
+            else:
+                return None, (VERIFY_REGISTRATION, ubrn_to_check)
+
+    else:
+        metrics.VALIDATION_FAILURES.inc(("option",))
+        response = "END Invalid option. Please restart the process."
+
+    return response, None
+
+def registration_sms(ubrn):
+    return (f"Congratulations! The birth of your child is provisionally registered. "
+            f"Your Unique Birth Registration Number is {ubrn}. Keep this safe.")
+
+def mother_nin_response(outcome, session_id):
+    """The response turning a registration away for the mother's card check's outcome, or None to go ahead."""
+    if outcome == nin_verification.NOT_FOUND:
+        flow_log.warning("NIA: Mother's Ghana Card for SessionID %s was not found.", session_id)
+        return "END The Mother's Ghana Card Number was not found. Please check it and restart."
+    if outcome == nin_verification.UNAVAILABLE:
+        flow_log.warning("NIA: Mother's Ghana Card for SessionID %s could not be checked; registering anyway.", session_id)
+    return None
+
+def verification_response(ubrn_to_check, record):
+    if record:
+        summary = f"Registration Found:\nName: {record['baby_name']}\nDOB: {record['dob']}\nStatus: {record['status']}"
+        flow_log.info("VERIFICATION: Found record for UBRN '%s'.", ubrn_to_check)
+        return f"END {summary}"
+    flow_log.warning("VERIFICATION: No record found for UBRN '%s'.", ubrn_to_check)
+    return "END Registration Not Found. Please check the UBRN and try again."
+
+
+def begin_submission(session_id, text):
+    """Claims a confirm hop so it is carried out once per (sessionId, text).
+
+    Returns (key, replay). If replay is not None the hop is a gateway resend and
+    replay is the response to send; otherwise the caller submits the
+    registration and then calls end_submission(key, response).
+    """
+    if not session_id: return None, None
+    key = idempotency.make_key(session_id, text)
+    cached = idempotency.cache.claim(key)
+    if cached is None:
+        return key, None
+    if cached is idempotency.PENDING:
+        metrics.IDEMPOTENT_REPLAYS.inc(("in_progress",))
+        flow_log.warning("IDEMPOTENCY: Resend of SessionID %s arrived while the original is still running.", session_id)
+        return key, IN_PROGRESS_RESPONSE
+    metrics.IDEMPOTENT_REPLAYS.inc(("replayed",))
+    flow_log.info("IDEMPOTENCY: Replaying response to resend of SessionID %s.", session_id)
+    return key, cached
+
+
+def end_submission(key, response):
+    """Keeps the confirm hop's response for resends, or releases the claim if it failed (response None)."""
+    if key is None: return
+    if response is None:
+        idempotency.cache.release(key)
+    else:
+        idempotency.cache.complete(key, response)
+
+
+class Hop:
+    """Logging, metrics, tracing and slow-hop watch for one callback hop."""
+
+    def __init__(self, session_id, phone_number, text):
+        self.started = time.perf_counter()
+        self.trace_token = tracing.start_hop()
+        self.session_id = session_id
+        self.phone_number = phone_number
+        self.text = text = (text or "").strip()
+        self.raw_inputs = [inp.strip()[:100] for inp in text.split('*')]
+        self.inputs, _ = menu_answers(self.raw_inputs)
+        # Set by use_reference() once the driver has looked up the session's pin.
+        self.reference = None
+        self.menu_page = 0
+        self.ended = False
+        self.step = step_name(text, self.inputs)
+        self.flow = self.step.partition(".")[0]
+        self.log_context = {"session": session_id, "phone": phone_number, "step": self.step}
+        self.slow_hop = slow_hops.detector.begin(self.step)
+        self.shed = False
+        admission.controller.enter()
+
+        # Log a sample of incoming requests for traceability. The raw text is not
+        # logged as it holds everything the user has typed so far.
+        self.log_access = sample_access()
+        if self.log_access:
+            access_log.info("Request received - SessionID: %s, Step: %s", session_id, self.step, extra=self.log_context)
+
+    def shed_if_busy(self):
+        """Returns the busy response if this hop starts a session while the worker is overloaded, else None."""
+        if self.text != "": return None
+        reason = admission.controller.overloaded()
+        if reason is None: return None
+        self.shed = True
+        metrics.SESSIONS_SHED.inc((reason,))
+        flow_log.warning("ADMISSION: Turned away new SessionID %s (%s).", self.session_id, reason,
+                         extra=self.log_context)
+        return self.finish(BUSY_RESPONSE)
+
+    def use_reference(self, reference):
+        """Renders this hop with `reference`, the region and district data the session is pinned to."""
+        self.reference = reference
+        self.inputs, self.menu_page = menu_answers(self.raw_inputs, reference)
+
+    def pin_reference(self):
+        """Looks up (or makes) the session's pin, so every hop of a session uses the data it started with."""
+        self.use_reference(reference_data.store.for_session(self.session_id, self.text == ""))
+
+    def release_reference(self):
+        """Unpins the session if this hop ended it."""
+        if self.ended:
+            reference_data.store.release(self.session_id)
+
+    def throttled(self):
+        """Returns the throttled response to send, or None if the hop is within its flow's rate limit."""
+        if rate_limit.limiter.allow(self.phone_number, self.flow):
+            return None
+        metrics.RATE_LIMITED.inc((self.flow,))
+        flow_log.warning("RATE LIMIT: Throttled SessionID %s in flow %s.", self.session_id, self.flow,
+                         extra=self.log_context)
+        return self.finish(THROTTLED_RESPONSE)
+
+    def finish(self, response):
+        """Records the finished hop and returns its response."""
+        elapsed = time.perf_counter() - self.started
+        ended = response.startswith("END")
+        metrics.HOP_LATENCY.observe(elapsed, (self.flow, self.step))
+        self.ended = ended
+        if ended:
+            metrics.SESSIONS_ENDED.inc((self.flow,))
+        self._finish_diagnostics(elapsed, response, ended)
+
+        # Log the response being sent back to the USSD gateway
+        if self.log_access:
+            self.log_context["latency_ms"] = round(elapsed * 1000, 3)
+            access_log.info("Response sent - SessionID: %s, Step: %s, Bytes: %d",
+                            self.session_id, self.step, len(response), extra=self.log_context)
+        return response
+
+    def fail(self, error):
+        """Records a hop that raised and returns the generic error response."""
+        # Log the full exception traceback for debugging
+        flow_log.error("FATAL ERROR in USSD callback for SessionID %s: %s", self.session_id, error,
+                       exc_info=error, extra=self.log_context)
+        metrics.CALLBACK_ERRORS.inc()
+        self.ended = True
+        # Provide a generic error to the user
+        self._finish_diagnostics(time.perf_counter() - self.started, ERROR_RESPONSE, True)
+        return ERROR_RESPONSE
+
+    def _finish_diagnostics(self, elapsed, response, ended):
+        # Shed hops are near-instant and would hide the overload from the latency average.
+        admission.controller.leave(None if self.shed else elapsed)
+        slow_hops.detector.end(self.slow_hop, elapsed, self.session_id, self.phone_number, self.text,
+                               tracing.hop_timings(self.trace_token))
+        tracing.finish_hop(self.trace_token, self.session_id, self.step, elapsed, len(response), ended)
+        if recorder is not None:
+            recorder.record(time.time() - elapsed, self.session_id, self.phone_number, self.text, self.step,
+                            response, elapsed)
+
+
+def handle_ussd(session_id, phone_number, text):
+    """Handles one USSD hop with blocking storage and SMS calls and returns the response text."""
+    hop = Hop(session_id, phone_number, text)
+    try:
+        rejected = hop.shed_if_busy() or hop.throttled()
+        if rejected is not None: return rejected
+        hop.pin_reference()
+        response, effect = render_hop(hop.text, hop.inputs, hop.menu_page, hop.reference)
+        if effect is not None:
+            kind, argument = effect
+            if kind == PREFETCH_MOTHER_NIN:
+                nin, response = argument
+                nin_verification.verifier.prefetch(nin)
+            elif kind == SUBMIT_REGISTRATION:
+                response = mother_nin_response(nin_verification.verifier.check(argument["mother_nin"]), session_id)
+                if response is None:
+                    key, response = begin_submission(session_id, hop.text)
+                if response is None:
+                    ubrn = None
+                    try:
+                        # After the claim, so a resend is not taken for a duplicate of its own original.
+                        response = check_duplicate(argument)
+                        if response is None:
+                            ubrn = save_registration(argument)
+                            response = SUBMITTED_RESPONSE
+                    except Exception:
+                        end_submission(key, None)
+                        raise
+                    # Kept as soon as the record is saved, so a resend never issues a second UBRN.
+                    end_submission(key, response)
+                    if ubrn is not None:
+                        send_registration_sms(phone_number, ubrn)
+            else:
+                response = verification_response(argument, find_registration_by_ubrn(argument))
+        return hop.finish(response)
+    except Exception as e:
+        return hop.fail(e)
+    finally:
+        hop.release_reference()
 
 
 # --- Main Flask Application ---
 
 app = Flask(__name__)
 
+# Token for the /admin endpoints, sent in the X-Admin-Token header. Without one
+# configured they are turned off. The client address is no substitute: behind
+# a tunnel such as ngrok every request comes from this machine.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def token_matches(sent, expected):
+    """Compares a request's token with a configured one in constant time; nothing matches an unset token."""
+    return bool(expected) and hmac.compare_digest((sent or "").encode(), expected.encode())
+
+def require_admin(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not token_matches(request.headers.get("X-Admin-Token"), ADMIN_TOKEN): abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+# Each facility that uploads bulk registrations has its own token, sent in the
+# X-Facility-Token header: FACILITY_TOKENS="facility-id=token,other-id=token".
+# Without any configured, bulk uploads are turned off (see ADMIN_TOKEN).
+FACILITY_TOKENS = {token: facility for facility, _, token in
+                   (item.strip().partition("=") for item in os.environ.get("FACILITY_TOKENS", "").split(",")) if token}
+
+def require_facility(view):
+    """Passes the authenticated facility's ID to the view as its first argument."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        sent = request.headers.get("X-Facility-Token")
+        facility = next((facility for token, facility in FACILITY_TOKENS.items() if token_matches(sent, token)), None)
+        if facility is None: abort(403)
+        return view(facility, *args, **kwargs)
+    return wrapper
+
+# The SMS gateway authenticates its delivery reports with SMS_DELIVERY_TOKEN,
+# in the X-Delivery-Token header or, for gateways that cannot send headers,
+# a ?token= on the callback URL. Without one configured, reports are refused.
+SMS_DELIVERY_TOKEN = os.environ.get("SMS_DELIVERY_TOKEN", "")
+
+def delivery_report_allowed():
+    token = request.headers.get("X-Delivery-Token") or request.args.get("token", "")
+    return token_matches(token, SMS_DELIVERY_TOKEN)
+
 @app.route('/callback', methods=['POST'])
 def ussd_callback():
     session_id = request.values.get("sessionId", None)
     phone_number = request.values.get("phoneNumber", None)
-    text = request.values.get("text", "").strip()
-    
-    # Log every incoming request for traceability
-    logging.info(f"Request received - SessionID: {session_id}, Phone: {phone_number}, Text: '{text}'")
+    text = request.values.get("text", "")
+    return handle_ussd(session_id, phone_number, text)
 
-    response = ""
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Exposes service metrics in the Prometheus text format."""
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+# --- Registrar Search ---
+
+@app.route('/registrations/search', methods=['GET'])
+@require_admin
+def search_registrations():
+    """Registrations whose child's name best matches ?name=..., best first (?limit=N, default 20)."""
+    name = request.args.get("name", "").strip()
+    if not name:
+        return "Missing name", 400
     try:
-        inputs = [inp.strip()[:100] for inp in text.split('*')]
-
-        # ================== MAIN MENU ==================
-        if text == "":
-            response = "CON Welcome to the Ghana e-Birth Service:\n1. Register a New Birth\n2. Verify Registration Status"
-
-        # ================== REGISTRATION FLOW (Option 1) ==================
-        elif inputs[0] == "1":
-            if len(inputs) == 1:
-                response = "CON Enter Child's Full Name (or enter 0 to skip)"
-            elif len(inputs) == 2:
-                if not validate_name(inputs[1]):
-                    response = "END Invalid Name. Please enter alphabetic characters only."
-                else:
-                    response = "CON Enter Date of Birth (DDMMYYYY)"
-            elif len(inputs) == 3:
-                if not validate_date_of_birth(inputs[2]):
-                    response = "END Invalid Date of Birth. Format must be DDMMYYYY and a valid date."
-                else:
-                    response = "CON Select Sex:\n1. Male\n2. Female"
-            elif len(inputs) == 4:
-                if not validate_sex_selection(inputs[3]):
-                    response = "END Invalid selection for sex. Please restart."
-                else:
-                    region_menu = "\n".join([f"{key}. {REGIONS_DISTRICTS[key]['name']}" for key in REGIONS_DISTRICTS])
-                    response = f"CON Select Region of Birth:\n{region_menu}"
-            elif len(inputs) == 5:
-                region_selection = inputs[4]
-                if region_selection not in REGIONS_DISTRICTS:
-                    response = "END Invalid region selection. Please restart."
-                else:
-                    districts = REGIONS_DISTRICTS[region_selection]["districts"]
-                    district_menu = "\n".join([f"{i+1}. {d['name']}" for i, d in enumerate(districts)])
-                    response = f"CON Select District:\n{district_menu}"
-            elif len(inputs) == 6:
-                region_selection = inputs[4]
-                if region_selection not in REGIONS_DISTRICTS:
-                     response = "END Session error. Invalid region. Please restart."
-                else:
-                    districts = REGIONS_DISTRICTS[region_selection]["districts"]
-                    try:
-                        district_index = int(inputs[5]) - 1
-                        if not (0 <= district_index < len(districts)): raise ValueError
-                        response = "CON Enter Mother's Ghana Card Number (e.g. GHA-123456789-0)"
-                    except (ValueError, IndexError):
-                        response = "END Invalid district selection. Please restart."
-            elif len(inputs) == 7:
-                if not validate_nin(inputs[6]):
-                    response = "END Invalid Mother's Ghana Card Number. Please restart."
-                else:
-                    response = "CON Enter Father's Ghana Card Number (or enter 0 to skip)"
-            elif len(inputs) == 8:
-                if not validate_optional_nin(inputs[7]):
-                    response = "END Invalid Father's Ghana Card Number. Please restart."
-                else:
-                    child_name_raw, dob_raw, sex_code, region_sel, district_sel, mother_nin, father_nin_raw = inputs[1:8]
-                    child_name = "N/A" if child_name_raw == '0' else child_name_raw
-                    dob_display = f"{dob_raw[:2]}/{dob_raw[2:4]}/{dob_raw[4:]}"
-                    sex_display = "Male" if sex_code == '1' else "Female"
-                    region_name = REGIONS_DISTRICTS[region_sel]['name']
-                    district_name = REGIONS_DISTRICTS[region_sel]['districts'][int(district_sel)-1]['name']
-                    father_nin = "N/A" if father_nin_raw == '0' else father_nin_raw
-
-                    summary = (f"Confirm Details:\nName: {child_name}\nDOB: {dob_display}\nSex: {sex_display}\n"
-                               f"Region: {region_name}\nDistrict: {district_name}\nMother NIN: {mother_nin}\n"
-                               f"Father NIN: {father_nin}\n\n1. Confirm & Submit\n2. Cancel")
-                    response = f"CON {summary}"
-            elif len(inputs) == 9:
-                if inputs[8] == '1':
-                    region_code = REGIONS_DISTRICTS[inputs[4]]['code']
-                    district_code = REGIONS_DISTRICTS[inputs[4]]['districts'][int(inputs[5])-1]['code']
-                    details = {
-                        "baby_name": "N/A" if inputs[1] == '0' else inputs[1],
-                        "dob": f"{inputs[2][:2]}/{inputs[2][2:4]}/{inputs[2][4:]}",
-                        "sex": "Male" if inputs[3] == '1' else "Female",
-                        "region_code": region_code, "district_code": district_code,
-                        "mother_nin": inputs[6],
-                        "father_nin": "N/A" if inputs[7] == '0' else inputs[7],
-                        "status": "Provisionally Registered"
-                    }
-                    ubrn = save_registration(details)
-                    sms_message = (f"Congratulations! The birth of your child is provisionally registered. "
-                                   f"Your Unique Birth Registration Number is {ubrn}. Keep this safe.")
-                    send_sms(phone_number, sms_message)
-                    response = "END Thank you! You will receive an SMS with the UBRN shortly."
-                else:
-                    response = "END Registration cancelled. Thank you."
-        
-        # ================== VERIFICATION FLOW (Option 2) ==================
-        elif inputs[0] == "2":
-            if len(inputs) == 1:
-                response = "CON Please enter the complete UBRN to verify (e.g., GHA-01-027-25213-0001-5)."
-            elif len(inputs) == 2:
-                ubrn_to_check = inputs[1].strip()
-                if not validate_ubrn(ubrn_to_check):
-                    response = "END Invalid UBRN format. Please dial code to start again."
-                else:
-                    record = find_registration_by_ubrn(ubrn_to_check)
-                    if record:
-                        summary = f"Registration Found:\nName: {record['baby_name']}\nDOB: {record['dob']}\nStatus: {record['status']}"
-                        logging.info(f"VERIFICATION: Found record for UBRN '{ubrn_to_check}'.")
-                        response = f"END {summary}"
-                    else:
-                        logging.warning(f"VERIFICATION: No record found for UBRN '{ubrn_to_check}'.")
-                        response = "END Registration Not Found. Please check the UBRN and try again."
-
-        else:
-            response = "END Invalid option. Please restart the process."
+        limit = min(int(request.args.get("limit", name_search.SEARCH_LIMIT)), name_search.SEARCH_MAX_LIMIT)
+    except ValueError:
+        return "Invalid limit", 400
+    started = time.perf_counter()
+    results = name_search.search(name, limit)
+    metrics.STORAGE_LATENCY.observe(time.perf_counter() - started, ("name_search",))
+    return jsonify({"query": name, "count": len(results), "results": results})
 
-        # Log the response being sent back to the USSD gateway
-        logging.info(f"Response sent - SessionID: {session_id}, Phone: {phone_number}, Response: '{response}'")
-        return response
 
-    except Exception as e:
-        # Log the full exception traceback for debugging
-        logging.error(f"FATAL ERROR in USSD callback for SessionID {session_id}: {e}", exc_info=True)
-        # Provide a generic error to the user
-        return "END A system error occurred. Please try again later."
+# --- Admin: Session Traces ---
+
+@app.route('/admin/traces', methods=['GET'])
+@require_admin
+def admin_traces():
+    """Summaries of the most recently active sessions (?limit=N, default 50)."""
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return "Invalid limit", 400
+    return jsonify({"sessions": tracing.store.recent(limit)})
+
+@app.route('/admin/traces/<session_id>', methods=['GET'])
+@require_admin
+def admin_trace(session_id):
+    """Hop-by-hop timeline for one session."""
+    trace = tracing.store.get(session_id)
+    if trace is None:
+        return "Session not found", 404
+    return jsonify(trace)
+
+
+# --- Admin: Slow Hops ---
+
+@app.route('/admin/slow-hops', methods=['GET'])
+@require_admin
+def admin_slow_hops():
+    """Most recent hops that exceeded their step's latency budget (?limit=N, default 50)."""
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return "Invalid limit", 400
+    detector = slow_hops.detector
+    return jsonify({
+        "default_budget_ms": detector.default_budget * 1000,
+        "budgets_ms": {step: budget * 1000 for step, budget in detector.budgets.items()},
+        "hops": detector.recent(limit),
+    })
+
+
+# --- Admin: Reference Data ---
+
+@app.route('/admin/reference-data', methods=['GET'])
+@require_admin
+def admin_reference_data():
+    """The current region and district data version, and the versions sessions are still pinned to."""
+    return jsonify(reference_data.store.status())
+
+@app.route('/admin/reference-data/reload', methods=['POST'])
+@require_admin
+def admin_reference_data_reload():
+    """Reloads the data file in this worker now, instead of at the next check; new sessions get it at once."""
+    try:
+        reference_data.store.reload()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        flow_log.error("REFERENCE DATA: Reload requested by an admin failed: %s", e)
+        return f"Cannot load {reference_data.store.path}: {e}", 400
+    return jsonify(reference_data.store.status())
+
+
+# --- Admin: Profiler ---
+
+@app.route('/admin/profile', methods=['POST'])
+@require_admin
+def admin_profile_start():
+    """Profiles /callback for the next ?requests=N calls or ?seconds=T (default 60s)."""
+    try:
+        max_requests = int(request.args["requests"]) if "requests" in request.args else None
+        max_seconds = float(request.args.get("seconds", 60))
+    except ValueError:
+        return "Invalid requests or seconds", 400
+    try:
+        session = profiler.start(app.view_functions, "ussd_callback", max_requests, max_seconds)
+    except RuntimeError as e:
+        return str(e), 409
+    return jsonify(session.status())
+
+@app.route('/admin/profile/stop', methods=['POST'])
+@require_admin
+def admin_profile_stop():
+    session = profiler.stop()
+    if session is None:
+        return "No profile has been started", 404
+    return jsonify(session.status())
+
+@app.route('/admin/profile', methods=['GET'])
+@require_admin
+def admin_profile_status():
+    session = profiler.current()
+    if session is None:
+        return "No profile has been started", 404
+    return jsonify(session.status())
+
+@app.route('/admin/profile/stats', methods=['GET'])
+@require_admin
+def admin_profile_stats():
+    """Top functions by cumulative time (?sort=tottime and ?limit=N also accepted)."""
+    session = profiler.current()
+    if session is None:
+        return "No profile has been started", 404
+    try:
+        limit = int(request.args.get("limit", 40))
+    except ValueError:
+        return "Invalid limit", 400
+    report = session.top_functions(limit, request.args.get("sort", "cumulative"))
+    return report, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.route('/admin/profile/collapsed', methods=['GET'])
+@require_admin
+def admin_profile_collapsed():
+    """Sampled stacks in collapsed format, ready for flamegraph.pl or speedscope."""
+    session = profiler.current()
+    if session is None:
+        return "No profile has been started", 404
+    return session.collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+# --- Bulk Registration ---
+
+JSONL_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-lines")
+
+@app.route('/registrations/bulk', methods=['POST'])
+@require_facility
+def bulk_registrations(facility):
+    """Registers a CSV (or JSON Lines) upload of births, streaming back each row's UBRN or errors as JSON lines."""
+    upload_format = bulk_upload.JSONL_FORMAT if request.mimetype in JSONL_CONTENT_TYPES else bulk_upload.CSV_FORMAT
+    try:
+        chunks = bulk_upload.open_upload(bulk_upload.text_stream(request.stream), upload_format)
+    except ValueError as e:
+        return f"Cannot read upload: {e}", 400
+    flow_log.info("BULK: Facility %s started a %s upload.", facility, upload_format)
+    # The whole upload is checked against one version of the district list.
+    district_codes = reference_data.store.current.district_codes
+
+    def results():
+        for chunk in bulk_upload.process_upload(chunks, district_codes, save_registrations):
+            yield "".join(json.dumps(result, separators=(",", ":")) + "\n" for result in chunk)
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+
+# --- SMS Delivery Reports ---
+
+@app.route('/sms/delivery', methods=['POST'])
+def sms_delivery_report():
+    """Receives a delivery report from the SMS gateway.
+
+    Reports are only queued here; a background thread matches them to the
+    outbox so that bursts of reports never compete with USSD callbacks.
+    """
+    if not delivery_report_allowed(): abort(403)
+    message_id = request.form.get("id")
+    status = request.form.get("status")
+    if not message_id or not status:
+        return "Missing id or status", 400
+    try:
+        retry_count = int(request.form.get("retryCount", 0))
+    except ValueError:
+        retry_count = 0
+    if not ingestor.submit(message_id, status, request.form.get("failureReason"), retry_count):
+        # Queue is full: ask the gateway to retry later rather than block.
+        return "Busy", 503
+    return "", 200
+
+@app.route('/sms/undelivered', methods=['GET'])
+@require_admin
+def sms_undelivered():
+    """Lists messages from the last N hours (default 24) that have not been delivered."""
+    try:
+        hours = float(request.args.get("hours", 24))
+    except ValueError:
+        return "Invalid hours", 400
+    messages = outbox.undelivered_since(time.time() - hours * 3600)
+    return jsonify({"hours": hours, "count": len(messages), "messages": messages})
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
+    # Development server only. In production run the pre-fork server instead:
+    #   gunicorn -c gunicorn.conf.py wsgi:application
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8000)), debug=os.environ.get("FLASK_DEBUG") == "1")
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""Asyncio (ASGI) server for the USSD callback.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+Serves POST /callback and GET /metrics. The menu flow, validators and
+instrumentation are the ones in app.py; only the I/O differs. SMS goes out
+through the asyncio gateway client, and storage calls run on a small thread
+pool (SQLite has no asyncio driver), so a slow gateway or database holds up
+only the sessions waiting on it rather than a whole worker. Admin and SMS
+delivery routes stay on the WSGI app.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import app as ussd
+import metrics
+import nin_verification
+import slow_hops
+import sms_gateway
+
+ASGI_STORAGE_THREADS = int(os.environ.get("ASGI_STORAGE_THREADS", "16"))
+MAX_BODY_BYTES = 16 * 1024
+
+_storage_pool = ThreadPoolExecutor(ASGI_STORAGE_THREADS, thread_name_prefix="storage")
+
+# Hops share the event-loop thread, so a stack taken at a hop's deadline would
+# be another hop's. Slow hops are still captured, without the stack.
+slow_hops.detector.capture_stacks = False
+
+
+async def run_storage(fn, *args):
+    """Runs a blocking storage call on the storage pool, keeping the hop's trace context."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _storage_pool, functools.partial(context.run, fn, *args))
+
+
+async def send_sms_async(phone_number, message):
+    started = time.perf_counter()
+    try:
+        message_id, status = await sms_gateway.send_async(phone_number, message), ussd.PENDING_STATUS
+    except sms_gateway.SmsGatewayError as e:
+        ussd.sms_log.error("SMS GATEWAY: Sending failed: %s", e, extra={"phone": phone_number})
+        message_id, status = sms_gateway.local_message_id(), ussd.FAILED_STATUS
+    return await run_storage(ussd.record_sent_sms, phone_number, message, message_id, status, started)
+
+
+async def send_registration_sms_async(phone_number, ubrn):
+    # As app.send_registration_sms(): the registration is saved, so failures are only logged.
+    try:
+        await send_sms_async(phone_number, ussd.registration_sms(ubrn))
+    except Exception as e:
+        ussd.sms_log.error("SMS GATEWAY: Registration %s saved but its SMS failed: %s", ubrn, e,
+                           exc_info=e, extra={"phone": phone_number})
+
+
+async def handle_ussd_async(session_id, phone_number, text):
+    """Asyncio version of app.handle_ussd()."""
+    hop = ussd.Hop(session_id, phone_number, text)
+    try:
+        rejected = hop.shed_if_busy() or await run_storage(hop.throttled)
+        if rejected is not None: return rejected
+        await run_storage(hop.pin_reference)
+        response, effect = ussd.render_hop(hop.text, hop.inputs, hop.menu_page, hop.reference)
+        if effect is not None:
+            kind, argument = effect
+            if kind == ussd.PREFETCH_MOTHER_NIN:
+                nin, response = argument
+                nin_verification.verifier.prefetch(nin)
+            elif kind == ussd.SUBMIT_REGISTRATION:
+                outcome = await nin_verification.verifier.check_async(argument["mother_nin"])
+                response = ussd.mother_nin_response(outcome, session_id)
+                if response is None:
+                    key, response = await run_storage(ussd.begin_submission, session_id, hop.text)
+                if response is None:
+                    ubrn = None
+                    try:
+                        response = await run_storage(ussd.check_duplicate, argument)
+                        if response is None:
+                            ubrn = await run_storage(ussd.save_registration, argument)
+                            response = ussd.SUBMITTED_RESPONSE
+                    except Exception:
+                        await run_storage(ussd.end_submission, key, None)
+                        raise
+                    await run_storage(ussd.end_submission, key, response)
+                    if ubrn is not None:
+                        await send_registration_sms_async(phone_number, ubrn)
+            else:
+                record = await run_storage(ussd.find_registration_by_ubrn, argument)
+                response = ussd.verification_response(argument, record)
+        return hop.finish(response)
+    except Exception as e:
+        return hop.fail(e)
+    finally:
+        await run_storage(hop.release_reference)
+
+
+# --- ASGI Plumbing ---
+
+async def _read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, body, content_type=b"text/plain; charset=utf-8"):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            metrics.start_flusher()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _storage_pool.shutdown(wait=False)
+            metrics.write_snapshot()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/callback" and method == "POST":
+        body = await _read_body(receive)
+        if body is None:
+            return await _respond(send, 413, b"Request body too large")
+        # Like Flask's request.values: the query string takes precedence over the
+        # form body, and the first of repeated values is used.
+        pairs = (urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1"))
+                 + urllib.parse.parse_qsl(body.decode("utf-8", "replace")))
+        values = dict(reversed(pairs))
+        response = await handle_ussd_async(values.get("sessionId"), values.get("phoneNumber"), values.get("text", ""))
+        return await _respond(send, 200, response.encode())
+    if path == "/metrics" and method == "GET":
+        text = await asyncio.to_thread(metrics.render)
+        return await _respond(send, 200, text.encode(), metrics.CONTENT_TYPE.encode())
+    await _respond(send, 404, b"Not found")
@@ -0,0 +1,117 @@
+import asyncio
+import ssl
+import urllib.parse
+from collections import defaultdict, deque
+
+# --- Minimal asyncio HTTP/1.1 Client ---
+# Just enough HTTP for calling the SMS and identity APIs from the asyncio
+# server without extra dependencies: one request per call, keep-alive
+# connections pooled per host, Content-Length and chunked responses. An
+# idempotent request on a pooled connection the server has meanwhile closed
+# is retried once on a new connection. Other methods are not: the server may
+# have read the request before closing (e.g. an SMS the gateway accepted).
+
+MAX_IDLE_PER_HOST = 32
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+_idle = defaultdict(deque)
+_ssl_context = None
+
+
+class HttpError(Exception):
+    pass
+
+
+class _ClosedBeforeResponse(ConnectionError):
+    # The connection failed before any of the response arrived.
+    pass
+
+
+def _context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+async def _connect(host, port, use_ssl, reuse=True):
+    # Returns (reader, writer, reused).
+    pool = _idle[(host, port, use_ssl)]
+    while reuse and pool:
+        reader, writer = pool.pop()
+        if not writer.is_closing() and not reader.at_eof():
+            return reader, writer, True
+        writer.close()
+    reader, writer = await asyncio.open_connection(host, port, ssl=_context() if use_ssl else None)
+    return reader, writer, False
+
+
+async def _read_body(reader, headers):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip(), 16)
+            if size == 0:
+                await reader.readline()
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"]))
+    return await reader.read()
+
+
+async def _exchange(reader, writer, raw, timeout):
+    writer.write(raw)
+    try:
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+    except ConnectionError as e:
+        raise _ClosedBeforeResponse(e) from e
+    if not status_line:
+        raise _ClosedBeforeResponse("Connection closed before response")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b"\r\n", b"\n", b""): break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await asyncio.wait_for(_read_body(reader, headers), timeout)
+    return status, headers, body
+
+
+async def request(method, url, body=b"", headers=None, timeout=5.0):
+    """Sends one request and returns (status, headers, body). Raises HttpError on transport errors."""
+    parts = urllib.parse.urlsplit(url)
+    use_ssl = parts.scheme == "https"
+    host = parts.hostname
+    port = parts.port or (443 if use_ssl else 80)
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}", f"Content-Length: {len(body)}"]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    raw = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+    for attempt in range(2):
+        writer = None
+        try:
+            reader, writer, reused = await asyncio.wait_for(_connect(host, port, use_ssl, reuse=attempt == 0), timeout)
+            status, response_headers, response_body = await _exchange(reader, writer, raw, timeout)
+        except BaseException as e:
+            # Failed, timed out or cancelled part way: the connection cannot be used again.
+            if writer is not None:
+                writer.close()
+            if isinstance(e, _ClosedBeforeResponse) and reused and method in IDEMPOTENT_METHODS:
+                continue  # the server closed the idle connection as it was reused
+            if isinstance(e, (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError)):
+                raise HttpError(f"{method} {url} failed: {e!r}") from e
+            raise
+        break
+
+    pool = _idle[(host, port, use_ssl)]
+    if response_headers.get("connection", "").lower() != "close" and len(pool) < MAX_IDLE_PER_HOST:
+        pool.append((reader, writer))
+    else:
+        writer.close()
+    return status, response_headers, response_body
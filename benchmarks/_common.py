@@ -0,0 +1,61 @@
+"""Shared helpers for the benchmark scripts in this directory."""
+import os
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# A complete parent registration, one entry per USSD hop.
+REGISTRATION_HOPS = [
+    "",
+    "1",
+    "1*Kwame Mensah",
+    "1*Kwame Mensah*15032024",
+    "1*Kwame Mensah*15032024*1",
+    "1*Kwame Mensah*15032024*1*1",
+    "1*Kwame Mensah*15032024*1*1*1",
+    "1*Kwame Mensah*15032024*1*1*1*GHA-123456789-0",
+    "1*Kwame Mensah*15032024*1*1*1*GHA-123456789-0*0",
+    "1*Kwame Mensah*15032024*1*1*1*GHA-123456789-0*0*1",
+]
+
+
+def post_hops(client, hops=REGISTRATION_HOPS, session_id="bench-session", phone_number="+233200000000"):
+    """Posts every hop of a session through a Flask/Werkzeug test client."""
+    for text in hops:
+        client.post("/callback", data={"sessionId": session_id, "phoneNumber": phone_number, "text": text})
+
+
+def time_per_call(fn, iterations):
+    """Returns the mean wall time of fn() in microseconds."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values: return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on port {port}")
@@ -0,0 +1,126 @@
+"""Compares concurrency and tail latency of the WSGI and ASGI servers.
+
+    python benchmarks/bench_asgi.py [--sessions 500] [--seconds 15] [--sms-delay-ms 300]
+
+Starts a fake SMS gateway that answers after --sms-delay-ms, then runs each
+server against it: gunicorn (wsgi:application) and uvicorn (asgi:application),
+with the same number of worker processes. --sessions virtual subscribers
+walk complete registrations at the same time over keep-alive connections.
+Reports throughput, errors and p50/p95/p99 latency for each. Needs gunicorn
+and uvicorn installed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from _common import REGISTRATION_HOPS, ROOT, free_port, percentile, wait_for_port
+
+import async_http
+
+
+async def fake_sms_gateway(port, delay):
+    """Answers every request like Africa's Talking's messaging API, after `delay` seconds."""
+    counter = 0
+
+    async def handle(reader, writer):
+        nonlocal counter
+        try:
+            while True:
+                length = 0
+                line = await reader.readline()
+                if not line: break
+                while line not in (b"\r\n", b""):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                    line = await reader.readline()
+                await reader.readexactly(length)
+                await asyncio.sleep(delay)
+                counter += 1
+                body = json.dumps({"SMSMessageData": {"Recipients": [{"messageId": f"ATXid_fake{counter}", "status": "Success"}]}}).encode()
+                writer.write(b"HTTP/1.1 201 Created\r\nContent-Type: application/json\r\nContent-Length: "
+                             + str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", port)
+
+
+async def subscriber(port, stop_at, latencies, errors, index):
+    url = f"http://127.0.0.1:{port}/callback"
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    session = 0
+    while time.monotonic() < stop_at:
+        session += 1
+        for text in REGISTRATION_HOPS:
+            body = urllib.parse.urlencode({"sessionId": f"b{index}-{session}", "phoneNumber": f"+23320{index:07d}", "text": text}).encode()
+            started = time.perf_counter()
+            try:
+                status, _, _ = await async_http.request("POST", url, body, headers, timeout=30)
+                if status != 200:
+                    errors.append(status)
+                    break
+            except async_http.HttpError as e:
+                errors.append(type(e).__name__)
+                break
+            latencies.append(time.perf_counter() - started)
+
+
+def server_command(name, port, workers, threads):
+    if name == "wsgi":
+        return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:application"], {"WEB_CONCURRENCY": str(workers), "THREADS_PER_WORKER": str(threads)}
+    return [sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port), "--workers", str(workers), "--log-level", "warning"], {}
+
+
+async def bench(name, args, gateway_port):
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="bench-asgi-")
+    command, extra_env = server_command(name, port, args.workers, args.threads)
+    env = dict(os.environ, PORT=str(port), STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(workdir, "bench.db"),
+               METRICS_DIR=os.path.join(workdir, "metrics"), ACCESS_LOG_SAMPLE_RATE="0", LOG_LEVEL="WARNING",
+               SMS_GATEWAY_URL=f"http://127.0.0.1:{gateway_port}/version1/messaging", **extra_env)
+    proc = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await asyncio.to_thread(wait_for_port, port)
+        latencies, errors = [], []
+        started = time.monotonic()
+        await asyncio.gather(*(subscriber(port, started + args.seconds, latencies, errors, i) for i in range(args.sessions)))
+        elapsed = time.monotonic() - started
+    finally:
+        proc.terminate()
+        await asyncio.to_thread(proc.wait, 30)
+    latencies.sort()
+    return name, len(latencies), len(errors), len(latencies) / elapsed, [percentile(latencies, p) * 1000 for p in (50, 95, 99)]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=500, help="concurrent virtual subscribers")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument("--sms-delay-ms", type=float, default=300)
+    parser.add_argument("--servers", default="wsgi,asgi")
+    args = parser.parse_args()
+    async_http.MAX_IDLE_PER_HOST = args.sessions
+
+    gateway_port = free_port()
+    gateway = await fake_sms_gateway(gateway_port, args.sms_delay_ms / 1000)
+    print(f"{args.sessions} concurrent sessions, {args.workers} workers, SMS gateway delay {args.sms_delay_ms:g} ms")
+    print(f"{'server':<8}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in args.servers.split(","):
+        name, count, errors, rps, (p50, p95, p99) = await bench(name, args, gateway_port)
+        print(f"{name:<8}{count:>10}{errors:>8}{rps:>9.0f}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+    gateway.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
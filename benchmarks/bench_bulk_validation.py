@@ -0,0 +1,115 @@
+"""Times validation of a bulk registration file with and without NumPy.
+
+    python benchmarks/bench_bulk_validation.py [--rows 1000000] [--bad 0.02] [--chunk-rows 100000]
+
+Writes a synthetic CSV in the bulk upload format (see bulk_validation.py) in
+which about --bad of the rows have a mistake, including unusual spellings the
+array checks leave to the row-by-row rules. It then validates the file with
+the NumPy engine, if NumPy is installed, and with the pure-Python engine. It
+reports the time for each, split into reading the CSV and validating, and
+exits with status 1 if the two error reports differ.
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+import _common  # noqa: F401  (puts the project root on sys.path)
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import bulk_validation
+import reference_data
+
+FIRST_NAMES = ["Kwame", "Ama", "Kofi", "Akosua", "Yaw", "Abena", "Kojo", "Efua", "Esi", "Nana"]
+LAST_NAMES = ["Mensah", "Owusu", "Boateng", "Asante", "Osei", "Addo", "Appiah", "Ofori", "Agyeman", "Darko"]
+MISTAKES = {
+    "baby_name": ["K", "Kofi2", "Ama_Mensah", " Yaw Osei ", "A" * 60],
+    "dob": ["31022024", "15/13/2023", "1503199", "01011990", "15.03.2024", "١٥٠٣٢٠٢٤"],
+    "sex": ["3", "Mal", "FEMALE", "x", ""],
+    "region_code": ["1", "99", "01 "],
+    "district_code": ["27", "999", "O27"],
+    "mother_nin": ["GHA-12345678-0", "gha-123456789-x", "GHA 123456789 0", "", "0"],
+    "father_nin": ["GHA-1234567890-0", "x", "gha-987654321-0"],
+}
+
+
+def write_file(path, rows, bad, seed=42):
+    rng = random.Random(seed)
+    districts = sorted(reference_data.store.current.district_codes)
+    today = datetime.date.today()
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(bulk_validation.BULK_COLUMNS)
+        for _ in range(rows):
+            region_code, district_code = rng.choice(districts)
+            dob = today - datetime.timedelta(days=rng.randrange(3000))
+            row = {
+                "baby_name": rng.choice([f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", "0", ""]),
+                "dob": dob.strftime(rng.choice(["%d%m%Y", "%d/%m/%Y"])),
+                "sex": rng.choice(["1", "2", "M", "F", "Male", "Female"]),
+                "region_code": region_code, "district_code": district_code,
+                "mother_nin": f"GHA-{rng.randrange(10 ** 9):09d}-{rng.choice('0123456789X')}",
+                "father_nin": rng.choice(["", "0", f"GHA-{rng.randrange(10 ** 9):09d}-{rng.randrange(10)}"]),
+            }
+            if rng.random() < bad:
+                field = rng.choice(list(MISTAKES))
+                row[field] = rng.choice(MISTAKES[field])
+            writer.writerow(row[name] for name in bulk_validation.BULK_COLUMNS)
+
+
+def run(path, use_numpy, chunk_rows):
+    read_seconds = check_seconds = 0.0
+    count, errors = 0, []
+    with open(path, newline="") as f:
+        chunks = bulk_validation.read_chunks(f, chunk_rows)
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            read_seconds += time.perf_counter() - started
+            if chunk is None: break
+            rows, columns, malformed = chunk
+            started = time.perf_counter()
+            checks = bulk_validation.validate_columns(columns, reference_data.store.current.district_codes, use_numpy)
+            errors.extend(bulk_validation.row_errors(rows, checks, malformed))
+            check_seconds += time.perf_counter() - started
+            count += len(rows)
+    return count, errors, read_seconds, check_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--bad", type=float, default=0.02, help="fraction of rows with a mistake")
+    parser.add_argument("--chunk-rows", type=int, default=bulk_validation.BULK_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-bulk-"), "births.csv")
+    write_file(path, args.rows, args.bad)
+    print(f"{args.rows:,} rows, {os.path.getsize(path) / 2 ** 20:.0f} MiB")
+
+    engines = [("python", False)]
+    if bulk_validation.np is not None:
+        engines.insert(0, ("numpy", True))
+    else:
+        print("NumPy is not installed; only the pure-Python engine runs.")
+    reports = {}
+    print(f"{'engine':<8}{'read s':>9}{'validate s':>12}{'total s':>9}{'rows/s':>12}{'invalid':>9}")
+    for name, use_numpy in engines:
+        rows, errors, read_seconds, check_seconds = run(path, use_numpy, args.chunk_rows)
+        total = read_seconds + check_seconds
+        reports[name] = errors
+        print(f"{name:<8}{read_seconds:>9.2f}{check_seconds:>12.2f}{total:>9.2f}{rows / total:>12,.0f}{len(errors):>9,}")
+    os.remove(path)
+
+    if len(reports) == 2 and reports["numpy"] != reports["python"]:
+        print("The NumPy and pure-Python engines disagree.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
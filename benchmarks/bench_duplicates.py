@@ -0,0 +1,126 @@
+"""Times the duplicate-birth check against a growing registration store.
+
+    python benchmarks/bench_duplicates.py [--scales 10000,100000,1000000] [--checks 2000] [--backends memory,sqlite]
+
+For each backend and each --scales size, loads that many synthetic
+registrations (mothers with one to three children), then runs --checks
+duplicate checks the way the confirm hop does: half are re-registrations of
+an existing child (the name's words swapped, a one-letter typo, or the date of
+birth a day out) and half are new births, some of them a sibling of an
+existing child. Reports the check's p50/p99 latency, which should stay flat
+as the store grows, the share of re-registrations caught and the share of new
+births wrongly flagged.
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+from _common import percentile
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import duplicates
+import storage
+
+FIRST_NAMES = ["Kwame", "Ama", "Kofi", "Akosua", "Yaw", "Abena", "Kojo", "Efua", "Esi", "Nana", "Kwabena",
+               "Adwoa", "Kwaku", "Akua", "Kwesi", "Afua", "Fiifi", "Araba", "Ekow", "Aba"]
+LAST_NAMES = ["Mensah", "Owusu", "Boateng", "Asante", "Osei", "Addo", "Appiah", "Ofori", "Agyeman", "Darko",
+              "Amoah", "Badu", "Quaye", "Tetteh", "Nkrumah", "Acheampong", "Frimpong", "Sarpong", "Annan", "Donkor"]
+BATCH = 10000
+
+
+def random_dob(rng):
+    return (datetime.date.today() - datetime.timedelta(days=rng.randrange(3650))).strftime(duplicates.DOB_FORMAT)
+
+
+def random_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def misspell(rng, name):
+    i = rng.randrange(1, len(name))
+    return name[:i] + rng.choice("aeiou") + name[i + 1:]
+
+
+def re_registration(rng, record):
+    details = dict(record)
+    change = rng.randrange(3)
+    if change == 0:
+        details["baby_name"] = " ".join(reversed(record["baby_name"].split()))
+    elif change == 1:
+        details["baby_name"] = misspell(rng, record["baby_name"])
+    else:
+        day = datetime.datetime.strptime(record["dob"], duplicates.DOB_FORMAT)
+        details["dob"] = (day + datetime.timedelta(days=rng.choice((-1, 1)))).strftime(duplicates.DOB_FORMAT)
+    return details
+
+
+def load(db, count, rng):
+    """Adds registrations up to `count` and returns a sample of them."""
+    sample, batch, mother = [], [], None
+    total = db.count_registrations()
+    while total < count:
+        if mother is None or rng.random() < 0.6:
+            mother = f"GHA-{rng.randrange(10 ** 9):09d}-{rng.randrange(10)}"
+        details = {"ubrn": f"BENCH-{total}", "baby_name": random_name(rng), "dob": random_dob(rng), "sex": "Male",
+                   "region_code": "01", "district_code": "027", "mother_nin": mother, "father_nin": "N/A",
+                   "status": "Provisionally Registered"}
+        batch.append(details)
+        if rng.random() < 0.01:
+            sample.append(details)
+        total += 1
+        if len(batch) == BATCH or total == count:
+            with db.transaction():
+                db.insert_registrations(batch)
+            batch = []
+    return sample
+
+
+def run_checks(db, sample, checks, rng):
+    times, caught, false_flags = [], 0, 0
+    for i in range(checks):
+        if i % 2 == 0:
+            details = re_registration(rng, rng.choice(sample))
+        else:
+            mother = rng.choice(sample)["mother_nin"] if rng.random() < 0.3 else f"GHA-{rng.randrange(10 ** 9):09d}-0"
+            details = {"baby_name": random_name(rng), "dob": random_dob(rng), "mother_nin": mother}
+        started = time.perf_counter()
+        match = duplicates.find_duplicate(db, details)
+        times.append(time.perf_counter() - started)
+        if i % 2 == 0:
+            caught += match is not None
+        else:
+            false_flags += match is not None
+    times.sort()
+    half = checks / 2
+    return percentile(times, 50), percentile(times, 99), caught / half, false_flags / half
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default="10000,100000,1000000")
+    parser.add_argument("--checks", type=int, default=2000)
+    parser.add_argument("--backends", default="memory,sqlite")
+    args = parser.parse_args()
+
+    print(f"{'backend':<8}{'records':>10}{'p50 us':>9}{'p99 us':>9}{'caught':>8}{'false':>8}")
+    for backend in args.backends.split(","):
+        rng = random.Random(11)
+        if backend == "sqlite":
+            db = storage.SqliteStorage(os.path.join(tempfile.mkdtemp(prefix="bench-dup-"), "ebirth.db"))
+        else:
+            db = storage.MemoryStorage()
+        sample = []
+        for scale in sorted(int(s) for s in args.scales.split(",")):
+            sample.extend(load(db, scale, rng))
+            p50, p99, caught, false_flags = run_checks(db, sample, args.checks, rng)
+            print(f"{backend:<8}{scale:>10,}{p50 * 1e6:>9.1f}{p99 * 1e6:>9.1f}{caught:>8.1%}{false_flags:>8.1%}")
+        if backend == "sqlite":
+            os.remove(db.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Measures log formatter throughput, including PII redaction.
+
+    python benchmarks/bench_log_format.py [--records 100000]
+
+Formats a mix of realistic records (access lines, saved registrations with
+Ghana Card numbers and UBRNs, plain messages) with the plain formatter, the
+redacting text formatter and the JSON formatter, and reports records/second.
+"""
+import argparse
+import logging
+import time
+
+import _common  # noqa: F401  (puts the project root on sys.path)
+
+import log_config
+
+
+def make_records():
+    details = {
+        "baby_name": "Kwame Mensah", "dob": "15/03/2024", "sex": "Male", "region_code": "01",
+        "district_code": "027", "mother_nin": "GHA-123456789-0", "father_nin": "GHA-987654321-X",
+        "status": "Provisionally Registered", "ubrn": "GHA-01-027-24075-0042-7",
+    }
+    context = {"session": "ATUid_4f2a9c", "phone": "+233244000111", "step": "register.confirm", "latency_ms": 1.734}
+    specs = [
+        ("ussd.access", logging.INFO, "Request received - SessionID: %s, Step: %s", ("ATUid_4f2a9c", "register.dob"), context),
+        ("ussd.access", logging.INFO, "Response sent - SessionID: %s, Step: %s, Bytes: %d", ("ATUid_4f2a9c", "register.dob", 61), context),
+        ("ussd.db", logging.INFO, "DATABASE: Record %s details: %s", (details["ubrn"], details), {}),
+        ("ussd.flow", logging.INFO, "VERIFICATION: Found record for UBRN '%s'.", (details["ubrn"],), context),
+        ("ussd.sms", logging.INFO, "SMS GATEWAY: Sending SMS %s to %s.", ("ATXid_0d1e", "+233244000111"), {}),
+    ]
+    records = []
+    for name, level, msg, args, extra in specs:
+        record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        records.append(record)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+
+    records = make_records()
+    formatters = [
+        ("plain text (no redaction)", logging.Formatter(log_config.LOG_FORMAT, datefmt=log_config.LOG_DATEFMT)),
+        ("redacting text", log_config.make_formatter(json_format=False)),
+        ("json + redaction", log_config.make_formatter(json_format=True)),
+    ]
+    print(f"{'formatter':<28}{'records/s':>12}{'us/record':>12}")
+    for name, formatter in formatters:
+        rounds = max(1, args.records // len(records))
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for record in records:
+                formatter.format(record)
+        elapsed = time.perf_counter() - start
+        count = rounds * len(records)
+        print(f"{name:<28}{count / elapsed:>12,.0f}{elapsed / count * 1e6:>12.2f}")
+
+    print("\nSample JSON line:")
+    print(log_config.make_formatter(json_format=True).format(records[2]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Measures the per-hop cost of logging on the /callback path.
+
+    python benchmarks/bench_logging.py [--sessions 300]
+
+Compares logging disabled, the old synchronous stream handler logging every
+request, and the queue pipeline with and without access-log sampling. Output
+goes to os.devnull so only the logging machinery itself is measured.
+"""
+import argparse
+import logging
+import os
+
+from _common import REGISTRATION_HOPS, post_hops, time_per_call
+
+import app
+import log_config
+
+
+def use_sync_handler(stream):
+    # Equivalent of the previous logging.basicConfig setup.
+    log_config.stop_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(log_config.LOG_FORMAT, datefmt=log_config.LOG_DATEFMT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    log_config._sample_rate = 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=300)
+    args = parser.parse_args()
+
+    client = app.app.test_client()
+    devnull = open(os.devnull, "w")
+    hops = len(REGISTRATION_HOPS)
+    modes = [
+        ("off", lambda: logging.disable(logging.CRITICAL)),
+        ("sync, every request", lambda: use_sync_handler(devnull)),
+        ("queue, every request", lambda: log_config.setup_logging(stream=devnull, sample_rate=1.0)),
+        (f"queue, sampled {log_config.ACCESS_LOG_SAMPLE_RATE:g}",
+         lambda: log_config.setup_logging(stream=devnull, sample_rate=log_config.ACCESS_LOG_SAMPLE_RATE)),
+    ]
+
+    results = []
+    for name, configure in modes:
+        logging.disable(logging.NOTSET)
+        configure()
+        post_hops(client)  # warm up
+        per_session = time_per_call(lambda: post_hops(client), args.sessions)
+        results.append((name, per_session / hops))
+    log_config.stop_logging()
+
+    baseline = results[0][1]
+    print(f"{'mode':<26}{'us/hop':>10}{'overhead':>12}")
+    for name, per_hop in results:
+        print(f"{name:<26}{per_hop:>10.1f}{per_hop - baseline:>+12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Measures how the registration store grows: memory, insert rate and lookup latency by size.
+
+    python benchmarks/bench_memory.py [--scales 100000,1000000] [--backends memory,sqlite] [--json out.json]
+
+For each storage backend a fresh Python process loads synthetic registrations
+spread over every region and district through app.save_registration. At each
+scale it reports resident memory (RSS), memory per record, the database size
+on disk (sqlite), the insert rate since the previous scale and the latency of
+UBRN lookups (hits and misses). A projection of records per GiB of RSS shows
+roughly where a worker would run out of memory.
+
+Records are dated back one day at a time as each district's daily sequence
+fills up, as they would be over months of real registrations. Larger runs
+(e.g. --scales 1000000,10000000,50000000) need a machine with the memory for
+them.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from _common import ROOT, percentile
+
+FIRST_NAMES = ["Kwame", "Ama", "Kofi", "Akosua", "Yaw", "Abena", "Kwabena", "Adwoa", "Kojo", "Efua", "Esi", "Fiifi",
+               "Kwaku", "Afua", "Kwesi", "Yaa", "Nana", "Akua", "Ekow", "Araba"]
+LAST_NAMES = ["Mensah", "Owusu", "Boateng", "Asante", "Osei", "Addo", "Appiah", "Quaye", "Tetteh", "Ofori",
+              "Nkrumah", "Agyeman", "Danquah", "Amoah", "Darko", "Frimpong", "Sarpong", "Antwi", "Badu", "Acheampong"]
+# Leave headroom under MAX_SEQUENCE (9999) in each district's day.
+PER_DISTRICT_DAY = 9000
+LOOKUPS = 5000
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# --- Child: load one backend ---
+
+def synthetic_details(rng, region_code, district_code):
+    dob = datetime.date.today() - datetime.timedelta(days=rng.randrange(365))
+    return {
+        "baby_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "dob": dob.strftime("%d/%m/%Y"),
+        "sex": rng.choice(("Male", "Female")),
+        "region_code": region_code, "district_code": district_code,
+        "mother_nin": f"GHA-{rng.randrange(10 ** 9):09d}-{rng.randrange(10)}",
+        "father_nin": f"GHA-{rng.randrange(10 ** 9):09d}-{rng.randrange(10)}" if rng.random() < 0.7 else "N/A",
+        "status": "Provisionally Registered",
+    }
+
+
+def ubrn_of(app, districts, i, today):
+    """The UBRN that the i-th insert received, recomputed so the load does not keep a list of them."""
+    region_code, district_code = districts[i % len(districts)]
+    day = today - datetime.timedelta(days=i // (len(districts) * PER_DISTRICT_DAY))
+    sequence = (i // len(districts)) % PER_DISTRICT_DAY + 1
+    numeric = f"{region_code}{district_code}{day:%y%j}{sequence:04d}"
+    return f"GHA-{region_code}-{district_code}-{day:%y%j}-{sequence:04d}-{app.calculate_check_digit(numeric)}"
+
+
+def time_lookups(app, keys):
+    latencies, found = [], 0
+    for ubrn in keys:
+        started = time.perf_counter()
+        found += app.find_registration_by_ubrn(ubrn) is not None
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {"found": found / len(keys), **{f"p{p}_us": percentile(latencies, p) * 1e6 for p in (50, 99)}}
+
+
+def run_child(scales, sqlite_path):
+    import app
+    districts = sorted(app.reference_data.store.current.district_codes)
+    rng = random.Random(42)
+    today = datetime.datetime.now()
+    baseline = rss_bytes()
+    done = 0
+    for scale in scales:
+        started, before = time.perf_counter(), done
+        while done < scale:
+            region_code, district_code = districts[done % len(districts)]
+            day = today - datetime.timedelta(days=done // (len(districts) * PER_DISTRICT_DAY))
+            app.save_registration(synthetic_details(rng, region_code, district_code), day)
+            done += 1
+        inserts_per_second = (done - before) / (time.perf_counter() - started)
+        rss = rss_bytes()
+        hits = [ubrn_of(app, districts, rng.randrange(done), today) for _ in range(LOOKUPS)]
+        misses = [f"GHA-00-000-00000-{rng.randrange(10000):04d}-0" for _ in range(LOOKUPS)]
+        disk = 0
+        if app.db.name == "sqlite":
+            disk = sum(os.path.getsize(p) for p in (sqlite_path, sqlite_path + "-wal") if os.path.exists(p))
+        print(json.dumps({
+            "records": done,
+            "rss_bytes": rss,
+            "bytes_per_record": (rss - baseline) / done,
+            "disk_bytes": disk,
+            "inserts_per_second": inserts_per_second,
+            "lookup_hit": time_lookups(app, hits),
+            "lookup_miss": time_lookups(app, misses),
+        }), flush=True)
+
+
+# --- Parent: one child per backend, then the comparison ---
+
+def run_backend(backend, scales):
+    workdir = tempfile.mkdtemp(prefix="bench-memory-")
+    sqlite_path = os.path.join(workdir, "registrations.db")
+    env = dict(os.environ, STORAGE_BACKEND=backend, SQLITE_PATH=sqlite_path, LOG_LEVEL="WARNING",
+               RATE_LIMITS="", TRAFFIC_RECORD_PATH="")
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--scales", ",".join(map(str, scales))]
+    proc = subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True, check=True)
+    return [json.loads(line) for line in proc.stdout.splitlines() if line.startswith("{")]
+
+
+def print_report(report):
+    print(f"{'backend':<8}{'records':>11}{'RSS MiB':>9}{'B/record':>10}{'disk MiB':>10}{'inserts/s':>11}"
+          f"{'hit p50':>9}{'hit p99':>9}{'miss p50':>10}{'records/GiB':>13}")
+    for backend, rows in report.items():
+        for r in rows:
+            # Only the memory backend keeps records in RSS; sqlite's grow on disk instead.
+            per_gib = f"{(1 << 30) / r['bytes_per_record']:,.0f}" if backend == "memory" else "-"
+            print(f"{backend:<8}{r['records']:>11,}{r['rss_bytes'] / 2 ** 20:>9.0f}{r['bytes_per_record']:>10.0f}"
+                  f"{r['disk_bytes'] / 2 ** 20:>10.0f}{r['inserts_per_second']:>11,.0f}"
+                  f"{r['lookup_hit']['p50_us']:>7.1f}us{r['lookup_hit']['p99_us']:>7.1f}us"
+                  f"{r['lookup_miss']['p50_us']:>8.1f}us{per_gib:>13}")
+            if r["lookup_hit"]["found"] < 1:
+                print(f"  warning: only {r['lookup_hit']['found']:.0%} of lookups of loaded UBRNs found a record")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default="100000,1000000", help="comma-separated record counts")
+    parser.add_argument("--backends", default="memory,sqlite")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    scales = sorted(int(s) for s in args.scales.split(","))
+
+    if args.child:
+        run_child(scales, os.environ["SQLITE_PATH"])
+        return
+    report = {backend: run_backend(backend, scales) for backend in args.backends.split(",")}
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
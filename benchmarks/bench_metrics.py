@@ -0,0 +1,70 @@
+"""Measures the per-request cost of metrics instrumentation.
+
+    python benchmarks/bench_metrics.py [--iterations 200000] [--threads 4]
+
+Times the individual primitives and the bundle of calls a /callback hop
+makes, single-threaded and with several threads recording concurrently,
+then times a scrape of /metrics.
+"""
+import argparse
+import threading
+import time
+
+from _common import time_per_call
+
+import metrics
+
+BENCH_HOP = metrics.Histogram("bench_hop_latency_seconds", "Benchmark only.", ("flow", "step"))
+BENCH_COUNTER = metrics.Counter("bench_events_total", "Benchmark only.", ("field",))
+BENCH_ENDED = metrics.Counter("bench_sessions_ended_total", "Benchmark only.", ("flow",))
+
+
+def per_request():
+    # Mirrors what ussd_callback records on a typical hop.
+    started = time.perf_counter()
+    step = "register.dob"
+    flow = step.partition(".")[0]
+    BENCH_HOP.observe(time.perf_counter() - started, (flow, step))
+    BENCH_ENDED.inc((flow,))
+
+
+def threaded_per_call(fn, iterations, threads):
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(iterations):
+            fn()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers: w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers: w.join()
+    return (time.perf_counter() - start) / (iterations * threads) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+    n = args.iterations
+
+    cases = [
+        ("counter.inc", lambda: BENCH_COUNTER.inc(("dob",))),
+        ("histogram.observe", lambda: BENCH_HOP.observe(0.0012, ("register", "register.dob"))),
+        ("per-request bundle", per_request),
+    ]
+    print(f"{'case':<22}{'1 thread us':>14}{f'{args.threads} threads us':>16}")
+    for name, fn in cases:
+        single = time_per_call(fn, n)
+        multi = threaded_per_call(fn, n // args.threads, args.threads)
+        print(f"{name:<22}{single:>14.3f}{multi:>16.3f}")
+
+    scrape = time_per_call(metrics.render, 200)
+    print(f"\n/metrics render: {scrape:.0f} us for {len(metrics.REGISTRY)} metrics")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Microbenchmarks for the hot helpers, with a stored baseline to catch regressions.
+
+    python benchmarks/bench_micro.py [--json results.json] [--baseline benchmarks/baseline.json]
+                                     [--threshold 0.25] [--save-baseline] [--filter ubrn]
+
+Times the validators, the check digit, UBRN generation, menu rendering and
+whole in-process callback hops with timeit (best of --repeat runs, each long
+enough to be measured reliably). When the baseline file exists each result is
+compared with it, and the script exits with status 1 if any benchmark got
+slower by more than --threshold (a fraction). --save-baseline writes the
+current results as the new baseline. Baselines are only comparable on the
+same machine and Python version, so keep one per CI runner.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from _common import REGISTRATION_HOPS, ROOT
+
+import app
+import idempotency
+import name_search
+import rate_limit
+import reference_data
+import sms_outbox
+import storage
+from log_config import stop_logging
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+REGION_MENU_TEXT = "1*Kwame Mensah*15032024*1"
+DISTRICT_MENU_TEXT = "1*Kwame Mensah*15032024*1*1"
+
+
+def fresh_storage():
+    # UBRN sequences run out at 9999 per district and day, so each run starts afresh,
+    # and so does everything else kept next to the registrations, so that hops
+    # read the same store they write to.
+    backend = storage.backend = app.db = storage.MemoryStorage()
+    name_search.index = name_search.MemoryNameIndex(backend)
+    idempotency.cache = idempotency.MemoryResponseCache()
+    rate_limit.limiter = rate_limit.create_limiter(backend=backend)
+    reference_data.store.pins = reference_data.MemorySessionPins()
+    app.outbox = sms_outbox.SmsOutbox()
+
+
+def ubrn_generator():
+    districts = itertools.cycle([("01", f"{i:03d}") for i in range(1000)])
+    return lambda: app.generate_robust_ubrn(*next(districts))
+
+
+def registration_session():
+    counter = itertools.count()
+
+    def run():
+        # A new session, phone number and mother each time, so neither the
+        # idempotency cache nor the rate limiter turns the hops away, and the
+        # registration is not flagged as a duplicate of the last one.
+        n = next(counter)
+        session_id, phone_number, mother_nin = f"micro-{n}", f"+23350{n:07d}", f"GHA-{n:09d}-0"
+        for text in REGISTRATION_HOPS:
+            app.handle_ussd(session_id, phone_number, text.replace("GHA-123456789-0", mother_nin))
+    return run
+
+
+def main_menu_hop():
+    counter = itertools.count()
+    return lambda: app.handle_ussd("micro", f"+23351{next(counter):07d}", "")
+
+
+BENCHMARKS = {
+    "validate_name": lambda: app.validate_name("Kwame Mensah"),
+    "validate_date_of_birth": lambda: app.validate_date_of_birth("15032024"),
+    "validate_nin": lambda: app.validate_nin("GHA-123456789-0"),
+    "validate_ubrn": lambda: app.validate_ubrn("GHA-01-027-24075-0001-7"),
+    "calculate_check_digit": lambda: app.calculate_check_digit("010272407500001"),
+    "generate_robust_ubrn": ubrn_generator,
+    "render_region_menu": lambda: app.render_hop(REGION_MENU_TEXT, REGION_MENU_TEXT.split("*")),
+    "render_district_menu": lambda: app.render_hop(DISTRICT_MENU_TEXT, DISTRICT_MENU_TEXT.split("*")),
+    "hop_main_menu": main_menu_hop,
+    "session_registration": registration_session,
+}
+# Benchmarks above that are factories: called once to build the function to time.
+FACTORIES = {"generate_robust_ubrn", "hop_main_menu", "session_registration"}
+
+
+def measure(fn, repeat):
+    timer = timeit.Timer(fn, setup=fresh_storage)
+    number, _ = timer.autorange()
+    runs = [total / number * 1e9 for total in timer.repeat(repeat=repeat, number=number)]
+    return {"ns_per_call": min(runs), "median_ns": statistics.median(runs), "number": number, "repeat": repeat}
+
+
+def compare(results, baseline, threshold):
+    """Prints results against the baseline and returns the names that regressed."""
+    regressions = []
+    print(f"{'benchmark':<24}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, result in results.items():
+        current = result["ns_per_call"]
+        before = baseline.get(name, {}).get("ns_per_call")
+        if before is None:
+            print(f"{name:<24}{'-':>12}{format_ns(current):>12}{'new':>9}")
+            continue
+        change = current / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<24}{format_ns(before):>12}{format_ns(current):>12}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def format_ns(ns):
+    return f"{ns / 1000:.2f} us" if ns >= 1000 else f"{ns:.0f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before failing, e.g. 0.25 for 25%%")
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    results = {}
+    for name, fn in BENCHMARKS.items():
+        if args.filter not in name: continue
+        results[name] = measure(fn() if name in FACTORIES else fn, args.repeat)
+    stop_logging()
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}.")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}: "
+              + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
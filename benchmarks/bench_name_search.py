@@ -0,0 +1,140 @@
+"""Times registrar name search as the number of registrations grows.
+
+    python benchmarks/bench_name_search.py [--scales 100000,1000000] [--queries 1000] [--backends memory,sqlite]
+
+For each backend, indexes synthetic registrations up to each --scales size.
+Names follow a skewed distribution like real ones: Akan day names are very
+common, and there is a long tail of other first names and surnames. Each
+query is an existing child's name typed another way: accent added, Qu for
+Kw, a letter dropped or changed, words swapped, or only one of the words.
+Reports the indexing rate, the search's p50/p99 latency, and how often a
+registration with the intended name is among the top 20 results when the
+query has all of its words (one common word alone can match thousands of
+children equally well).
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from _common import percentile
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import name_search
+import storage
+
+DAY_NAMES = ["Kwame", "Kwasi", "Kwadwo", "Kwabena", "Kwaku", "Yaw", "Kofi", "Akosua", "Adwoa", "Abena",
+             "Akua", "Yaa", "Afua", "Ama", "Kojo", "Kwesi", "Ekow", "Esi", "Efua", "Araba", "Fiifi", "Aba"]
+OTHER_NAMES = ["Nana", "Elikem", "Selorm", "Delali", "Mawuli", "Dzifa", "Sena", "Edem", "Kekeli", "Fafali",
+               "Nii", "Naa", "Tetteh", "Adjoa", "Emmanuel", "Esther", "Grace", "Daniel", "Comfort", "Samuel",
+               "Priscilla", "Joseph", "Christiana", "Benjamin", "Rita", "Michael", "Gifty", "Isaac", "Mercy",
+               "Francis", "Abigail", "Prince", "Ruth", "Richard", "Hannah", "Godfred", "Patience", "Eric",
+               "Felicia", "Ibrahim", "Fatima", "Abdul", "Amina", "Mohammed", "Zainab", "Issah", "Rahinatu"]
+SYLLABLES = ["a", "ba", "bo", "da", "do", "fo", "ga", "gye", "kwa", "ko", "ku", "ma", "me", "na", "nsa",
+             "nti", "o", "pa", "pe", "sa", "si", "ta", "te", "tu", "wu", "ya", "ye"]
+QUERY_CHANGES = ["accent", "qu", "drop", "typo", "swap", "first", "last"]
+
+
+def zipf_weights(count):
+    return [1 / (rank + 1) for rank in range(count)]
+
+
+def surnames(rng, count):
+    names = {"Mensah", "Owusu", "Boateng", "Asante", "Osei", "Addo", "Appiah", "Ofori", "Agyeman", "Darko"}
+    while len(names) < count:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize())
+    return sorted(names, key=lambda name: (len(name) > 6, name))
+
+
+def query_for(rng, name):
+    words = name.split()
+    change = rng.choice(QUERY_CHANGES)
+    if change == "accent":
+        i = rng.randrange(len(words))
+        words[i] = words[i].replace("e", "é", 1).replace("a", "á", 1)
+    elif change == "qu":
+        words = [word.replace("Kw", "Qu") for word in words]
+    elif change == "drop":
+        i = rng.randrange(len(words))
+        if len(words[i]) > 3: words[i] = words[i][:-1]
+    elif change == "typo":
+        i = rng.randrange(len(words))
+        j = rng.randrange(1, len(words[i]))
+        words[i] = words[i][:j] + rng.choice("aeiou") + words[i][j + 1:]
+    elif change == "swap":
+        words.reverse()
+    elif change == "first":
+        words = words[:1]
+    else:
+        words = words[-1:]
+    return " ".join(words)
+
+
+def load(db, index, count, rng, first_names, first_weights, last_names, last_weights):
+    """Adds registrations up to `count`; returns (seconds, a sample of names)."""
+    total, sample, seconds = db.count_registrations(), [], 0.0
+    while total < count:
+        batch = []
+        for _ in range(min(10000, count - total)):
+            name = f"{rng.choices(first_names, first_weights)[0]} {rng.choices(last_names, last_weights)[0]}"
+            batch.append({"ubrn": f"BENCH-{total}", "baby_name": name, "dob": "15/03/2024", "sex": "Male",
+                          "region_code": "01", "district_code": "027", "mother_nin": "GHA-123456789-0",
+                          "father_nin": "N/A", "status": "Provisionally Registered"})
+            total += 1
+        sample.extend(details["baby_name"] for details in batch[:50])
+        started = time.perf_counter()
+        with db.transaction():
+            db.insert_registrations(batch)
+            index.add_many((details["ubrn"], details["baby_name"]) for details in batch)
+        seconds += time.perf_counter() - started
+    return seconds, sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default="100000,1000000")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--backends", default="memory,sqlite")
+    args = parser.parse_args()
+
+    print(f"{'backend':<8}{'records':>11}{'words':>8}{'saves/s':>9}{'p50 ms':>8}{'p99 ms':>8}{'found':>7}")
+    for backend in args.backends.split(","):
+        rng = random.Random(5)
+        first_names = DAY_NAMES + OTHER_NAMES
+        last_names = surnames(rng, 3000)
+        first_weights, last_weights = zipf_weights(len(first_names)), zipf_weights(len(last_names))
+        if backend == "sqlite":
+            db = storage.SqliteStorage(os.path.join(tempfile.mkdtemp(prefix="bench-names-"), "ebirth.db"))
+            index = name_search.SqliteNameIndex(db)
+        else:
+            db = storage.MemoryStorage()
+            index = name_search.MemoryNameIndex(db)
+        sample, loaded = [], 0
+        for scale in sorted(int(s) for s in args.scales.split(",")):
+            seconds, names = load(db, index, scale, rng, first_names, first_weights, last_names, last_weights)
+            sample.extend(names)
+            rate = (scale - loaded) / seconds
+            loaded = scale
+            times, found, full_queries = [], 0, 0
+            for _ in range(args.queries):
+                name = rng.choice(sample)
+                query = query_for(rng, name)
+                started = time.perf_counter()
+                results = name_search.search(query, name_search.SEARCH_LIMIT, index)
+                times.append(time.perf_counter() - started)
+                if len(query.split()) == len(name.split()):
+                    full_queries += 1
+                    found += any(result["baby_name"] == name for result in results)
+            times.sort()
+            words = (len(index.postings) if backend == "memory" else
+                     db.connection().execute("SELECT COUNT(*) FROM name_words").fetchone()[0])
+            print(f"{backend:<8}{scale:>11,}{words:>8,}{rate:>9,.0f}{percentile(times, 50) * 1000:>8.2f}"
+                  f"{percentile(times, 99) * 1000:>8.2f}{found / max(full_queries, 1):>7.1%}")
+        if backend == "sqlite":
+            os.remove(db.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Measures what Ghana Card verification adds to the registration confirm hop.
+
+    python benchmarks/bench_nin_verification.py [--sessions 100] [--concurrency 25] [--latency 0.3] [--think 0.5]
+
+Starts tools/fake_nia.py with --latency seconds per lookup, then walks
+--sessions registrations through app.handle_ussd on --concurrency threads,
+pausing --think seconds between hops as a parent would. --repeat of the
+sessions reuse an earlier mother's card number. This is done three times:
+without verification, with the lookup made only at the confirm hop, and with
+the lookup started when the mother's number is entered (the default). For
+each it reports the confirm hop's p50/p99 latency, how many checks found the
+answer already cached, the lookups the fake NIA served, and the outcomes.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import REGISTRATION_HOPS, ROOT, free_port, percentile, wait_for_port
+
+# Slow confirm hops are expected here; their warnings would drown the report.
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("RATE_LIMITS", "")
+
+import app
+import metrics
+import nin_verification
+
+MODES = [("off", None), ("confirm", False), ("prefetch", True)]
+
+
+def session_hops(nin):
+    return [text.replace("GHA-123456789-0", nin) for text in REGISTRATION_HOPS]
+
+
+def run_session(mode, index, nin, think, confirm_times, outcomes, lock):
+    for i, text in enumerate(session_hops(nin)):
+        if i: time.sleep(think)
+        started = time.perf_counter()
+        response = app.handle_ussd(f"bench-nia-{mode}-{index}", f"+23320{index:07d}", text)
+        elapsed = time.perf_counter() - started
+    # The last hop is the confirm hop.
+    with lock:
+        confirm_times.append(elapsed)
+        outcomes[response[:40]] = outcomes.get(response[:40], 0) + 1
+
+
+def checks_by_source():
+    counts = {"cache": 0, "lookup": 0}
+    for labels, value in metrics.NIN_CHECKS.collect().items():
+        counts[labels[1]] += value
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per fake NIA lookup")
+    parser.add_argument("--think", type=float, default=0.5, help="seconds between a session's hops")
+    parser.add_argument("--repeat", type=float, default=0.2, help="fraction of sessions reusing an earlier card")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    nins = []
+    for _ in range(args.sessions):
+        if nins and rng.random() < args.repeat:
+            nins.append(rng.choice(nins))
+        else:
+            nins.append(f"GHA-{rng.randrange(10 ** 9):09d}-{rng.randrange(10)}")
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "tools", "fake_nia.py"), "--port", str(port),
+                               "--latency", str(args.latency)], stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/v1/cards"
+        print(f"{args.sessions} sessions, {args.concurrency} at a time, {args.latency * 1000:.0f} ms per lookup, "
+              f"{args.think * 1000:.0f} ms think time")
+        print(f"{'mode':<10}{'p50 ms':>9}{'p99 ms':>9}{'cached':>8}{'lookups':>9}  outcomes")
+        for name, prefetch in MODES:
+            nin_verification.verifier = nin_verification.NinVerifier(
+                url=url if prefetch is not None else "", prefetch=bool(prefetch))
+            before = checks_by_source()
+            lookups_before = sum(metrics.NIN_LOOKUPS.collect().values())
+            confirm_times, outcomes, lock = [], {}, threading.Lock()
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                for i, nin in enumerate(nins):
+                    pool.submit(run_session, name, i, nin, args.think, confirm_times, outcomes, lock)
+            confirm_times.sort()
+            cached = checks_by_source()["cache"] - before["cache"]
+            lookups = sum(metrics.NIN_LOOKUPS.collect().values()) - lookups_before
+            summary = ", ".join(f"{count} x {response!r}" for response, count in sorted(outcomes.items()))
+            print(f"{name:<10}{percentile(confirm_times, 50) * 1000:>9.1f}{percentile(confirm_times, 99) * 1000:>9.1f}"
+                  f"{cached:>8}{lookups:>9}  {summary}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
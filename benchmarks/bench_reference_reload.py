@@ -0,0 +1,140 @@
+"""Checks that reloading the region and district data never mixes versions within a session.
+
+    python benchmarks/bench_reference_reload.py [--sessions 300] [--concurrency 20] [--swap-every 0.05] [--backend memory]
+
+Copies data/districts.json to a temporary file and makes a second version
+with every region's districts rotated by one, so each menu number names a
+different district. --concurrency threads walk --sessions registrations
+through app.handle_ussd, each choosing a district from the menu page it was
+shown (sometimes after "98. More"). This is done twice: with the file left
+alone, then with it switched between the two versions and reloaded every
+--swap-every seconds. A session is wrong if its confirm screen names a
+district other than the one it chose. Reports the hop p50/p99 latency, the
+reloads made, wrong sessions (should be 0), and the versions still loaded
+and pinned once every session has ended. Also reports the time to build a
+snapshot from the file.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import ROOT, percentile
+
+OPTION_PATTERN = re.compile(r"^(\d+)\. (.+)$", re.MULTILINE)
+START_HOPS = ["", "1", "1*Kwame Mensah", "1*Kwame Mensah*15032024", "1*Kwame Mensah*15032024*1"]
+
+
+def rotated(document, version):
+    document = json.loads(json.dumps(document))
+    document["version"] = version
+    for region in document["regions"]:
+        region["districts"] = region["districts"][1:] + region["districts"][:1]
+    return document
+
+
+def write_document(path, document):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(document, f)
+    os.replace(path + ".tmp", path)
+
+
+def run_session(app, session_id, phone_number, seed, times, wrong, lock):
+    rng = random.Random(seed)
+    elapsed = []
+
+    def hop(text):
+        time.sleep(rng.uniform(0, 0.01))
+        started = time.perf_counter()
+        response = app.handle_ussd(session_id, phone_number, text)
+        elapsed.append(time.perf_counter() - started)
+        return response
+
+    for text in START_HOPS:
+        response = hop(text)
+    text = f"{START_HOPS[-1]}*{rng.randint(1, 16)}"
+    response = hop(text)
+    while "98. More" in response and rng.random() < 0.5:
+        text += "*98"
+        response = hop(text)
+    number, district = rng.choice([option for option in OPTION_PATTERN.findall(response)
+                                   if option[0] not in ("0", "98")])
+    for answer in (number, "GHA-123456789-0", "0"):
+        text += f"*{answer}"
+        response = hop(text)
+    hop(text + "*1")
+    with lock:
+        times.extend(elapsed)
+        wrong[0] += f"\nDistrict: {district}\n" not in response
+
+
+def run(app, reference_data, path, versions, args, mode):
+    times, wrong, lock = [], [0], threading.Lock()
+    done, reloads = threading.Event(), [0]
+
+    def swap():
+        i = 0
+        while not done.wait(args.swap_every):
+            i += 1
+            write_document(path, versions[i % 2])
+            reference_data.store.reload()
+            reloads[0] += 1
+
+    swapper = threading.Thread(target=swap) if mode == "swaps" else None
+    if swapper: swapper.start()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for i in range(args.sessions):
+            pool.submit(run_session, app, f"bench-ref-{mode}-{i}", f"+23324{i:07d}", i, times, wrong, lock)
+    done.set()
+    if swapper: swapper.join()
+    reference_data.store.prune()
+    times.sort()
+    status = reference_data.store.status()
+    print(f"{mode:<8}{percentile(times, 50) * 1000:>8.2f}{percentile(times, 99) * 1000:>8.2f}{reloads[0]:>9}"
+          f"{wrong[0]:>7}{len(status['loaded']):>8}{sum(status['pinned_sessions'].values()):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--swap-every", type=float, default=0.05, help="seconds between reloads")
+    parser.add_argument("--backend", default="memory", choices=("memory", "sqlite"))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-reference-")
+    path = os.path.join(workdir, "districts.json")
+    shutil.copy(os.path.join(ROOT, "data", "districts.json"), path)
+    os.environ["DISTRICTS_PATH"] = path
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "ebirth.db")
+    os.environ.setdefault("REFERENCE_RELOAD_SECONDS", "0")  # only the reloads made here
+    os.environ.setdefault("DUPLICATE_MODE", "off")  # every session registers the same child
+    os.environ.setdefault("RATE_LIMITS", "")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import app
+    import reference_data
+
+    with open(path, encoding="utf-8") as f:
+        original = json.load(f)
+    versions = [original, rotated(original, original["version"] + "-rotated")]
+    started = time.perf_counter()
+    for _ in range(20):
+        reference_data.load(path)
+    print(f"snapshot build: {(time.perf_counter() - started) / 20 * 1000:.2f} ms "
+          f"({len(reference_data.store.current.district_names)} districts, {args.backend} backend)")
+    print(f"{'mode':<8}{'p50 ms':>8}{'p99 ms':>8}{'reloads':>9}{'wrong':>7}{'loaded':>8}{'pinned':>8}")
+    for mode in ("steady", "swaps"):
+        run(app, reference_data, path, versions, args, mode)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
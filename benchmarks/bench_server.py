@@ -0,0 +1,94 @@
+"""Compares requests/second of the development server and the production server.
+
+    python benchmarks/bench_server.py [--servers dev,gunicorn] [--clients 32] [--seconds 10]
+
+Each server is started in a subprocess on a free port with a fresh SQLite
+database, then `--clients` threads walk complete registrations over
+keep-alive HTTP connections for `--seconds`. Reports requests/second and
+latency percentiles per server. The gunicorn run needs gunicorn installed.
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from _common import REGISTRATION_HOPS, ROOT, free_port, percentile, wait_for_port
+
+SERVERS = {
+    "dev": [sys.executable, "app.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:application"],
+}
+
+
+def run_client(port, stop_at, latencies, errors, client_id):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    session = 0
+    while time.monotonic() < stop_at:
+        session += 1
+        for text in REGISTRATION_HOPS:
+            body = urllib.parse.urlencode({"sessionId": f"bench-{client_id}-{session}",
+                                           "phoneNumber": f"+23320{client_id:07d}", "text": text})
+            started = time.perf_counter()
+            try:
+                conn.request("POST", "/callback", body, headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200: errors.append(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(type(e).__name__)
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                continue
+            latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def bench(name, clients, seconds, workers):
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="bench-server-")
+    env = dict(os.environ, PORT=str(port), STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(workdir, "bench.db"),
+               METRICS_DIR=os.path.join(workdir, "metrics"), ACCESS_LOG_SAMPLE_RATE="0", LOG_LEVEL="WARNING")
+    if workers: env["WEB_CONCURRENCY"] = str(workers)
+    proc = subprocess.Popen(SERVERS[name], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        latencies, errors = [], []
+        stop_at = time.monotonic() + seconds
+        threads = [threading.Thread(target=run_client, args=(port, stop_at, latencies, errors, i)) for i in range(clients)]
+        started = time.monotonic()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        elapsed = time.monotonic() - started
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    latencies.sort()
+    return {
+        "server": name, "requests": len(latencies), "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000, "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", default="dev,gunicorn")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=None, help="gunicorn workers (default from gunicorn.conf.py)")
+    args = parser.parse_args()
+
+    print(f"{'server':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name in args.servers.split(","):
+        r = bench(name, args.clients, args.seconds, args.workers)
+        print(f"{r['server']:<10}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10.0f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Compares validators.py with the inline validators app.py used to have.
+
+    python benchmarks/bench_validators.py [--values 100000] [--repeat 5]
+
+First checks that both versions accept and reject the same inputs on a corpus
+of valid, invalid and random values (exiting with status 1 on any
+disagreement). Then it reports ns per value for each field: the original
+functions, the new scalar functions, and validate_batch over the whole list.
+"""
+import argparse
+import datetime
+import random
+import re
+import string
+import sys
+import timeit
+
+import _common  # noqa: F401  (puts the project root on sys.path)
+
+import validators
+
+
+# --- The original validators, as they were in app.py ---
+
+def legacy_validate_name(name):
+    if name == '0': return True
+    if not name: return False
+    clean_name = name.strip()
+    if not (2 <= len(clean_name) <= 50): return False
+    return bool(re.match(r"^[a-zA-Z\s'-]+$", clean_name))
+
+def legacy_validate_date_of_birth(dob):
+    if not dob or len(dob) != 8 or not dob.isdigit(): return False
+    try:
+        day, month, year = int(dob[:2]), int(dob[2:4]), int(dob[4:])
+        current_year = datetime.datetime.now().year
+        if not (1 <= day <= 31 and 1 <= month <= 12 and (current_year - 10) <= year <= current_year): return False
+        datetime.datetime(year, month, day)
+        return True
+    except (ValueError, TypeError): return False
+
+def legacy_validate_sex_selection(sex_input):
+    return sex_input in ['1', '2']
+
+def legacy_validate_nin(nin):
+    if not nin: return False
+    return bool(re.match(r'^GHA-\d{9}-[\dA-Z]$', nin.upper()))
+
+def legacy_validate_optional_nin(nin):
+    if nin == '0': return True
+    return legacy_validate_nin(nin)
+
+def legacy_validate_ubrn(ubrn):
+    if not ubrn: return False
+    return bool(re.match(r'^GHA-\d{2}-\d{3}-\d{5}-\d{4}-[\dX]$', ubrn.upper()))
+
+
+LEGACY = {
+    "name": legacy_validate_name,
+    "dob": legacy_validate_date_of_birth,
+    "sex": legacy_validate_sex_selection,
+    "nin": legacy_validate_nin,
+    "optional_nin": legacy_validate_optional_nin,
+    "ubrn": legacy_validate_ubrn,
+}
+
+
+# --- Inputs ---
+
+def sample_values(field, rng, n):
+    """Mostly well-formed values as users type them, with some mistakes mixed in."""
+    year = datetime.date.today().year
+    make = {
+        "name": lambda: rng.choice(["Kwame Mensah", "Ama", "Akosua Boateng-Owusu", "O'Neil", "K", "Kofi2", " Yaw "]),
+        "dob": lambda: f"{rng.randint(1, 31):02d}{rng.randint(1, 12):02d}{rng.randint(year - 11, year)}",
+        "sex": lambda: rng.choice("123"),
+        "nin": lambda: f"{rng.choice(['GHA', 'GHA', 'gha', 'GH'])}-{rng.randrange(10 ** 9):09d}-{rng.choice('0123456789Xx')}",
+        "optional_nin": lambda: rng.choice(["0", f"GHA-{rng.randrange(10 ** 9):09d}-{rng.randrange(10)}"]),
+        "ubrn": lambda: f"GHA-01-027-{rng.randrange(100000):05d}-{rng.randrange(10000):04d}-{rng.choice('0123456789Xx')}",
+    }[field]
+    return [make() for _ in range(n)]
+
+
+def edge_cases():
+    year = datetime.date.today().year
+    leap = next(y for y in range(year, year - 11, -1) if y % 4 == 0 and (y % 100 or y % 400 == 0))
+    common = next(y for y in range(year, year - 11, -1) if y % 4)
+    return [
+        "", "0", "1", "2", "3", " ", "  Ab  ", "A" * 50, "A" * 51, "Ab\n", "Ab\t", "Amaé", "١٢",
+        f"2902{leap}", f"2902{common}", f"3002{leap}", f"3104{year}", f"3004{year}", f"0001{year}", f"0100{year}",
+        f"0113{year}", f"0101{year - 10}", f"0101{year - 11}", f"3112{year}", f"0101{year + 1}",
+        "٠١٠١" + str(year), "²²²²²²²²", "1503202a",
+        "GHA-123456789-0", "gha-123456789-x", "GHA-123456789-0\n", "GHA-12345678-0", "GHA-123456789-00",
+        "GHA-١٢٣456789-0", "GHA-01-027-24075-0001-7", "gha-01-027-24075-0001-x",
+        "GHA-01-027-24075-0001-A", "GHA-01-027-24075-0001-7\n", "GHA-1-027-24075-0001-7",
+    ]
+
+
+def random_strings(rng, n):
+    alphabet = string.ascii_letters + string.digits + "-' *\n١é"
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 25))) for _ in range(n)]
+
+
+def check_agreement(rng):
+    corpus = edge_cases() + random_strings(rng, 20000)
+    disagreements = []
+    for field, legacy in LEGACY.items():
+        values = corpus + sample_values(field, rng, 20000)
+        batch = validators.validate_batch(field, values)
+        for value, in_batch in zip(values, batch):
+            expected = legacy(value)
+            if validators.VALIDATORS[field](value) != expected or in_batch != expected:
+                disagreements.append((field, value, expected))
+    for field, value, expected in disagreements[:20]:
+        print(f"MISMATCH {field} {value!r}: original says {expected}")
+    return not disagreements
+
+
+# --- Timing ---
+
+def ns_per_value(fn, values, repeat):
+    timer = timeit.Timer(lambda: fn(values))
+    return min(timer.repeat(repeat=repeat, number=1)) / len(values) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--values", type=int, default=100000, help="values per field")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    if not check_agreement(rng):
+        sys.exit(1)
+    print("validators.py agrees with the original validators on every input.")
+
+    print(f"{'field':<14}{'original':>12}{'scalar':>12}{'batch':>12}{'speedup':>9}")
+    for field, legacy in LEGACY.items():
+        values = sample_values(field, rng, args.values)
+        scalar = validators.VALIDATORS[field]
+        before = ns_per_value(lambda vs: [legacy(v) for v in vs], values, args.repeat)
+        after = ns_per_value(lambda vs: [scalar(v) for v in vs], values, args.repeat)
+        batch = ns_per_value(lambda vs: validators.validate_batch(field, vs), values, args.repeat)
+        print(f"{field:<14}{before:>9.0f} ns{after:>9.0f} ns{batch:>9.0f} ns{before / min(after, batch):>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compares the per-hop cost of /callback through Flask and through the raw WSGI fast path.
+
+    python benchmarks/bench_wsgi.py [--sessions 2000]
+
+Calls both WSGI callables in-process with hand-built environs, so neither a
+server nor a test client is in the measurement, and walks complete
+registrations through each. Reports the mean time per hop, and the same for
+the main menu hop alone, which does no storage or SMS work and so shows the
+framework overhead most clearly.
+"""
+import argparse
+import io
+import os
+import urllib.parse
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from _common import REGISTRATION_HOPS, time_per_call
+
+import wsgi
+from log_config import stop_logging
+
+
+def make_environ(body):
+    return {
+        "REQUEST_METHOD": "POST", "PATH_INFO": "/callback", "SCRIPT_NAME": "", "QUERY_STRING": "",
+        "CONTENT_TYPE": "application/x-www-form-urlencoded", "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": "127.0.0.1", "SERVER_PORT": "8000", "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": "127.0.0.1", "wsgi.input": io.BytesIO(body), "wsgi.url_scheme": "http",
+        "wsgi.errors": io.StringIO(), "wsgi.multithread": True, "wsgi.multiprocess": False,
+        "wsgi.run_once": False, "wsgi.version": (1, 0),
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def hop_runner(application, hops):
+    bodies = [urllib.parse.urlencode({"sessionId": "bench", "phoneNumber": "+233200000000", "text": text}).encode()
+              for text in hops]
+
+    def run():
+        for body in bodies:
+            b"".join(application(make_environ(body), start_response))
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=2000)
+    args = parser.parse_args()
+
+    flask_app, fast_app = wsgi.app.wsgi_app, wsgi.fast_callback
+    print(f"{'path':<12}{'flask us':>10}{'fast us':>10}{'saved':>8}")
+    for label, hops in (("registration", REGISTRATION_HOPS), ("main menu", [""])):
+        count = len(hops)
+        results = []
+        for application in (flask_app, fast_app):
+            hop_runner(application, hops)()  # warm up
+            results.append(time_per_call(hop_runner(application, hops), args.sessions) / count)
+        flask_us, fast_us = results
+        print(f"{label:<12}{flask_us:>10.1f}{fast_us:>10.1f}{1 - fast_us / flask_us:>8.0%}")
+    stop_logging()
+
+
+if __name__ == "__main__":
+    main()
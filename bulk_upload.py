@@ -0,0 +1,166 @@
+import collections
+import concurrent.futures
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+
+import bulk_validation
+import metrics
+
+# --- Bulk Upload Pipeline ---
+# A facility's upload is read, checked and registered a chunk of rows at a
+# time, so memory stays bounded however large the file is:
+#
+#   read chunk -> check it in a worker process -> save its valid rows in one
+#   transaction -> send back a result line per row
+#
+# Checking runs in a pool of BULK_WORKERS processes, so a large upload does
+# not hold this worker's GIL (and its USSD threads) for seconds at a time.
+# At most BULK_MAX_PENDING_CHUNKS chunks are read ahead of the one being
+# saved, and nothing more is read from the request until the client has taken
+# the results so far. A slow client or a slow disk therefore slows the
+# upload down instead of filling memory.
+#
+# Chunks are saved in file order, so a failure part-way leaves a clean cut:
+# every row before it has a UBRN, and no row after it was saved.
+
+# Smaller than bulk_validation's default, so UBRNs start coming back sooner.
+BULK_UPLOAD_CHUNK_ROWS = int(os.environ.get("BULK_UPLOAD_CHUNK_ROWS", "10000"))
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", str(os.cpu_count() or 1)))
+BULK_MAX_PENDING_CHUNKS = int(os.environ.get("BULK_MAX_PENDING_CHUNKS", "2"))
+
+CSV_FORMAT = "csv"
+JSONL_FORMAT = "jsonl"
+
+log = logging.getLogger("ussd.bulk")
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """This process's pool of checking processes, started on first use."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Spawned rather than forked: the server process has threads running.
+            _pool = concurrent.futures.ProcessPoolExecutor(BULK_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_pool():
+    # A pool whose process died refuses all further work; the next upload starts a new one.
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def check_chunk(rows, columns, malformed, districts):
+    """Runs in a pool process: the error report for one chunk."""
+    return bulk_validation.row_errors(rows, bulk_validation.validate_columns(columns, districts), malformed)
+
+
+class _RequestBody(io.RawIOBase):
+    # WSGI input only promises read(); servers pass chunked bodies through as it is.
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def text_stream(stream):
+    """A UTF-8 text file (a leading byte order mark is skipped) over a request's input stream."""
+    return io.TextIOWrapper(io.BufferedReader(_RequestBody(stream)), encoding="utf-8-sig", newline="")
+
+
+def open_upload(f, upload_format, chunk_rows=BULK_UPLOAD_CHUNK_ROWS):
+    """The chunks of an upload (an open text file).
+
+    Reads the first chunk straight away, so a file that cannot be used at all
+    (such as a CSV header missing a column) raises ValueError here, before any
+    response has been sent.
+    """
+    if upload_format == JSONL_FORMAT:
+        chunks = bulk_validation.read_jsonl_chunks(f, chunk_rows)
+    else:
+        chunks = bulk_validation.read_chunks(f, chunk_rows)
+    first = next(chunks, None)
+    return itertools.chain([first] if first else [], chunks)
+
+
+def process_upload(chunks, districts, save, workers=None):
+    """Checks and saves an upload's chunks, yielding the results of each one once it is saved.
+
+    `save` takes a list of registrations and returns their UBRNs (None for
+    any it could not save), e.g. app.save_registrations. Each yield is a list
+    of result dicts: {"row": n, "ubrn": ...} or {"row": n, "errors": [...]},
+    in row order. The last is a summary: {"done": true, "rows": ..,
+    "registered": .., "invalid": ..}, with "done": false and an "error" if
+    the upload stopped early.
+    """
+    workers = BULK_WORKERS if workers is None else workers
+    chunks = iter(chunks)
+    pending = collections.deque()
+    totals = {"rows": 0, "registered": 0, "invalid": 0}
+
+    def read_ahead():
+        while len(pending) < max(BULK_MAX_PENDING_CHUNKS, 1):
+            chunk = next(chunks, None)
+            if chunk is None: return
+            rows, columns, malformed = chunk
+            if workers:
+                checked = pool().submit(check_chunk, rows, columns, malformed, districts)
+            else:
+                checked = concurrent.futures.Future()
+                checked.set_result(check_chunk(rows, columns, malformed, districts))
+            pending.append((rows, columns, checked))
+
+    try:
+        read_ahead()
+        while pending:
+            rows, columns, checked = pending.popleft()
+            failed = {error["row"]: error["errors"] for error in checked.result()}
+            read_ahead()  # the pool checks the next chunks while this one is saved
+            valid = [i for i, row in enumerate(rows) if row not in failed]
+            ubrns = save([bulk_validation.registration_details(columns, i) for i in valid]) if valid else []
+            ubrn_of = dict(zip(valid, ubrns))
+            results = []
+            for i, row in enumerate(rows):
+                if row in failed:
+                    results.append({"row": row, "errors": failed[row]})
+                elif ubrn_of[i] is None:
+                    results.append({"row": row, "errors": ["No UBRNs left for this district today"]})
+                else:
+                    results.append({"row": row, "ubrn": ubrn_of[i]})
+            registered = sum(1 for ubrn in ubrns if ubrn is not None)
+            totals["rows"] += len(rows)
+            totals["registered"] += registered
+            totals["invalid"] += len(rows) - registered
+            metrics.BULK_ROWS.inc(("registered",), registered)
+            metrics.BULK_ROWS.inc(("invalid",), len(rows) - registered)
+            yield results
+    except Exception as e:
+        log.exception("BULK: Upload stopped after %d rows.", totals["rows"])
+        if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+            _discard_pool()
+        message = f"Upload stopped after {totals['rows']} rows; later rows were not registered."
+        yield [{"done": False, "error": message, **totals}]
+        return
+    finally:
+        # Also reached when the client goes away and the response is closed.
+        for _, _, checked in pending:
+            checked.cancel()
+    log.info("BULK: Upload of %d rows finished: %d registered, %d invalid.",
+             totals["rows"], totals["registered"], totals["invalid"])
+    yield [{"done": True, **totals}]
@@ -0,0 +1,320 @@
+import csv
+import itertools
+import json
+import logging
+import operator
+import os
+
+from validators import DAYS_IN_MONTH, validate_date_of_birth, validate_name, validate_nin, year_window
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# --- Bulk Registration Files ---
+# Facilities that were offline send births recorded on paper or in a
+# spreadsheet as one CSV file. The header row names the columns, in any order
+# (extra columns are ignored):
+#   baby_name      child's name; empty or 0 if not yet named
+#   dob            DDMMYYYY or DD/MM/YYYY
+#   sex            1/2, M/F or Male/Female, any case
+#   region_code    e.g. 01
+#   district_code  e.g. 027
+#   mother_nin     mother's Ghana Card number
+#   father_nin     father's Ghana Card number; empty or 0 if not given
+#
+# Rows are validated a chunk at a time, a whole column at once. With NumPy
+# each column becomes an array of code points and every rule is a handful of
+# array operations, so a chunk costs the same few calls whatever its size.
+# The array checks only ever *accept*: anything they reject (including
+# unusual but valid input such as other Unicode digits or surrounding spaces)
+# is checked again with the same rules the USSD flow uses, so the result
+# never differs from validating row by row. Without NumPy the row-by-row
+# rules are used for everything, with the same results, more slowly.
+
+BULK_COLUMNS = ("baby_name", "dob", "sex", "region_code", "district_code", "mother_nin", "father_nin")
+BULK_CHUNK_ROWS = int(os.environ.get("BULK_CHUNK_ROWS", "100000"))
+BULK_NUMPY = os.environ.get("BULK_NUMPY", "1") == "1"
+
+SEX_VALUES = {"1": "Male", "2": "Female", "m": "Male", "f": "Female", "male": "Male", "female": "Female"}
+
+# The checks, in report order, with the message for a row that fails them.
+ERROR_MESSAGES = {
+    "baby_name": "Invalid child's name",
+    "dob": "Invalid date of birth (DDMMYYYY within the last 10 years)",
+    "sex": "Invalid sex (1/2, M/F or Male/Female)",
+    "district": "Unknown region and district code",
+    "mother_nin": "Invalid mother's Ghana Card number",
+    "father_nin": "Invalid father's Ghana Card number",
+}
+
+log = logging.getLogger("ussd.bulk")
+
+
+def normalize_dob(dob):
+    """DD/MM/YYYY to DDMMYYYY; anything else is returned as it is."""
+    if len(dob) == 10 and dob[2] == "/" and dob[5] == "/":
+        return dob[:2] + dob[3:5] + dob[6:]
+    return dob
+
+
+def registration_details(columns, i):
+    """The registration to store for row `i` of a validated chunk, in the same form as the USSD flow saves."""
+    name, dob, father_nin = columns["baby_name"][i], normalize_dob(columns["dob"][i]), columns["father_nin"][i]
+    return {
+        "baby_name": "N/A" if name in ("", "0") else name,
+        "dob": f"{dob[:2]}/{dob[2:4]}/{dob[4:]}",
+        "sex": SEX_VALUES[columns["sex"][i].lower()],
+        "region_code": columns["region_code"][i], "district_code": columns["district_code"][i],
+        "mother_nin": columns["mother_nin"][i],
+        "father_nin": "N/A" if father_nin in ("", "0") else father_nin,
+        "status": "Provisionally Registered",
+    }
+
+
+# --- Row-by-Row Rules ---
+# The reference for every check. The NumPy path falls back to these.
+
+def name_ok(name):
+    return name == "" or validate_name(name)
+
+def dob_ok(dob):
+    return validate_date_of_birth(normalize_dob(dob))
+
+def sex_ok(sex):
+    return sex.lower() in SEX_VALUES
+
+def father_nin_ok(nin):
+    return nin == "" or nin == "0" or validate_nin(nin)
+
+
+def python_checks(columns, districts):
+    """{check: [bool per row]} using only the row-by-row rules."""
+    return {
+        "baby_name": list(map(name_ok, columns["baby_name"])),
+        "dob": list(map(dob_ok, columns["dob"])),
+        "sex": list(map(sex_ok, columns["sex"])),
+        "district": [pair in districts for pair in zip(columns["region_code"], columns["district_code"])],
+        "mother_nin": list(map(validate_nin, columns["mother_nin"])),
+        "father_nin": list(map(father_nin_ok, columns["father_nin"])),
+    }
+
+
+# --- Column-at-a-Time Rules (NumPy) ---
+
+if np is not None:
+    _NAME_CHARS = np.zeros(129, dtype=bool)
+    _NAME_CHARS[[ord(c) for c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ '-"]] = True
+    _DAYS = np.array(DAYS_IN_MONTH + (0, 0, 0), dtype=np.int64)  # padded so any two-digit month indexes safely
+    _DOB_SLASHED = [0, 1, 3, 4, 6, 7, 8, 9]
+
+
+def _strings(values, width):
+    """The values as a NumPy string array cut to `width` characters, and their lengths.
+
+    Values longer than `width` are cut, so pass one more than the longest
+    valid length and anything that long is known to be too long.
+    """
+    array = np.array(values, dtype=f"<U{width}")
+    if "\0" in "".join(values):
+        # NumPy drops trailing NULs, so only Python can count these.
+        return array, np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    return array, np.char.str_len(array)
+
+
+def _codes(array):
+    """An (n, width) uint32 array of the code points of a string array, zero-padded."""
+    return array.view(np.uint32).reshape(len(array), -1)
+
+
+def _are_digits(codes):
+    # Unsigned, so codes below "0" wrap round to huge numbers: one comparison checks both ends.
+    return (codes - 48 <= 9).all(axis=1)
+
+
+def _number(codes):
+    """The value of columns of ASCII digits, one number per row."""
+    result = np.zeros(len(codes), dtype=np.int64)
+    for column in range(codes.shape[1]):
+        result = result * 10 + codes[:, column].astype(np.int64) - 48
+    return result
+
+
+def _names_accepted(values):
+    width = min(max(map(len, values), default=0), 50) + 1
+    array, lengths = _strings(values, width)
+    codes = _codes(array)
+    padding = np.arange(width) >= lengths[:, None]
+    letters = (_NAME_CHARS[np.minimum(codes, 128)] | padding).all(axis=1)
+    # Leading or trailing spaces are left to the row-by-row rule, which strips them.
+    last = codes[np.arange(len(values)), np.clip(lengths - 1, 0, width - 1)]
+    ends = (codes[:, 0] != 32) & (last != 32)
+    unnamed = (lengths == 0) | ((lengths == 1) & (codes[:, 0] == 48))
+    return unnamed | ((lengths >= 2) & (lengths <= 50) & letters & ends)
+
+
+def _dobs_accepted(values):
+    array, lengths = _strings(values, 11)
+    codes = _codes(array)
+    slashed = (lengths == 10) & (codes[:, 2] == 47) & (codes[:, 5] == 47)
+    digits = np.where(slashed[:, None], codes[:, _DOB_SLASHED], codes[:, :8])
+    day, month, year = _number(digits[:, :2]), _number(digits[:, 2:4]), _number(digits[:, 4:])
+    earliest, latest = year_window()
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = _DAYS[np.clip(month, 0, 15)] + ((month == 2) & leap)
+    return (((lengths == 8) | slashed) & _are_digits(digits) & (month >= 1) & (month <= 12)
+            & (year >= earliest) & (year <= latest) & (day >= 1) & (day <= month_days))
+
+
+def _sexes_accepted(values):
+    spelled, lengths = _strings(values, 7)
+    # The lengths catch values that were cut or that end in NULs, which NumPy drops.
+    return np.isin(spelled, ["1", "2", "M", "F", "m", "f", "Male", "Female"]) & (lengths <= 6) & (lengths == np.char.str_len(spelled))
+
+
+def _districts_accepted(regions, districts_column, districts):
+    (region, region_lengths), (district, district_lengths) = _strings(regions, 3), _strings(districts_column, 4)
+    region, district = _codes(region)[:, :2], _codes(district)[:, :3]
+    known = [int(r) * 1000 + int(d) for r, d in districts if r.isascii() and r.isdigit() and d.isascii() and d.isdigit()]
+    shape = (region_lengths == 2) & (district_lengths == 3) & _are_digits(region) & _are_digits(district)
+    return shape & np.isin(_number(region) * 1000 + _number(district), known)
+
+
+def _nins_accepted(values, optional=False):
+    array, lengths = _strings(values, 16)
+    codes = _codes(array)
+    # ASCII letters differ from their capitals only in bit 5, so "| 32" folds case.
+    last = codes[:, 14] | 32
+    accepted = ((lengths == 15) & (codes[:, 0] | 32 == 103) & (codes[:, 1] | 32 == 104) & (codes[:, 2] | 32 == 97)
+                & (codes[:, 3] == 45) & _are_digits(codes[:, 4:13]) & (codes[:, 13] == 45)
+                & ((codes[:, 14] - 48 <= 9) | (last - 97 <= 25)))
+    if optional:
+        accepted |= (lengths == 0) | ((lengths == 1) & (codes[:, 0] == 48))
+    return accepted
+
+
+def numpy_checks(columns, districts):
+    """{check: bool array per row}, the same as python_checks gives."""
+    checks = {
+        "baby_name": _names_accepted(columns["baby_name"]),
+        "dob": _dobs_accepted(columns["dob"]),
+        "sex": _sexes_accepted(columns["sex"]),
+        "district": _districts_accepted(columns["region_code"], columns["district_code"], districts),
+        "mother_nin": _nins_accepted(columns["mother_nin"]),
+        "father_nin": _nins_accepted(columns["father_nin"], optional=True),
+    }
+    rules = {
+        "baby_name": lambda i: name_ok(columns["baby_name"][i]),
+        "dob": lambda i: dob_ok(columns["dob"][i]),
+        "sex": lambda i: sex_ok(columns["sex"][i]),
+        "district": lambda i: (columns["region_code"][i], columns["district_code"][i]) in districts,
+        "mother_nin": lambda i: validate_nin(columns["mother_nin"][i]),
+        "father_nin": lambda i: father_nin_ok(columns["father_nin"][i]),
+    }
+    for name, accepted in checks.items():
+        for i in np.flatnonzero(~accepted):
+            accepted[i] = rules[name](i)
+    return checks
+
+
+# --- Files ---
+
+def validate_columns(columns, districts, use_numpy=None):
+    """Validates one chunk: `columns` maps each of BULK_COLUMNS to an equal-length sequence of strings.
+
+    `districts` is a set of known (region_code, district_code) pairs. Returns
+    {check: sequence of bool}, True where the row passed, keyed as ERROR_MESSAGES.
+    """
+    if use_numpy is None:
+        use_numpy = BULK_NUMPY
+    if use_numpy and np is not None:
+        return numpy_checks(columns, districts)
+    return python_checks(columns, districts)
+
+
+def read_chunks(f, chunk_rows=BULK_CHUNK_ROWS):
+    """Yields (rows, columns, malformed) per chunk of a bulk CSV file.
+
+    `rows` holds each record's row number as a spreadsheet shows it (the
+    header is row 1), `columns` maps each of BULK_COLUMNS to a tuple of values
+    and `malformed` maps rows that had too few fields to an error (their
+    missing values are read as empty). Blank rows are skipped. Raises
+    ValueError if the header lacks a column.
+    """
+    reader = csv.reader(f)
+    header = [name.strip().lstrip("\ufeff").lower() for name in next(reader, [])]
+    missing = [name for name in BULK_COLUMNS if name not in header]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    indices = [header.index(name) for name in BULK_COLUMNS]
+    pick = operator.itemgetter(*indices)
+    width = max(indices) + 1
+    first = 2
+    while True:
+        records = list(itertools.islice(reader, chunk_rows))
+        if not records: return
+        try:
+            picked = list(map(pick, records))
+            rows, malformed = range(first, first + len(records)), {}
+        except IndexError:
+            # A blank or short row somewhere in the chunk: go through it row by row.
+            rows, picked, malformed = [], [], {}
+            for row, record in enumerate(records, first):
+                if not record: continue
+                rows.append(row)
+                if len(record) < width:
+                    malformed[row] = "Too few columns"
+                    record = record + [""] * (width - len(record))
+                picked.append(pick(record))
+        first += len(records)
+        if picked:
+            yield rows, dict(zip(BULK_COLUMNS, zip(*picked))), malformed
+
+
+def read_jsonl_chunks(f, chunk_rows=BULK_CHUNK_ROWS):
+    """Like read_chunks, for JSON Lines: one object per line with BULK_COLUMNS as keys.
+
+    Rows are numbered by line. Missing keys are read as empty and other
+    values as text; a line that is not a JSON object is reported as malformed.
+    """
+    rows, picked, malformed = [], [], {}
+    for number, line in enumerate(f, 1):
+        if not line.strip(): continue
+        rows.append(number)
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            malformed[number] = "Not a JSON object"
+            record = {}
+        picked.append(tuple("" if record.get(name) is None else str(record[name]) for name in BULK_COLUMNS))
+        if len(picked) >= chunk_rows:
+            yield rows, dict(zip(BULK_COLUMNS, zip(*picked))), malformed
+            rows, picked, malformed = [], [], {}
+    if picked:
+        yield rows, dict(zip(BULK_COLUMNS, zip(*picked))), malformed
+
+
+def row_errors(rows, checks, malformed=None):
+    """[{"row": n, "errors": [message, ...]}] for the rows of one chunk that failed a check."""
+    failed = {row: [message] for row, message in (malformed or {}).items()}
+    for name, passed in checks.items():
+        if np is not None and isinstance(passed, np.ndarray):
+            indices = np.flatnonzero(~passed).tolist()
+        else:
+            indices = [i for i, ok in enumerate(passed) if not ok]
+        for i in indices:
+            failed.setdefault(rows[i], []).append(ERROR_MESSAGES[name])
+    return [{"row": row, "errors": failed[row]} for row in sorted(failed)]
+
+
+def validate_file(f, districts, use_numpy=None, chunk_rows=BULK_CHUNK_ROWS):
+    """Validates a whole bulk CSV file (an open text file) and returns the per-row error report."""
+    count, errors = 0, []
+    for rows, columns, malformed in read_chunks(f, chunk_rows):
+        count += len(rows)
+        errors.extend(row_errors(rows, validate_columns(columns, districts, use_numpy), malformed))
+    log.info("BULK: Validated %d rows, %d invalid.", count, len(errors))
+    return {"rows": count, "valid_rows": count - len(errors), "invalid_rows": len(errors), "errors": errors}
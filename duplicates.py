@@ -0,0 +1,75 @@
+import datetime
+import difflib
+import os
+import re
+
+# --- Duplicate Birth Detection ---
+# The same child is often registered twice, e.g. once at the facility and
+# again from home. Before a USSD registration is saved, it is compared with
+# the existing registrations that have the same mother's NIN and a date of
+# birth at most DUPLICATE_DOB_DAYS days away. Storage keeps an index on
+# (mother's NIN, date of birth) for this, so a check reads only those few
+# candidates however many births are registered.
+#
+# A candidate is a duplicate if the child's names are similar: the same words
+# in any order, allowing small spelling differences (a similarity of at least
+# DUPLICATE_NAME_SIMILARITY between 0 and 1). Twins have the same mother and
+# birthday but different names, so they are not caught. A child registered
+# without a name only matches another registered without one.
+#
+# DUPLICATE_MODE says what happens to a duplicate:
+#   flag   - it is registered with DUPLICATE_STATUS, for a registrar to review
+#   reject - it is not registered, and the parent is told the existing UBRN
+#   off    - no check is made
+
+DUPLICATE_MODE = os.environ.get("DUPLICATE_MODE", "flag")
+DUPLICATE_NAME_SIMILARITY = float(os.environ.get("DUPLICATE_NAME_SIMILARITY", "0.85"))
+DUPLICATE_DOB_DAYS = int(os.environ.get("DUPLICATE_DOB_DAYS", "1"))
+if DUPLICATE_MODE not in ("flag", "reject", "off"):
+    raise ValueError(f"Unknown DUPLICATE_MODE '{DUPLICATE_MODE}' (expected 'flag', 'reject' or 'off').")
+
+DUPLICATE_STATUS = "Provisionally Registered (Possible Duplicate)"
+DOB_FORMAT = "%d/%m/%Y"
+
+_NOT_LETTERS = re.compile(r"[^a-z]+")
+
+
+def name_key(name):
+    """The child's name as sorted lower-case words, or "" if it was not given."""
+    if not name or name in ("N/A", "0"): return ""
+    return " ".join(sorted(_NOT_LETTERS.sub(" ", name.lower()).split()))
+
+
+def names_similar(first, second):
+    first, second = name_key(first), name_key(second)
+    if first == second: return True
+    if not first or not second: return False
+    return difflib.SequenceMatcher(None, first, second).ratio() >= DUPLICATE_NAME_SIMILARITY
+
+
+def nearby_dobs(dob, days=DUPLICATE_DOB_DAYS):
+    """Dates of birth (DD/MM/YYYY) at most `days` from `dob`, closest first."""
+    try:
+        day = datetime.datetime.strptime(dob, DOB_FORMAT).date()
+    except ValueError:
+        return [dob]
+    dates = []
+    for offset in sorted(range(-days, days + 1), key=abs):
+        try:
+            dates.append((day + datetime.timedelta(days=offset)).strftime(DOB_FORMAT))
+        except OverflowError:
+            pass
+    return dates
+
+
+def find_duplicate(storage, details):
+    """An existing registration of the child in `details`, or None.
+
+    Of several, one that was not itself flagged as a duplicate is preferred,
+    then the closest date of birth.
+    """
+    dobs = nearby_dobs(details["dob"])
+    matches = [record for record in storage.find_by_mother(details["mother_nin"], dobs)
+               if names_similar(record["baby_name"], details["baby_name"])]
+    if not matches: return None
+    return min(matches, key=lambda record: (record["status"] == DUPLICATE_STATUS, dobs.index(record["dob"])))
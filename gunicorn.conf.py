@@ -0,0 +1,69 @@
+# --- Production Server Configuration ---
+# Pre-fork, multi-worker server for the USSD service:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:application
+#
+# The app is imported once in the master (preload_app) and forked into the
+# workers, so start-up work such as building menus is done once. Workers are
+# recycled after a number of requests, and the server reloads gracefully:
+#   kill -HUP <master pid>          restart workers with the current config
+#   kill -USR2 <master pid>, then   start a new master with new code, then
+#   kill -QUIT <old master pid>     retire the old one once it is serving
+#
+# All state that must be shared between workers (registrations, UBRN
+# sequences, the SMS outbox) lives in the sqlite storage backend. USSD
+# session state travels in the gateway's `text` field, so nothing
+# session-related is held in a worker. Traces, slow hops and profiles are
+# diagnostics of the worker that served the request.
+import multiprocessing
+import os
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("METRICS_DIR", os.path.join(os.getcwd(), ".metrics"))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("THREADS_PER_WORKER", "4"))
+worker_class = "gthread"
+preload_app = True
+
+# Recycle workers to contain slow leaks; jitter keeps them from restarting together.
+max_requests = int(os.environ.get("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", "1000"))
+
+# USSD gateways give up after a few seconds, so a hung worker is useless well before this.
+timeout = int(os.environ.get("WORKER_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "20"))
+keepalive = 5
+
+accesslog = None  # the app writes its own sampled access log
+
+
+def on_starting(server):
+    import storage
+    if storage.STORAGE_BACKEND == "memory" and workers > 1:
+        raise RuntimeError("STORAGE_BACKEND=memory cannot be shared between workers; use sqlite.")
+    import metrics
+    metrics.clear_snapshots()
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork(): give each worker its own log listener and
+    # metrics flusher. Other background threads start lazily per process.
+    import log_config
+    import metrics
+    log_config.setup_logging()
+    metrics.start_flusher()
+
+
+def worker_exit(server, worker):
+    import log_config
+    import metrics
+    metrics.write_snapshot()
+    log_config.stop_logging()
+
+
+def child_exit(server, worker):
+    # Runs in the master once the worker is gone, however it ended.
+    import metrics
+    metrics.retire_snapshot(worker.pid)
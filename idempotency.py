@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+
+# --- Gateway Retry Idempotency ---
+# USSD gateways resend a callback when our answer is late. For hops with side
+# effects (the registration confirm) a resend must not save the birth and send
+# the SMS a second time, so the first request claims the (sessionId, text)
+# key, and the response it produces is kept for IDEMPOTENCY_TTL_SECONDS.
+# A resend gets that response back without touching storage. A resend that
+# arrives while the first request is still running waits up to
+# IDEMPOTENCY_WAIT_SECONDS for it to finish.
+#
+# Keys are hashes, so the NINs in `text` are not stored. With the sqlite
+# storage backend the keys are in the shared database, so a resend is caught
+# whichever worker process it reaches.
+
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "300"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "3"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "50000"))
+# A claim whose request never finished (e.g. the worker died) lapses after this.
+CLAIM_TIMEOUT_SECONDS = 60
+POLL_INTERVAL_SECONDS = 0.05
+PRUNE_EVERY = 1000
+
+# Returned by claim() when the first request is still running after the wait.
+PENDING = object()
+
+
+def make_key(session_id, text):
+    return hashlib.blake2b(f"{session_id}\x00{text}".encode(), digest_size=16).digest()
+
+
+class MemoryResponseCache:
+    """Bounded in-process cache of responses by key, oldest entries evicted first."""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL_SECONDS, max_entries=IDEMPOTENCY_MAX_ENTRIES,
+                 wait_seconds=IDEMPOTENCY_WAIT_SECONDS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_seconds = wait_seconds
+        self._entries = OrderedDict()  # key -> [expires_at, response or None while claimed]
+        self._changed = threading.Condition()
+
+    def claim(self, key):
+        """Claims `key` and returns None, or returns the stored response (or PENDING) if already claimed."""
+        deadline = time.monotonic() + self.wait_seconds
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                entry = self._entries.get(key)
+                if entry is None or entry[0] < now:
+                    self._store(key, now + CLAIM_TIMEOUT_SECONDS, None, now)
+                    return None
+                if entry[1] is not None:
+                    return entry[1]
+                if now >= deadline:
+                    return PENDING
+                self._changed.wait(deadline - now)
+
+    def complete(self, key, response):
+        """Stores the response for a claimed key."""
+        with self._changed:
+            now = time.monotonic()
+            self._store(key, now + self.ttl, response, now)
+            self._changed.notify_all()
+
+    def release(self, key):
+        """Drops a claim whose request failed, so a resend is processed afresh."""
+        with self._changed:
+            self._entries.pop(key, None)
+            self._changed.notify_all()
+
+    def _store(self, key, expires_at, response, now):
+        self._entries[key] = [expires_at, response]
+        self._entries.move_to_end(key)
+        entries = self._entries
+        while entries and (len(entries) > self.max_entries or next(iter(entries.values()))[0] < now):
+            entries.popitem(last=False)
+
+
+class SqliteResponseCache:
+    """Responses by key in the shared SQLite database, pruned of expired keys as it goes."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key BLOB PRIMARY KEY,
+            response TEXT,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idempotency_keys_expires_at ON idempotency_keys (expires_at);
+    """
+
+    def __init__(self, backend, ttl=IDEMPOTENCY_TTL_SECONDS, wait_seconds=IDEMPOTENCY_WAIT_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.wait_seconds = wait_seconds
+        self._claims = 0
+        backend.connection().executescript(self.SCHEMA)
+
+    def claim(self, key):
+        conn = self.backend.connection()
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            now = time.time()
+            # Inserts the claim, or takes over an expired one; returns a row only if we got it.
+            if conn.execute(
+                "INSERT INTO idempotency_keys (key, response, expires_at) VALUES (?, NULL, ?) "
+                "ON CONFLICT (key) DO UPDATE SET response = NULL, expires_at = excluded.expires_at "
+                "WHERE idempotency_keys.expires_at < ? RETURNING 1",
+                (key, now + CLAIM_TIMEOUT_SECONDS, now),
+            ).fetchone():
+                self._maybe_prune(conn, now)
+                return None
+            row = conn.execute("SELECT response FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] is not None:
+                return row[0]
+            if row is not None and time.monotonic() >= deadline:
+                return PENDING
+            if row is not None:
+                time.sleep(POLL_INTERVAL_SECONDS)
+
+    def complete(self, key, response):
+        self.backend.connection().execute(
+            "UPDATE idempotency_keys SET response = ?, expires_at = ? WHERE key = ?",
+            (response, time.time() + self.ttl, key),
+        )
+
+    def release(self, key):
+        self.backend.connection().execute("DELETE FROM idempotency_keys WHERE key = ? AND response IS NULL", (key,))
+
+    def _maybe_prune(self, conn, now):
+        self._claims += 1
+        if self._claims % PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+
+
+cache = SqliteResponseCache(storage.backend) if storage.backend.name == "sqlite" else MemoryResponseCache()
@@ -0,0 +1,280 @@
+import bisect
+import fcntl
+import glob
+import json
+import os
+import threading
+
+# --- Metrics ---
+# Counters and histograms for the /metrics endpoint (Prometheus text format).
+#
+# Each thread writes to its own shard, so recording a value takes no lock: the
+# hot path is a thread-local lookup and a dict update. Shards are only summed
+# when /metrics is scraped. Shards of threads that have exited are folded into
+# a single retired shard so per-request threads do not grow memory.
+#
+# Under the multi-worker production server each process has its own values.
+# When METRICS_DIR is set, every worker periodically writes its totals to a
+# file there and /metrics reports the sum over all the files, so a scrape
+# sees the whole server whichever worker answers it. When a worker exits its
+# file is folded into a single retired file, so counters never go backwards
+# and the number of files stays at one per live worker.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from 100us to 10s (USSD gateways give up after a few seconds).
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MAX_LIVE_SHARDS = 256
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+REGISTRY = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._retired = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                if len(self._shards) >= MAX_LIVE_SHARDS:
+                    self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_dead_shards(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    def _merge(self, into, shard):
+        raise NotImplementedError
+
+    def collect(self):
+        """Returns {labels: value} summed over every thread."""
+        with self._lock:
+            self._retire_dead_shards()
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in self._shards:
+                self._merge(total, dict(shard))
+            return total
+
+    def _label_string(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs: return ""
+        return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples(self.collect() if values is None else values))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, into, shard):
+        for labels, value in shard.items():
+            into[labels] = into.get(labels, 0) + value
+
+    def _render_samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{self._label_string(labels)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        # Layout: one count per bucket, an overflow count, then the sum.
+        data = shard.get(labels)
+        if data is None:
+            data = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def _merge(self, into, shard):
+        for labels, data in shard.items():
+            current = into.get(labels)
+            if current is None:
+                into[labels] = list(data)
+            else:
+                for i, value in enumerate(data):
+                    current[i] += value
+
+    def _render_samples(self, values):
+        for labels, data in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                yield f"{self.name}_bucket{self._label_string(labels, [('le', repr(bound))])} {cumulative}"
+            cumulative += data[len(self.buckets)]
+            yield f"{self.name}_bucket{self._label_string(labels, [('le', '+Inf')])} {cumulative}"
+            yield f"{self.name}_sum{self._label_string(labels)} {data[-1]!r}"
+            yield f"{self.name}_count{self._label_string(labels)} {cumulative}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render():
+    """Renders every registered metric in the Prometheus text exposition format."""
+    merged = _read_snapshots() if METRICS_DIR else {}
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(merged.get(metric.name) if METRICS_DIR else None))
+    return "\n".join(lines) + "\n"
+
+
+# --- Multi-Process Aggregation ---
+
+def write_snapshot():
+    """Writes this process's totals to METRICS_DIR (atomically)."""
+    if not METRICS_DIR: return
+    _write_file(f"worker-{os.getpid()}.json", {m.name: m.collect() for m in REGISTRY})
+
+
+def _write_file(filename, totals):
+    snapshot = {name: [[list(labels), value] for labels, value in values.items()] for name, values in totals.items()}
+    path = os.path.join(METRICS_DIR, filename)
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+
+
+def _merge_file(merged, path):
+    by_name = {m.name: m for m in REGISTRY}
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return False
+    for name, samples in snapshot.items():
+        metric = by_name.get(name)
+        if metric is None: continue
+        metric._merge(merged.setdefault(name, {}), {tuple(labels): value for labels, value in samples})
+    return True
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def retire_snapshot(pid):
+    """Folds the file of an exited worker into the retired totals and removes it."""
+    if not METRICS_DIR: return
+    path = os.path.join(METRICS_DIR, f"worker-{pid}.json")
+    # Scrapes in several workers may retire the same file at once.
+    with open(os.path.join(METRICS_DIR, "retired.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(path): return
+        retired = {}
+        _merge_file(retired, os.path.join(METRICS_DIR, "retired.json"))
+        if _merge_file(retired, path):
+            _write_file("retired.json", retired)
+        os.remove(path)
+
+
+def _read_snapshots():
+    write_snapshot()
+    merged = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "worker-*.json")):
+        pid = int(os.path.basename(path)[len("worker-"):-len(".json")])
+        if not _pid_alive(pid):
+            retire_snapshot(pid)
+    with open(os.path.join(METRICS_DIR, "retired.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        _merge_file(merged, os.path.join(METRICS_DIR, "retired.json"))
+        for path in glob.glob(os.path.join(METRICS_DIR, "worker-*.json")):
+            _merge_file(merged, path)
+    return merged
+
+
+def clear_snapshots():
+    """Removes old worker files. Called once by the server master at start-up."""
+    if not METRICS_DIR: return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(METRICS_DIR, "worker-*.json*")) + \
+            glob.glob(os.path.join(METRICS_DIR, "retired.*")):
+        os.remove(path)
+
+
+_flusher_pid = None
+
+
+def start_flusher():
+    """Starts a thread in this worker that writes its snapshot every METRICS_FLUSH_SECONDS."""
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid(): return
+    _flusher_pid = os.getpid()
+    # A file under this PID was left by an earlier process that had it.
+    retire_snapshot(os.getpid())
+
+    def flush():
+        while True:
+            threading.Event().wait(METRICS_FLUSH_SECONDS)
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+
+    threading.Thread(target=flush, name="metrics-flusher", daemon=True).start()
+
+
+# --- USSD Service Metrics ---
+
+HOP_LATENCY = Histogram("ussd_hop_latency_seconds", "Time to handle one USSD callback hop.", ("flow", "step"))
+VALIDATION_FAILURES = Counter("ussd_validation_failures_total", "User input rejected by validation.", ("field",))
+STORAGE_LATENCY = Histogram("ussd_storage_latency_seconds", "Time spent in registration storage calls.", ("operation",))
+SMS_LATENCY = Histogram("ussd_sms_latency_seconds", "Time spent handing an SMS to the gateway.")
+SESSIONS_STARTED = Counter("ussd_sessions_started_total", "Sessions that reached the main menu.")
+SESSIONS_ENDED = Counter("ussd_sessions_ended_total", "Sessions ended with an END response.", ("flow",))
+UBRNS_ISSUED = Counter("ussd_ubrns_issued_total", "UBRNs issued for new registrations.", ("region_code",))
+CALLBACK_ERRORS = Counter("ussd_callback_errors_total", "Unhandled errors in the USSD callback.")
+SLOW_HOPS = Counter("ussd_slow_hops_total", "Hops that exceeded their step's latency budget.", ("step",))
+IDEMPOTENT_REPLAYS = Counter("ussd_idempotent_replays_total", "Gateway resends of a confirm hop answered without resubmitting.", ("outcome",))
+RATE_LIMITED = Counter("ussd_rate_limited_total", "Hops refused because the phone number exceeded its flow's rate limit.", ("flow",))
+SESSIONS_SHED = Counter("ussd_sessions_shed_total", "New sessions turned away because the worker was overloaded.", ("reason",))
+BULK_ROWS = Counter("ussd_bulk_rows_total", "Rows of facility bulk uploads, by outcome.", ("outcome",))
+NIN_LOOKUPS = Counter("ussd_nin_lookups_total", "Ghana Card lookups made with the NIA identity API, by result.", ("result",))
+NIN_LOOKUP_LATENCY = Histogram("ussd_nin_lookup_latency_seconds", "Time taken by one NIA identity API lookup.")
+NIN_CHECKS = Counter("ussd_nin_checks_total", "Mother's Ghana Card checks at the confirm hop, by outcome and whether the result was already cached.", ("outcome", "source"))
+DUPLICATE_REGISTRATIONS = Counter("ussd_duplicate_registrations_total", "USSD registrations matching an existing registration of the same child, by action taken.", ("action",))
+REFERENCE_RELOADS = Counter("ussd_reference_reloads_total", "Loads of the region and district data file, by outcome.", ("outcome",))
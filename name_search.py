@@ -0,0 +1,275 @@
+import functools
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from itertools import islice
+
+import storage
+
+# --- Child Name Search ---
+# Registrars look children up by name, and names typed on a phone keypad come
+# in many spellings (Kwame, Kwamé, Quame, Kwam). Rather than scan every
+# registration, names are indexed word by word as they are saved:
+#
+#   word -> the UBRNs whose child's name has that word        (postings)
+#   phonetic key -> the words with that key                    (by sound)
+#   trigram -> the words containing that three-letter run      (by spelling)
+#
+# The phonetic and trigram indexes are over the distinct words only, which
+# stay few (tens of thousands) however many births are registered.
+#
+# A search finds, for each word of the query, the indexed words that sound
+# the same or share enough trigrams with it, and scores each one from 0 to 1.
+# Candidates come from the postings of the query word with the fewest
+# registrations, best-scoring words first, up to SEARCH_MAX_CANDIDATES. Each
+# candidate's whole name is then scored against the whole query and the best
+# are returned. A very common single word (e.g. "Kwame") may match more
+# registrations than are looked at; adding another word of the name narrows
+# the search.
+#
+# The phonetic key is a consonant skeleton tuned for Ghanaian names: accents
+# are dropped, qu/kw, c/k/s, dz/gy/j, ch/ky/ts and ph/f sound alike, and
+# vowels after the first letter are ignored, so Kwame, Kwamé, Quame and Kwam
+# all have the key KWM.
+
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_CANDIDATES = int(os.environ.get("SEARCH_MAX_CANDIDATES", "1000"))
+# Trigram similarity (Jaccard) below which a word is not a match.
+SEARCH_MIN_SIMILARITY = float(os.environ.get("SEARCH_MIN_SIMILARITY", "0.4"))
+# Score of a word that sounds the same but is spelt quite differently.
+PHONETIC_SCORE = 0.75
+MAX_QUERY_WORDS = 5
+
+RESULT_FIELDS = ("ubrn", "baby_name", "dob", "sex", "region_code", "district_code", "status")
+
+_NOT_LETTERS = re.compile(r"[^a-z]+")
+_PHONETIC_RULES = [(re.compile(pattern), replacement) for pattern, replacement in (
+    (r"tch|ch|ky|ts", "C"), (r"qu", "kw"), (r"q", "k"), (r"ph", "f"), (r"ck", "k"), (r"c(?=[eiy])", "s"),
+    (r"c", "k"), (r"x", "ks"), (r"gh", "g"), (r"dz|gy|dj", "j"), (r"sh", "s"),
+)]
+_VOWELS = frozenset("aeiou")
+
+
+def fold(name):
+    """Lower case, accents removed, anything but letters turned into spaces."""
+    if not name.isascii():
+        name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    return _NOT_LETTERS.sub(" ", name.lower())
+
+
+def name_words(name):
+    """The words of a child's name as indexed; none for a name that was not given."""
+    if not name or name in ("N/A", "0"): return []
+    return fold(name).split()
+
+
+@functools.lru_cache(maxsize=65536)
+def phonetic_key(word):
+    for pattern, replacement in _PHONETIC_RULES:
+        word = pattern.sub(replacement, word)
+    key = ["A" if word[0] in _VOWELS else word[0].upper()]
+    previous = word[0]
+    for c in word[1:]:
+        if c in _VOWELS or c == "h" or (c in "wy" and (previous in _VOWELS or previous in "wy")):
+            previous = c
+            continue
+        c = c.upper()
+        if c != key[-1]:
+            key.append(c)
+        previous = c.lower()
+    return "".join(key)
+
+
+def trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# --- Index Backends ---
+
+class MemoryNameIndex:
+    """The name index in this process, next to the memory storage backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.postings = {}  # word -> set of UBRNs
+        self.by_key = {}  # phonetic key -> set of words
+        self.by_trigram = {}  # trigram -> set of words
+        self._lock = threading.Lock()
+
+    def add(self, ubrn, name):
+        self.add_many([(ubrn, name)])
+
+    def add_many(self, entries):
+        """Indexes (ubrn, child's name) pairs."""
+        with self._lock:
+            for ubrn, name in entries:
+                for word in set(name_words(name)):
+                    postings = self.postings.get(word)
+                    if postings is None:
+                        postings = self.postings[word] = set()
+                        self.by_key.setdefault(phonetic_key(word), set()).add(word)
+                        for trigram in trigrams(word):
+                            self.by_trigram.setdefault(trigram, set()).add(word)
+                    postings.add(ubrn)
+
+    def words_with_key(self, key):
+        """(word, registrations) for the indexed words with this phonetic key."""
+        with self._lock:
+            return [(word, len(self.postings[word])) for word in self.by_key.get(key, ())]
+
+    def words_sharing_trigrams(self, word_trigrams, min_shared):
+        """(word, shared trigrams, registrations) for indexed words sharing at least min_shared trigrams."""
+        shared = {}
+        with self._lock:
+            for trigram in word_trigrams:
+                for word in self.by_trigram.get(trigram, ()):
+                    shared[word] = shared.get(word, 0) + 1
+            return [(word, count, len(self.postings[word])) for word, count in shared.items() if count >= min_shared]
+
+    def names_with(self, word, limit):
+        """(ubrn, child's name) for up to `limit` registrations whose child's name has this word."""
+        with self._lock:
+            ubrns = list(islice(self.postings.get(word, ()), limit))
+        registrations = self.backend.registrations
+        return [(ubrn, registrations[ubrn]["baby_name"]) for ubrn in ubrns]
+
+    def records(self, ubrns):
+        return [self.backend.get_registration(ubrn) for ubrn in ubrns]
+
+
+class SqliteNameIndex:
+    """The name index in the shared SQLite database, written in the same transaction as the registration."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS name_words (
+            word TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            postings INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS name_words_key ON name_words (key);
+        CREATE TABLE IF NOT EXISTS name_trigrams (
+            trigram TEXT NOT NULL, word TEXT NOT NULL,
+            PRIMARY KEY (trigram, word)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS name_postings (
+            word TEXT NOT NULL, ubrn TEXT NOT NULL,
+            name TEXT NOT NULL,  -- a copy, so candidates are read from this table alone
+            PRIMARY KEY (word, ubrn)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        backend.connection().executescript(self.SCHEMA)
+
+    def add(self, ubrn, name):
+        self.add_many([(ubrn, name)])
+
+    def add_many(self, entries):
+        # Decided by what the tables already hold, inside the caller's transaction,
+        # so a rolled-back registration leaves nothing behind.
+        conn = self.backend.connection()
+        for ubrn, name in entries:
+            for word in set(name_words(name)):
+                if not conn.execute("INSERT OR IGNORE INTO name_postings (word, ubrn, name) VALUES (?, ?, ?)",
+                                    (word, ubrn, name)).rowcount:
+                    continue  # already indexed under this word; do not count it twice
+                postings, = conn.execute(
+                    "INSERT INTO name_words (word, key, postings) VALUES (?, ?, 1) "
+                    "ON CONFLICT (word) DO UPDATE SET postings = postings + 1 RETURNING postings",
+                    (word, phonetic_key(word))).fetchone()
+                if postings == 1:  # a new word
+                    conn.executemany("INSERT OR IGNORE INTO name_trigrams (trigram, word) VALUES (?, ?)",
+                                     ((trigram, word) for trigram in trigrams(word)))
+
+    def words_with_key(self, key):
+        return self.backend.connection().execute(
+            "SELECT word, postings FROM name_words WHERE key = ?", (key,)).fetchall()
+
+    def words_sharing_trigrams(self, word_trigrams, min_shared):
+        return self.backend.connection().execute(
+            "SELECT t.word, count(*), w.postings FROM name_trigrams t JOIN name_words w ON w.word = t.word "
+            "WHERE t.trigram IN (SELECT value FROM json_each(?)) GROUP BY t.word HAVING count(*) >= ?",
+            (json.dumps(sorted(word_trigrams)), min_shared)).fetchall()
+
+    def names_with(self, word, limit):
+        return self.backend.connection().execute(
+            "SELECT ubrn, name FROM name_postings WHERE word = ? LIMIT ?", (word, limit)).fetchall()
+
+    def records(self, ubrns):
+        rows = self.backend.connection().execute(
+            f"SELECT {', '.join(RESULT_FIELDS)} FROM registrations WHERE ubrn IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(ubrns)),))
+        return [dict(row) for row in rows]
+
+    def rebuild(self, batch_rows=10000):
+        """Indexes every registration afresh, e.g. for a database saved before names were indexed."""
+        conn = self.backend.connection()
+        with self.backend.transaction():
+            conn.execute("DELETE FROM name_postings")
+            conn.execute("DELETE FROM name_trigrams")
+            conn.execute("DELETE FROM name_words")
+            rows = conn.execute("SELECT ubrn, baby_name FROM registrations")
+            while True:
+                batch = rows.fetchmany(batch_rows)
+                if not batch: break
+                self.add_many([(row[0], row[1]) for row in batch])
+
+
+# --- Search ---
+
+def word_matches(index, query_word):
+    """{indexed word: (score, registrations)} for the words matching one word of a query."""
+    matches = {}
+    for word, count in index.words_with_key(phonetic_key(query_word)):
+        matches[word] = (PHONETIC_SCORE, count)
+    query_trigrams = trigrams(query_word)
+    # The similarity is at most shared / len(query_trigrams), so fewer shared trigrams cannot match.
+    min_shared = max(1, math.ceil(SEARCH_MIN_SIMILARITY * len(query_trigrams) - 1e-9))
+    for word, shared, count in index.words_sharing_trigrams(query_trigrams, min_shared):
+        similarity = shared / (len(query_trigrams) + len(trigrams(word)) - shared)
+        if similarity >= SEARCH_MIN_SIMILARITY and similarity > matches.get(word, (0.0,))[0]:
+            matches[word] = (similarity, count)
+    return matches
+
+
+def search(query, limit=SEARCH_LIMIT, name_index=None):
+    """The registrations whose child's name best matches `query`, best first, each with a "score" from 0 to 1."""
+    name_index = name_index or index
+    query_words = list(dict.fromkeys(name_words(query)))[:MAX_QUERY_WORDS]
+    if not query_words: return []
+    matches = [word_matches(name_index, word) for word in query_words]
+    # Candidates come from the query word matching the fewest registrations.
+    driving = min(matches, key=lambda found: sum(count for _, count in found.values()))
+    candidates, budget = {}, SEARCH_MAX_CANDIDATES
+    for word, _ in sorted(driving.items(), key=lambda item: -item[1][0]):
+        if budget <= 0: break
+        for ubrn, name in name_index.names_with(word, budget):
+            if ubrn not in candidates:
+                candidates[ubrn] = name
+                budget -= 1
+
+    # Every indexed word that matches a query word at all is in its matches.
+    word_scores = [{word: score for word, (score, _) in found.items()} for found in matches]
+    name_scores = {}  # many candidates share a name
+    ranked = []
+    for ubrn, name in candidates.items():
+        score = name_scores.get(name)
+        if score is None:
+            record_words = name_words(name)
+            total = sum(max((scores.get(word, 0.0) for word in record_words), default=0.0) for scores in word_scores)
+            score = name_scores[name] = total / len(query_words)
+        ranked.append((-score, ubrn))
+    ranked.sort()
+    best = ranked[:limit]
+    records = {record["ubrn"]: record for record in name_index.records([ubrn for _, ubrn in best]) if record}
+    return [{**{field: records[ubrn][field] for field in RESULT_FIELDS}, "score": round(-score, 3)}
+            for score, ubrn in best if ubrn in records]
+
+
+index = SqliteNameIndex(storage.backend) if storage.backend.name == "sqlite" else MemoryNameIndex(storage.backend)
@@ -0,0 +1,172 @@
+import asyncio
+import concurrent.futures
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+
+import metrics
+
+# --- Ghana Card Verification ---
+# validate_nin() only checks the shape of a Ghana Card number. Before a
+# registration is submitted, the mother's card is looked up with the NIA
+# identity API at NIA_URL: GET <NIA_URL>/<nin> answers 200 if the card
+# exists and 404 if it does not.
+#
+# The lookup is too slow to make on the hop that needs it, so it is started in
+# the background as soon as the mother's number is entered (and again on the
+# next hop, in case that reaches another worker). By the confirm hop, after
+# the parent has typed the father's number and read the summary, the answer
+# is normally in the cache; otherwise the confirm hop waits at most
+# NIA_WAIT_SECONDS for it.
+#
+# Results are kept in a least-recently-used cache: cards that exist for
+# NIA_CACHE_TTL_SECONDS, cards that do not for the shorter
+# NIA_NEGATIVE_TTL_SECONDS (a card may be issued in the meantime). Failed or
+# late lookups are not cached, and the registration goes ahead unverified as
+# it did before; only a card the NIA says does not exist is turned away.
+# Without NIA_URL no lookups are made.
+
+NIA_URL = os.environ.get("NIA_URL", "").rstrip("/")
+NIA_API_KEY = os.environ.get("NIA_API_KEY", "")
+NIA_TIMEOUT = float(os.environ.get("NIA_TIMEOUT", "3"))
+NIA_WAIT_SECONDS = float(os.environ.get("NIA_WAIT_SECONDS", "1"))
+NIA_CACHE_SIZE = int(os.environ.get("NIA_CACHE_SIZE", "100000"))
+NIA_CACHE_TTL_SECONDS = float(os.environ.get("NIA_CACHE_TTL_SECONDS", "86400"))
+NIA_NEGATIVE_TTL_SECONDS = float(os.environ.get("NIA_NEGATIVE_TTL_SECONDS", "600"))
+NIA_THREADS = int(os.environ.get("NIA_THREADS", "8"))
+# Set to 0 to look cards up only at the confirm hop.
+NIA_PREFETCH = os.environ.get("NIA_PREFETCH", "1") == "1"
+
+VERIFIED = "verified"
+NOT_FOUND = "not_found"
+UNAVAILABLE = "unavailable"
+
+log = logging.getLogger("ussd.nia")
+
+
+def lookup(url, nin, timeout=NIA_TIMEOUT, api_key=NIA_API_KEY):
+    """Asks the NIA whether a card exists: VERIFIED, NOT_FOUND or UNAVAILABLE."""
+    headers = {"Accept": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    req = urllib.request.Request(f"{url}/{urllib.parse.quote(nin)}", headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            json.loads(response.read() or b"{}")
+        outcome = VERIFIED
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            outcome = NOT_FOUND
+        else:
+            log.warning("NIA: Lookup failed with HTTP %d.", e.code)
+            outcome = UNAVAILABLE
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        log.warning("NIA: Lookup failed: %s", e)
+        outcome = UNAVAILABLE
+    metrics.NIN_LOOKUP_LATENCY.observe(time.perf_counter() - started)
+    metrics.NIN_LOOKUPS.inc((outcome,))
+    return outcome
+
+
+class NinVerifier:
+    """Cached, deduplicated background lookups of Ghana Card numbers."""
+
+    def __init__(self, url=NIA_URL, cache_size=NIA_CACHE_SIZE, ttl=NIA_CACHE_TTL_SECONDS,
+                 negative_ttl=NIA_NEGATIVE_TTL_SECONDS, wait_seconds=NIA_WAIT_SECONDS,
+                 threads=NIA_THREADS, prefetch=NIA_PREFETCH):
+        self.url = url
+        self.cache_size = cache_size
+        self.ttls = {VERIFIED: ttl, NOT_FOUND: negative_ttl}
+        self.wait_seconds = wait_seconds
+        self.threads = threads
+        self.prefetching = prefetch
+        self._cache = OrderedDict()  # nin -> (expires_at, outcome)
+        self._in_flight = {}  # nin -> Future of its lookup
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    @property
+    def enabled(self):
+        return bool(self.url)
+
+    def prefetch(self, nin):
+        """Starts looking up `nin` in the background unless it is cached or already being looked up."""
+        if self.enabled and self.prefetching:
+            self._lookup(nin.upper())
+
+    def check(self, nin):
+        """The outcome for `nin`, waiting up to wait_seconds for a lookup; None if verification is off."""
+        if not self.enabled: return None
+        future, cached = self._lookup(nin.upper())
+        try:
+            outcome = future.result(self.wait_seconds)
+        except concurrent.futures.TimeoutError:
+            outcome = UNAVAILABLE
+        except Exception as e:
+            # A lookup that raised is not an answer; go ahead unverified.
+            log.warning("NIA: Lookup for the confirm hop failed: %s", e)
+            outcome = UNAVAILABLE
+        metrics.NIN_CHECKS.inc((outcome, "cache" if cached else "lookup"))
+        return outcome
+
+    async def check_async(self, nin):
+        """Asyncio version of check(); the wait does not hold up the event loop."""
+        if not self.enabled: return None
+        future, cached = self._lookup(nin.upper())
+        try:
+            # Shielded so that giving up on the wait leaves the lookup to fill the cache.
+            outcome = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.wait_seconds)
+        except asyncio.TimeoutError:
+            outcome = UNAVAILABLE
+        except Exception as e:
+            log.warning("NIA: Lookup for the confirm hop failed: %s", e)
+            outcome = UNAVAILABLE
+        metrics.NIN_CHECKS.inc((outcome, "cache" if cached else "lookup"))
+        return outcome
+
+    def _lookup(self, nin):
+        # Returns (future, cached): a finished future for a cached outcome, else the lookup's.
+        with self._lock:
+            if self._pool_pid != os.getpid():
+                # A forked worker: the parent's lookup threads and their futures were not copied.
+                self._pool = concurrent.futures.ThreadPoolExecutor(self.threads, thread_name_prefix="nia")
+                self._pool_pid = os.getpid()
+                self._in_flight = {}
+            entry = self._cache.get(nin)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._cache.move_to_end(nin)
+                    future = concurrent.futures.Future()
+                    future.set_result(entry[1])
+                    return future, True
+                del self._cache[nin]
+            future = self._in_flight.get(nin)
+            started = future is None
+            if started:
+                future = self._in_flight[nin] = self._pool.submit(lookup, self.url, nin)
+        if started:
+            # Outside the lock: a lookup that has already finished runs the callback right here.
+            future.add_done_callback(lambda done: self._store(nin, done))
+        return future, False
+
+    def _store(self, nin, future):
+        outcome = UNAVAILABLE if future.cancelled() or future.exception() else future.result()
+        with self._lock:
+            self._in_flight.pop(nin, None)
+            if outcome == UNAVAILABLE: return
+            self._cache[nin] = (time.monotonic() + self.ttls[outcome], outcome)
+            self._cache.move_to_end(nin)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+verifier = NinVerifier()
@@ -0,0 +1,187 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+# --- On-Demand Profiler ---
+# Profiles the USSD callback under real traffic without a restart. Starting a
+# profile swaps the handler in its dispatch table for a profiling wrapper and
+# stopping puts the original back, so there is no cost at all while profiling
+# is off.
+#
+# Two views are collected at once:
+#   * cProfile, per request and per thread, merged into one pstats file.
+#   * A sampling thread that snapshots the stacks of threads inside the
+#     handler, written as collapsed stacks ("a;b;c 12") for flamegraph tools.
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))
+MAX_PROFILE_SECONDS = 600
+
+log = logging.getLogger("ussd.profiler")
+
+
+class ProfilingSession:
+    def __init__(self, table, key, max_requests=None, max_seconds=None, sample_interval=PROFILE_SAMPLE_INTERVAL):
+        self.table = table
+        self.key = key
+        self.original = table[key]
+        self.max_requests = max_requests
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + min(max_seconds or MAX_PROFILE_SECONDS, MAX_PROFILE_SECONDS)
+        self.sample_interval = sample_interval
+        self.requests = 0
+        self.samples = 0
+        self.stats = None
+        self.stacks = Counter()
+        self.active_threads = set()
+        self.result = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+        self.wrapper = self._make_wrapper()
+
+    def _make_wrapper(self):
+        original = self.original
+
+        @wraps(original)
+        def profiled(*args, **kwargs):
+            if self._stopped.is_set():
+                return original(*args, **kwargs)
+            ident = threading.get_ident()
+            profile = cProfile.Profile()
+            self.active_threads.add(ident)
+            try:
+                return profile.runcall(original, *args, **kwargs)
+            finally:
+                self.active_threads.discard(ident)
+                self._add_profile(profile)
+
+        self._wrapper_code = profiled.__code__
+        return profiled
+
+    def _add_profile(self, profile):
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.requests += 1
+            done = (self.max_requests is not None and self.requests >= self.max_requests)
+        if done or time.monotonic() >= self.deadline:
+            self.stop()
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.sample_interval):
+            if time.monotonic() >= self.deadline:
+                self.stop()
+                break
+            frames = sys._current_frames()
+            stacks = [self._collapse(frames[ident]) for ident in list(self.active_threads) if ident in frames]
+            # Under the lock, as the stacks are read while the profile runs.
+            with self._lock:
+                self.stacks.update(stacks)
+                self.samples += len(stacks)
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            if code is self._wrapper_code: break
+            if code.co_filename != cProfile.__file__:
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def start(self):
+        self.table[self.key] = self.wrapper
+        self._sampler.start()
+        log.info("PROFILER: Started on %s (requests=%s).", self.key, self.max_requests)
+
+    def stop(self):
+        with self._lock:
+            if self._stopped.is_set(): return
+            self._stopped.set()
+            self.table[self.key] = self.original
+        self.result = self._dump()
+        log.info("PROFILER: Stopped after %d requests, %d samples.", self.requests, self.samples)
+
+    def _dump(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{self.key}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}")
+        result = {"requests": self.requests, "samples": self.samples, "pstats": None, "collapsed": None}
+        with self._lock:
+            if self.stats is not None:
+                self.stats.dump_stats(base + ".pstats")
+                result["pstats"] = base + ".pstats"
+            stacks = self.stacks.copy()
+        with open(base + ".collapsed", "w") as f:
+            for stack, count in stacks.most_common():
+                if stack: f.write(f"{stack} {count}\n")
+        result["collapsed"] = base + ".collapsed"
+        return result
+
+    def status(self):
+        return {
+            "target": self.key,
+            "running": not self._stopped.is_set(),
+            "started_at": self.started_at,
+            "requests": self.requests,
+            "max_requests": self.max_requests,
+            "samples": self.samples,
+            "result": self.result,
+        }
+
+    def top_functions(self, limit=40, sort="cumulative"):
+        """Text report of the most expensive functions so far."""
+        with self._lock:
+            if self.stats is None: return ""
+            out = io.StringIO()
+            stats = pstats.Stats(stream=out)
+            stats.add(self.stats)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def collapsed(self):
+        with self._lock:
+            stacks = self.stacks.copy()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common() if stack)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def start(table, key, max_requests=None, max_seconds=None):
+    """Starts profiling table[key] for the next `max_requests` calls or `max_seconds`.
+
+    Raises RuntimeError if a profile is already running.
+    """
+    global _session
+    with _session_lock:
+        if running():
+            raise RuntimeError("A profile is already running.")
+        _session = ProfilingSession(table, key, max_requests, max_seconds)
+        _session.start()
+        return _session
+
+
+def stop():
+    if _session is not None:
+        _session.stop()
+    return _session
+
+
+def current():
+    return _session
+
+
+def running():
+    """True while a profile is collecting."""
+    return _session is not None and not _session._stopped.is_set()
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+
+# --- Per-Phone Rate Limiting ---
+# Limits how fast one phone number can move through each flow, so a single
+# MSISDN or script cannot hammer /callback or brute-force UBRNs through the
+# verification menu. Uses GCRA (the generic cell rate algorithm): each
+# (flow, phone) key keeps one timestamp, the "theoretical arrival time", so
+# a check is O(1) and needs no list of past requests. A limit of N/T allows a
+# burst of N hops and then one every T/N seconds.
+#
+# Limits are set per flow with RATE_LIMITS, e.g. "default=60/60,verify=10/300";
+# flows without an entry use "default", and an empty value turns limiting
+# off. With the sqlite storage backend the timestamps are in the shared
+# database, so the limit holds across all worker processes.
+
+RATE_LIMITS = os.environ.get("RATE_LIMITS", "default=60/60,verify=10/300")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+PRUNE_EVERY = 1000
+
+
+def parse_limits(spec):
+    """Parses "flow=count/seconds,..." into {flow: (interval, period)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        flow, _, rate = item.partition("=")
+        count, _, seconds = rate.partition("/")
+        try:
+            count, seconds = int(count), float(seconds)
+        except ValueError:
+            raise ValueError(f"Invalid RATE_LIMITS entry '{item}' (expected flow=count/seconds).") from None
+        if count <= 0 or seconds <= 0:
+            raise ValueError(f"Invalid RATE_LIMITS entry '{item}' (count and seconds must be positive).")
+        limits[flow.strip()] = (seconds / count, seconds)
+    return limits
+
+
+class MemoryRateLimiter:
+    """GCRA state in this process, least recently used keys evicted first."""
+
+    def __init__(self, limits, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.limits = limits
+        self.max_keys = max_keys
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, phone_number, flow):
+        """Counts one hop for (phone, flow) and returns False if it is over the limit."""
+        limit = self.limits.get(flow) or self.limits.get("default")
+        if limit is None or not phone_number: return True
+        interval, period = limit
+        key = (flow, phone_number)
+        now = time.monotonic()
+        with self._lock:
+            tat = max(self._tats.get(key, now), now) + interval
+            if tat - now > period:
+                return False
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            tats = self._tats
+            # Keys whose arrival time has passed hold no state, so they go first.
+            while tats and (len(tats) > self.max_keys or next(iter(tats.values())) < now):
+                tats.popitem(last=False)
+        return True
+
+
+class SqliteRateLimiter:
+    """GCRA state in the shared SQLite database; each check is one UPSERT."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            tat REAL NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+        self._checks = 0
+        backend.connection().executescript(self.SCHEMA)
+
+    def allow(self, phone_number, flow):
+        limit = self.limits.get(flow) or self.limits.get("default")
+        if limit is None or not phone_number: return True
+        interval, period = limit
+        now = time.time()
+        conn = self.backend.connection()
+        # Returns a row only if the hop is within the limit; otherwise nothing is written.
+        allowed = conn.execute(
+            "INSERT INTO rate_limits (key, tat) VALUES (:key, :now + :interval) "
+            "ON CONFLICT (key) DO UPDATE SET tat = max(tat, :now) + :interval "
+            "WHERE max(tat, :now) + :interval - :now <= :period RETURNING 1",
+            {"key": f"{flow}:{phone_number}", "now": now, "interval": interval, "period": period},
+        ).fetchone() is not None
+        self._checks += 1
+        if self._checks % PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+        return allowed
+
+
+def create_limiter(spec=RATE_LIMITS, backend=storage.backend):
+    limits = parse_limits(spec)
+    if backend.name == "sqlite":
+        return SqliteRateLimiter(backend, limits)
+    return MemoryRateLimiter(limits)
+
+
+limiter = create_limiter()
@@ -0,0 +1,97 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from log_config import hash_phone, redact, redact_ussd_text
+
+# --- Traffic Recorder ---
+# Opt-in recording of /callback traffic for replaying with tools/replay.py.
+# Set TRAFFIC_RECORD_PATH to a file and every hop is appended to it as one
+# JSON line:
+#   {"t": arrival time, "s": sessionId, "p": phone hash, "x": redacted text,
+#    "step": step name, "r": first line of the response, "ms": handler time}
+# The text is redacted as in the logs (Ghana Card numbers, UBRNs and free
+# text are replaced by placeholders), so the file holds no personal data.
+# Only the first line of the response is kept, which is the menu title and
+# not what the user entered.
+#
+# Lines are queued by the request thread and written in batches by a
+# background thread. Every worker appends to the same file and each batch is a
+# single O_APPEND write, so lines from different workers never interleave.
+# If the writer falls behind, lines are dropped rather than slowing requests.
+
+TRAFFIC_RECORD_PATH = os.environ.get("TRAFFIC_RECORD_PATH", "")
+RECORD_QUEUE_SIZE = 100000
+RECORD_BATCH_SIZE = 1000
+
+log = logging.getLogger("ussd.recorder")
+
+
+class TrafficRecorder:
+    def __init__(self, path, maxsize=RECORD_QUEUE_SIZE, batch_size=RECORD_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def record(self, arrival, session_id, phone_number, text, step, response, elapsed):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((arrival, session_id, phone_number, text, step, response, elapsed))
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_worker(self):
+        # Started lazily so that forked server workers get their own writer thread.
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    @staticmethod
+    def format_line(arrival, session_id, phone_number, text, step, response, elapsed):
+        # Redaction happens here on the writer thread, off the request path.
+        return json.dumps({
+            "t": round(arrival, 6), "s": session_id, "p": hash_phone(phone_number),
+            "x": redact_ussd_text(text), "step": step,
+            "r": redact(response.partition("\n")[0]), "ms": round(elapsed * 1000, 3),
+        }, separators=(",", ":")) + "\n"
+
+    def _run(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                os.write(fd, "".join(self.format_line(*item) for item in batch).encode())
+            except Exception:
+                log.exception("RECORDER: Failed to write %d lines to %s.", len(batch), self.path)
+            finally:
+                for _ in batch: self._queue.task_done()
+
+    def drain(self, timeout=5.0):
+        """Waits until all queued lines have been written (used by tools and shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+
+recorder = None
+if TRAFFIC_RECORD_PATH:
+    recorder = TrafficRecorder(TRAFFIC_RECORD_PATH)
+    atexit.register(recorder.drain)
@@ -0,0 +1,373 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+import metrics
+import storage
+
+# --- Region & District Reference Data ---
+# Ghana's regions and districts (MMDAs), with the codes used in UBRNs, come
+# from a versioned data file (data/districts.json, or DISTRICTS_PATH). Each
+# version is built once into a ReferenceData snapshot holding the structures
+# the hops use, so no hop builds a menu or searches a list:
+#
+#   region code -> name, (region code, district code) -> name
+#   menu selection -> region, and per region, menu selection -> district
+#   each menu as ready-made screens
+#
+# A menu too long for one USSD screen (USSD_SCREEN_CHARS, not counting the
+# "CON " prefix) is split into pages. Every page but the last ends with
+# "98. More" and every page but the first with "0. Back". Items keep their
+# number on every page, so a selection means the same whichever page it was
+# typed on.
+#
+# District codes are unique within their region, as a UBRN always carries
+# both. A published code must never change or be reused; a new district gets
+# a new code and the file a new version.
+
+DISTRICTS_PATH = os.environ.get("DISTRICTS_PATH", os.path.join(os.path.dirname(__file__), "data", "districts.json"))
+USSD_SCREEN_CHARS = int(os.environ.get("USSD_SCREEN_CHARS", "182"))
+
+MORE_OPTION = "98"
+BACK_OPTION = "0"
+REGION_MENU_TITLE = "Select Region of Birth:"
+DISTRICT_MENU_TITLE = "Select District:"
+
+log = logging.getLogger("ussd.reference")
+
+
+def _screen(title, lines, back, more):
+    navigation = ([f"{MORE_OPTION}. More"] if more else []) + ([f"{BACK_OPTION}. Back"] if back else [])
+    return "\n".join([title, *lines, *navigation])
+
+
+def paginate(title, names, screen_chars=USSD_SCREEN_CHARS):
+    """The "CON" screens of a numbered menu of `names`, each at most screen_chars long."""
+    pages, lines = [], []
+    for i, name in enumerate(names):
+        line = f"{i + 1}. {name}"
+        more = i + 1 < len(names)
+        if lines and len(_screen(title, lines + [line], bool(pages), more)) > screen_chars:
+            pages.append(lines)
+            lines = []
+        lines.append(line)
+        if len(_screen(title, lines, bool(pages), more)) > screen_chars:
+            raise ValueError(f"Menu item '{name}' does not fit on a {screen_chars}-character screen.")
+    pages.append(lines)
+    return tuple("CON " + _screen(title, lines, i > 0, i + 1 < len(pages)) for i, lines in enumerate(pages))
+
+
+class ReferenceData:
+    """Regions and districts from one version of the data file, with their lookups and menus.
+
+    A snapshot is never changed once built, so hops read it without locks.
+    """
+
+    def __init__(self, document):
+        version = str(document["version"])
+        region_names = {}  # region code -> name
+        district_names = {}  # (region code, district code) -> name
+        regions = {}  # menu selection -> {"name", "code", "districts"}
+        districts = {}  # region selection -> {district selection -> {"name", "code"}}
+        district_menus = {}  # region selection -> screens
+        for number, region in enumerate(document["regions"], 1):
+            region_code = region["code"]
+            if len(region_code) != 2 or not region_code.isdigit() or region_code in region_names:
+                raise ValueError(f"Bad or repeated region code '{region_code}' in version {version}.")
+            if not region["districts"] or len(region["districts"]) >= int(MORE_OPTION):
+                raise ValueError(f"Region {region_code} must have between 1 and {int(MORE_OPTION) - 1} districts.")
+            selection = str(number)
+            region_districts = tuple(MappingProxyType({"name": district["name"], "code": district["code"]})
+                                     for district in region["districts"])
+            for district in region_districts:
+                key = (region_code, district["code"])
+                if len(district["code"]) != 3 or not district["code"].isdigit() or key in district_names:
+                    raise ValueError(f"Bad or repeated district code '{district['code']}' in region {region_code}.")
+                district_names[key] = district["name"]
+            region_names[region_code] = region["name"]
+            regions[selection] = MappingProxyType(
+                {"name": region["name"], "code": region_code, "districts": region_districts})
+            districts[selection] = MappingProxyType({str(i): d for i, d in enumerate(region_districts, 1)})
+            district_menus[selection] = paginate(DISTRICT_MENU_TITLE, [d["name"] for d in region_districts])
+
+        self._set("version", version)
+        self._set("region_names", MappingProxyType(region_names))
+        self._set("district_names", MappingProxyType(district_names))
+        self._set("regions", MappingProxyType(regions))
+        self._set("districts", MappingProxyType(districts))
+        self._set("district_menus", MappingProxyType(district_menus))
+        self._set("region_menu", paginate(REGION_MENU_TITLE, [region["name"] for region in regions.values()]))
+        # Every valid (region_code, district_code) pair, e.g. for checking bulk upload files.
+        self._set("district_codes", frozenset(district_names))
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ReferenceData snapshots cannot be changed; load a new version instead.")
+
+    def region(self, selection):
+        """The region chosen by a region menu selection, or None."""
+        return self.regions.get(selection)
+
+    def district(self, region_selection, selection):
+        """The district chosen by a district menu selection in a region, or None."""
+        return self.districts.get(region_selection, {}).get(selection)
+
+
+def read_document(path=DISTRICTS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load(path=DISTRICTS_PATH):
+    return ReferenceData(read_document(path))
+
+
+# --- Reloading & Session Pinning ---
+# Ghana creates and renames districts from time to time. The data file is
+# checked every REFERENCE_RELOAD_SECONDS (0 turns this off), or on demand
+# from POST /admin/reference-data/reload. A new version is built into a new
+# snapshot in the background, while hops go on using the current one, and
+# then replaces it in a single assignment. A file that fails to load, or
+# whose version has not changed, leaves the current snapshot in place.
+#
+# A session's hops all use the snapshot that was current at its first hop:
+# a session that chose "3" from the district menu must get the district it
+# was shown, even if the menus changed since. Each session is pinned to its
+# version until it ends, or for at most REFERENCE_PIN_SECONDS, longer than
+# any USSD session lives. A snapshot no session is pinned to any more is
+# dropped (except the current one), and freed once the last hop using it
+# finishes.
+#
+# With the sqlite storage backend the pins are in the shared database,
+# together with every version's document. A worker that has not reloaded
+# yet, or has already dropped a version, can then still serve a session
+# pinned to it by another worker.
+
+REFERENCE_RELOAD_SECONDS = float(os.environ.get("REFERENCE_RELOAD_SECONDS", "30"))
+REFERENCE_PIN_SECONDS = float(os.environ.get("REFERENCE_PIN_SECONDS", "600"))
+REFERENCE_MAX_PINS = int(os.environ.get("REFERENCE_MAX_PINS", "200000"))
+PRUNE_EVERY = 1000
+
+
+class MemorySessionPins:
+    """Session -> snapshot version in this process, oldest pins evicted first."""
+
+    def __init__(self, ttl=REFERENCE_PIN_SECONDS, max_entries=REFERENCE_MAX_PINS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._pins = OrderedDict()  # session ID -> (expires_at, version)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            pin = self._pins.get(session_id)
+        return pin[1] if pin is not None and pin[0] >= time.monotonic() else None
+
+    def pin(self, session_id, version):
+        now = time.monotonic()
+        with self._lock:
+            pins = self._pins
+            pins[session_id] = (now + self.ttl, version)
+            pins.move_to_end(session_id)
+            while pins and (len(pins) > self.max_entries or next(iter(pins.values()))[0] < now):
+                pins.popitem(last=False)
+
+    def release(self, session_id):
+        with self._lock:
+            self._pins.pop(session_id, None)
+
+    def versions(self):
+        """{version: sessions pinned to it}."""
+        now, counts = time.monotonic(), {}
+        with self._lock:
+            for expires_at, version in self._pins.values():
+                if expires_at >= now:
+                    counts[version] = counts.get(version, 0) + 1
+        return counts
+
+    def keep_document(self, version, document):
+        pass  # only this process serves its sessions
+
+    def document(self, version):
+        return None
+
+
+class SqliteSessionPins:
+    """Pins and version documents in the shared SQLite database, seen by every worker."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reference_pins (
+            session_id TEXT PRIMARY KEY,
+            version TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS reference_versions (
+            version TEXT PRIMARY KEY,
+            document TEXT NOT NULL,
+            loaded_at REAL NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, backend, ttl=REFERENCE_PIN_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self._pinned = 0
+        backend.connection().executescript(self.SCHEMA)
+
+    def get(self, session_id):
+        row = self.backend.connection().execute(
+            "SELECT version FROM reference_pins WHERE session_id = ? AND expires_at >= ?",
+            (session_id, time.time())).fetchone()
+        return row[0] if row is not None else None
+
+    def pin(self, session_id, version):
+        now = time.time()
+        conn = self.backend.connection()
+        conn.execute("INSERT OR REPLACE INTO reference_pins (session_id, version, expires_at) VALUES (?, ?, ?)",
+                     (session_id, version, now + self.ttl))
+        self._pinned += 1
+        if self._pinned % PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM reference_pins WHERE expires_at < ?", (now,))
+
+    def release(self, session_id):
+        self.backend.connection().execute("DELETE FROM reference_pins WHERE session_id = ?", (session_id,))
+
+    def versions(self):
+        return dict(self.backend.connection().execute(
+            "SELECT version, count(*) FROM reference_pins WHERE expires_at >= ? GROUP BY version",
+            (time.time(),)).fetchall())
+
+    def keep_document(self, version, document):
+        # Versions are few (a new one when districts change), so all are kept.
+        self.backend.connection().execute(
+            "INSERT OR IGNORE INTO reference_versions (version, document, loaded_at) VALUES (?, ?, ?)",
+            (version, json.dumps(document), time.time()))
+
+    def document(self, version):
+        row = self.backend.connection().execute(
+            "SELECT document FROM reference_versions WHERE version = ?", (version,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+
+class ReferenceStore:
+    """The current snapshot, the older ones sessions are still pinned to, and the file they come from."""
+
+    def __init__(self, pins, path=DISTRICTS_PATH, reload_seconds=REFERENCE_RELOAD_SECONDS):
+        self.pins = pins
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.current = None
+        self._snapshots = {}  # version -> snapshot: the current one and any still pinned
+        self._file_mtime = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._watcher_pid = None
+        self.reload()
+
+    def reload(self):
+        """Loads the data file and makes its snapshot current if its version is new. Returns the current version.
+
+        Raises (keeping the current snapshot) if the file cannot be read or is not valid.
+        """
+        mtime = None
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            document = read_document(self.path)
+            snapshot = ReferenceData(document)
+        except Exception:
+            metrics.REFERENCE_RELOADS.inc(("failed",))
+            # The watcher tries a bad file again only once it has changed.
+            self._file_mtime = mtime
+            raise
+        with self._lock:
+            self._file_mtime = mtime
+            previous = self.current
+            if previous is not None and snapshot.version == previous.version:
+                metrics.REFERENCE_RELOADS.inc(("unchanged",))
+                return previous.version
+            self.pins.keep_document(snapshot.version, document)
+            self._snapshots[snapshot.version] = snapshot
+            self.current = snapshot
+        metrics.REFERENCE_RELOADS.inc(("loaded",))
+        log.info("REFERENCE DATA: Version %s is current (was %s): %d regions, %d districts.", snapshot.version,
+                 previous.version if previous else "none", len(snapshot.region_names), len(snapshot.district_names))
+        self.prune()
+        return snapshot.version
+
+    def for_session(self, session_id, starting):
+        """The snapshot for a hop of this session: the one it is pinned to, or (pinned now) the current one."""
+        self._ensure_watcher()
+        current = self.current
+        if not session_id: return current
+        try:
+            version = None if starting else self.pins.get(session_id)
+            if version is None:
+                self.pins.pin(session_id, current.version)
+                return current
+            if version == current.version: return current
+            return self._snapshots.get(version) or self._restore(version) or current
+        except Exception:
+            # A session is better served from the current data than not at all.
+            log.exception("REFERENCE DATA: Could not read the pin of SessionID %s.", session_id)
+            return current
+
+    def release(self, session_id):
+        """Unpins a session that has ended; a pin left behind just lapses later."""
+        if not session_id: return
+        try:
+            self.pins.release(session_id)
+        except Exception:
+            log.exception("REFERENCE DATA: Could not unpin SessionID %s.", session_id)
+
+    def _restore(self, version):
+        # A version pinned by another worker, or one this worker has already dropped.
+        document = self.pins.document(version)
+        if document is None:
+            log.warning("REFERENCE DATA: Version %s is not available; using version %s.", version, self.current.version)
+            return None
+        snapshot = ReferenceData(document)
+        with self._lock:
+            return self._snapshots.setdefault(version, snapshot)
+
+    def prune(self):
+        """Drops the snapshots, other than the current one, that no session is pinned to."""
+        pinned = self.pins.versions()
+        with self._lock:
+            for version in [v for v in self._snapshots if v != self.current.version and v not in pinned]:
+                del self._snapshots[version]
+                log.info("REFERENCE DATA: Dropped version %s; no session is using it.", version)
+
+    def status(self):
+        pinned = self.pins.versions()
+        with self._lock:
+            loaded = sorted(self._snapshots)
+        return {"current": self.current.version, "loaded": loaded, "pinned_sessions": pinned,
+                "path": self.path, "reload_seconds": self.reload_seconds}
+
+    def _ensure_watcher(self):
+        # Started lazily so that forked server workers each get their own thread.
+        if self.reload_seconds <= 0 or self._watcher_pid == os.getpid(): return
+        with self._lock:
+            if self._watcher_pid == os.getpid(): return
+            self._watcher = threading.Thread(target=self._watch, name="reference-data-reload", daemon=True)
+            self._watcher_pid = os.getpid()
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_seconds)
+            try:
+                if os.stat(self.path).st_mtime_ns != self._file_mtime:
+                    self.reload()
+                self.prune()
+            except Exception:
+                log.exception("REFERENCE DATA: Could not reload %s; keeping version %s.", self.path, self.current.version)
+
+
+store = ReferenceStore(SqliteSessionPins(storage.backend) if storage.backend.name == "sqlite" else MemorySessionPins())
@@ -0,0 +1,127 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import metrics
+from log_config import hash_phone, redact_ussd_text
+
+# --- Slow-Hop Detector ---
+# USSD gateways drop sessions that take more than a few seconds to answer, so
+# every step has a latency budget. A watchdog thread looks at the hops in
+# flight and, the first time one passes its deadline, snapshots that thread's
+# stack. When the hop finishes over budget it is captured with its timing
+# breakdown, the stack and a redacted copy of the request in a bounded buffer.
+#
+# Stacks are only taken under the WSGI server, where each hop has a thread to
+# itself; asgi.py turns capture off.
+
+SLOW_HOP_BUDGET_MS = float(os.environ.get("SLOW_HOP_BUDGET_MS", "200"))
+# Per-step overrides, e.g. "register.confirm=500,verify.ubrn=300".
+SLOW_HOP_BUDGETS = os.environ.get("SLOW_HOP_BUDGETS", "")
+SLOW_HOP_BUFFER = int(os.environ.get("SLOW_HOP_BUFFER", "200"))
+SLOW_HOP_POLL_MS = float(os.environ.get("SLOW_HOP_POLL_MS", "10"))
+MAX_STACK_FRAMES = 40
+
+log = logging.getLogger("ussd.slow_hops")
+
+
+def parse_budgets(spec):
+    """Parses "step=ms,step=ms" into {step: seconds}."""
+    budgets = {}
+    for item in spec.split(","):
+        if "=" not in item: continue
+        step, ms = item.split("=", 1)
+        budgets[step.strip()] = float(ms) / 1000
+    return budgets
+
+
+class _InflightHop:
+    __slots__ = ("thread_id", "step", "deadline", "stack")
+
+    def __init__(self, thread_id, step, deadline):
+        self.thread_id = thread_id
+        self.step = step
+        self.deadline = deadline
+        self.stack = None
+
+
+class SlowHopDetector:
+    def __init__(self, default_budget_ms=SLOW_HOP_BUDGET_MS, budgets=SLOW_HOP_BUDGETS,
+                 buffer_size=SLOW_HOP_BUFFER, poll_ms=SLOW_HOP_POLL_MS, capture_stacks=True):
+        self.default_budget = default_budget_ms / 1000
+        self.budgets = parse_budgets(budgets)
+        self.poll_interval = poll_ms / 1000
+        self.capture_stacks = capture_stacks
+        self.captured = deque(maxlen=buffer_size)
+        self._inflight = {}
+        self._watchdog = None
+        self._watchdog_pid = None
+        self._start_lock = threading.Lock()
+
+    def budget(self, step):
+        return self.budgets.get(step, self.default_budget)
+
+    def begin(self, step):
+        """Registers a hop with the watchdog. Returns a handle for end()."""
+        hop = _InflightHop(threading.get_ident(), step, time.monotonic() + self.budget(step))
+        if self.capture_stacks:
+            self._ensure_watchdog()
+            self._inflight[id(hop)] = hop
+        return hop
+
+    def end(self, hop, elapsed, session_id, phone_number, text, timings):
+        """Unregisters a hop and captures it if it went over budget."""
+        self._inflight.pop(id(hop), None)
+        budget = self.budget(hop.step)
+        if elapsed <= budget: return
+        metrics.SLOW_HOPS.inc((hop.step,))
+        handler_ms = round(elapsed * 1000, 3)
+        breakdown = dict(timings)
+        breakdown["handler_ms"] = handler_ms
+        breakdown["other_ms"] = round(handler_ms - breakdown.get("storage_ms", 0) - breakdown.get("sms_ms", 0), 3)
+        self.captured.append({
+            "captured_at": time.time(),
+            "session_id": session_id,
+            "phone_hash": hash_phone(phone_number),
+            "step": hop.step,
+            "budget_ms": round(budget * 1000, 3),
+            "timings": breakdown,
+            "request_text": redact_ussd_text(text),
+            "stack_at_deadline": hop.stack,
+        })
+        log.warning("SLOW HOP: %s took %.1f ms (budget %.0f ms), session %s.",
+                    hop.step, handler_ms, budget * 1000, session_id)
+
+    def recent(self, limit=50):
+        return list(self.captured)[-limit:][::-1]
+
+    def _ensure_watchdog(self):
+        if self._watchdog is not None and self._watchdog_pid == os.getpid() and self._watchdog.is_alive():
+            return
+        with self._start_lock:
+            if self._watchdog is not None and self._watchdog_pid == os.getpid() and self._watchdog.is_alive():
+                return
+            self._watchdog = threading.Thread(target=self._watch, name="slow-hop-watchdog", daemon=True)
+            self._watchdog_pid = os.getpid()
+            self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if not self._inflight: continue
+            now = time.monotonic()
+            frames = None
+            for hop in list(self._inflight.values()):
+                if hop.stack is not None or now < hop.deadline: continue
+                if frames is None:
+                    frames = sys._current_frames()
+                frame = frames.get(hop.thread_id)
+                if frame is not None:
+                    hop.stack = [line.rstrip() for line in traceback.format_stack(frame, limit=MAX_STACK_FRAMES)]
+
+
+detector = SlowHopDetector()
@@ -0,0 +1,85 @@
+import http.client
+import json
+import logging
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import async_http
+
+# --- SMS Gateway Client ---
+# Sends messages through Africa's Talking's messaging API. Without
+# SMS_GATEWAY_URL the send is simulated and a local message ID is returned,
+# as before. There is a blocking client for the WSGI server and an asyncio one
+# for the ASGI server; both build the same request.
+
+# e.g. https://api.sandbox.africastalking.com/version1/messaging
+SMS_GATEWAY_URL = os.environ.get("SMS_GATEWAY_URL", "")
+SMS_GATEWAY_USERNAME = os.environ.get("SMS_GATEWAY_USERNAME", "sandbox")
+SMS_GATEWAY_API_KEY = os.environ.get("SMS_GATEWAY_API_KEY", "")
+SMS_SENDER_ID = os.environ.get("SMS_SENDER_ID", "")
+SMS_GATEWAY_TIMEOUT = float(os.environ.get("SMS_GATEWAY_TIMEOUT", "3"))
+
+log = logging.getLogger("ussd.sms")
+
+
+class SmsGatewayError(Exception):
+    pass
+
+
+def local_message_id():
+    return f"ATXid_{uuid.uuid4().hex}"
+
+
+def _build_request(phone_number, message):
+    fields = {"username": SMS_GATEWAY_USERNAME, "to": phone_number, "message": message}
+    if SMS_SENDER_ID:
+        fields["from"] = SMS_SENDER_ID
+    headers = {
+        "apiKey": SMS_GATEWAY_API_KEY,
+        "Accept": "application/json",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+    return urllib.parse.urlencode(fields).encode(), headers
+
+
+def _message_id(status, body):
+    if not 200 <= status < 300:
+        raise SmsGatewayError(f"Gateway returned HTTP {status}")
+    try:
+        recipients = json.loads(body)["SMSMessageData"]["Recipients"]
+        return recipients[0]["messageId"]
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise SmsGatewayError(f"Unexpected gateway response: {body[:200]!r}") from e
+
+
+def send(phone_number, message):
+    """Sends an SMS and returns the gateway's message ID. Raises SmsGatewayError."""
+    if not SMS_GATEWAY_URL:
+        return local_message_id()
+    body, headers = _build_request(phone_number, message)
+    req = urllib.request.Request(SMS_GATEWAY_URL, data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=SMS_GATEWAY_TIMEOUT) as response:
+            return _message_id(response.status, response.read())
+    except urllib.error.HTTPError as e:
+        raise SmsGatewayError(f"Gateway returned HTTP {e.code}") from e
+    except OSError as e:
+        raise SmsGatewayError(f"Gateway unreachable: {e}") from e
+    except http.client.HTTPException as e:
+        raise SmsGatewayError(f"Malformed gateway response: {e!r}") from e
+
+
+async def send_async(phone_number, message):
+    """Asyncio version of send()."""
+    if not SMS_GATEWAY_URL:
+        return local_message_id()
+    body, headers = _build_request(phone_number, message)
+    try:
+        status, _, response_body = await async_http.request(
+            "POST", SMS_GATEWAY_URL, body, headers, timeout=SMS_GATEWAY_TIMEOUT)
+    except async_http.HttpError as e:
+        raise SmsGatewayError(str(e)) from e
+    return _message_id(status, response_body)
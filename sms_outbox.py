@@ -0,0 +1,222 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+import storage
+
+# --- SMS Outbox & Delivery Reports ---
+# Every SMS we hand to the gateway is kept here, indexed by its message ID, so
+# that the gateway's delivery reports can be matched back to it. Reports are
+# queued by the HTTP handler and applied in batches by a background thread, so
+# a burst of reports never holds up the USSD callback.
+#
+# With the sqlite storage backend the outbox is a table in the shared database,
+# so a report is matched even when it reaches a different worker process from
+# the one that sent the message.
+
+DELIVERED_STATUS = "Success"
+PENDING_STATUS = "Sent"
+# Recorded when the gateway could not be reached, so the message is resent.
+FAILED_STATUS = "Failed"
+
+MAX_MESSAGES = int(os.environ.get("SMS_OUTBOX_MAX_MESSAGES", "200000"))
+REPORT_QUEUE_SIZE = int(os.environ.get("SMS_REPORT_QUEUE_SIZE", "50000"))
+REPORT_BATCH_SIZE = 500
+
+log = logging.getLogger("ussd.sms.delivery")
+
+
+class SmsOutbox:
+    """In-memory outbox of sent messages with an index on message ID."""
+
+    def __init__(self, max_messages=MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._messages = {}
+        self._order = deque()  # (sent_at, message_id, entry), oldest first
+        self._lock = threading.Lock()
+        self.unmatched_reports = 0
+
+    def record(self, phone_number, message, message_id=None, status=PENDING_STATUS):
+        """Adds a sent message to the outbox and returns its message ID."""
+        message_id = message_id or f"ATXid_{uuid.uuid4().hex}"
+        now = time.time()
+        entry = {
+            "id": message_id, "phone_number": phone_number, "message": message,
+            "status": status, "failure_reason": None, "retry_count": 0,
+            "sent_at": now, "updated_at": now,
+        }
+        with self._lock:
+            # A message recorded again (e.g. resent) replaces its entry; the
+            # older item left in _order is then stale and skipped.
+            self._messages[message_id] = entry
+            self._order.append((now, message_id, entry))
+            while len(self._order) > self.max_messages:
+                _, old_id, old_entry = self._order.popleft()
+                if self._messages.get(old_id) is old_entry:
+                    del self._messages[old_id]
+        return message_id
+
+    def get(self, message_id):
+        return self._messages.get(message_id)
+
+    def apply_reports(self, reports):
+        """Applies a batch of (message_id, status, failure_reason, retry_count) reports."""
+        now = time.time()
+        matched = 0
+        with self._lock:
+            for message_id, status, failure_reason, retry_count in reports:
+                entry = self._messages.get(message_id)
+                if entry is None:
+                    self.unmatched_reports += 1
+                    continue
+                entry["status"] = status
+                entry["failure_reason"] = failure_reason
+                entry["retry_count"] = retry_count
+                entry["updated_at"] = now
+                matched += 1
+        return matched
+
+    def undelivered_since(self, cutoff):
+        """Returns messages sent at or after `cutoff` that have not been delivered, newest first."""
+        result = []
+        with self._lock:
+            for sent_at, message_id, recorded in reversed(self._order):
+                if sent_at < cutoff: break
+                entry = self._messages.get(message_id)
+                if entry is not recorded: continue
+                if entry["status"] != DELIVERED_STATUS:
+                    result.append(dict(entry))
+        return result
+
+
+class SqliteOutbox:
+    """Outbox kept in the shared SQLite database, indexed on message ID and send time."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sms_outbox (
+            id TEXT PRIMARY KEY,
+            phone_number TEXT, message TEXT, status TEXT NOT NULL,
+            failure_reason TEXT, retry_count INTEGER NOT NULL DEFAULT 0,
+            sent_at REAL NOT NULL, updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sms_outbox_sent_at ON sms_outbox (sent_at);
+    """
+    FIELDS = ("id", "phone_number", "message", "status", "failure_reason", "retry_count", "sent_at", "updated_at")
+
+    def __init__(self, backend, max_age_seconds=7 * 24 * 3600):
+        self.backend = backend
+        self.max_age_seconds = max_age_seconds
+        self.unmatched_reports = 0
+        backend.connection().executescript(self.SCHEMA)
+
+    def record(self, phone_number, message, message_id=None, status=PENDING_STATUS):
+        message_id = message_id or f"ATXid_{uuid.uuid4().hex}"
+        now = time.time()
+        # As in MemoryOutbox, a message recorded again replaces its entry.
+        self.backend.connection().execute(
+            "INSERT INTO sms_outbox (id, phone_number, message, status, sent_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET phone_number = excluded.phone_number, message = excluded.message, "
+            "status = excluded.status, failure_reason = NULL, retry_count = 0, "
+            "sent_at = excluded.sent_at, updated_at = excluded.updated_at",
+            (message_id, phone_number, message, status, now, now),
+        )
+        return message_id
+
+    def get(self, message_id):
+        row = self.backend.connection().execute(
+            f"SELECT {', '.join(self.FIELDS)} FROM sms_outbox WHERE id = ?", (message_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def apply_reports(self, reports):
+        """Applies a batch of reports in one transaction."""
+        now = time.time()
+        conn = self.backend.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE sms_outbox SET status = ?, failure_reason = ?, retry_count = ?, updated_at = ? WHERE id = ?",
+                [(status, failure_reason, retry_count, now, message_id)
+                 for message_id, status, failure_reason, retry_count in reports],
+            )
+            matched = conn.total_changes - before
+            # Old messages are pruned here, off the request path.
+            conn.execute("DELETE FROM sms_outbox WHERE sent_at < ?", (now - self.max_age_seconds,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.unmatched_reports += len(reports) - matched
+        return matched
+
+    def undelivered_since(self, cutoff):
+        rows = self.backend.connection().execute(
+            f"SELECT {', '.join(self.FIELDS)} FROM sms_outbox WHERE sent_at >= ? AND status != ? ORDER BY sent_at DESC",
+            (cutoff, DELIVERED_STATUS),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class DeliveryReportIngestor:
+    """Queues delivery reports and applies them to the outbox on a background thread."""
+
+    def __init__(self, outbox, maxsize=REPORT_QUEUE_SIZE, batch_size=REPORT_BATCH_SIZE):
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, message_id, status, failure_reason=None, retry_count=0):
+        """Enqueues a report without blocking. Returns False if the queue is full."""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((message_id, status, failure_reason, retry_count))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _ensure_worker(self):
+        # The worker is (re)started lazily so that forked server workers get their own thread.
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="sms-delivery-ingest", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                matched = self.outbox.apply_reports(batch)
+                log.debug("SMS DELIVERY: Applied %d reports (%d matched).", len(batch), matched)
+            except Exception:
+                log.exception("SMS DELIVERY: Failed to apply a batch of %d reports.", len(batch))
+            finally:
+                for _ in batch: self._queue.task_done()
+
+    def drain(self, timeout=5.0):
+        """Waits until all queued reports have been applied (used by tools and shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+
+outbox = SqliteOutbox(storage.backend) if storage.backend.name == "sqlite" else SmsOutbox()
+ingestor = DeliveryReportIngestor(outbox)
@@ -0,0 +1,164 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- Registration Storage ---
+# Two interchangeable backends:
+#   memory - a dict in this process. Fine for the simulator and a single
+#            development server; everything is lost on restart.
+#   sqlite - a file shared by every worker process on the machine (WAL mode),
+#            so registrations, UBRN sequences and the SMS outbox survive
+#            restarts and are seen by all workers.
+# Choose with STORAGE_BACKEND; the production server defaults to sqlite.
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "ebirth.db")
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+REGISTRATION_FIELDS = ("ubrn", "baby_name", "dob", "sex", "region_code", "district_code",
+                       "mother_nin", "father_nin", "status")
+
+_INSERT_REGISTRATION = (f"INSERT INTO registrations ({', '.join(REGISTRATION_FIELDS)}, created_at) "
+                        f"VALUES ({', '.join('?' * len(REGISTRATION_FIELDS))}, ?)")
+_SELECT_REGISTRATION = f"SELECT {', '.join(REGISTRATION_FIELDS)} FROM registrations WHERE ubrn = ?"
+_SELECT_BY_MOTHER = (f"SELECT {', '.join(REGISTRATION_FIELDS)} FROM registrations "
+                     f"WHERE upper(mother_nin) = ? AND dob IN (SELECT value FROM json_each(?))")
+
+
+class MemoryStorage:
+    name = "memory"
+
+    def __init__(self):
+        self.registrations = {}
+        self.by_mother = {}  # (mother NIN, dob) -> records, for duplicate checks
+        self.sequences = {}
+        self._lock = threading.Lock()
+
+    def insert_registration(self, details):
+        self.registrations[details["ubrn"]] = details
+        self.by_mother.setdefault((details["mother_nin"].upper(), details["dob"]), []).append(details)
+
+    def insert_registrations(self, batch):
+        self.registrations.update((details["ubrn"], details) for details in batch)
+        for details in batch:
+            self.by_mother.setdefault((details["mother_nin"].upper(), details["dob"]), []).append(details)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Groups writes; the memory backend applies them as they are made and has nothing to roll back."""
+        yield
+
+    def get_registration(self, ubrn):
+        return self.registrations.get(ubrn)
+
+    def find_by_mother(self, mother_nin, dobs):
+        """Registrations with this mother's NIN (in any case) and one of these dates of birth."""
+        mother_nin = mother_nin.upper()
+        return [record for dob in dobs for record in self.by_mother.get((mother_nin, dob), ())]
+
+    def count_registrations(self):
+        return len(self.registrations)
+
+    def next_sequence(self, region_code, district_code, day, count=1):
+        """Reserves `count` consecutive sequence numbers for a district/day and returns the first."""
+        key = (region_code, district_code, day)
+        with self._lock:
+            last = self.sequences.get(key, 0)
+            self.sequences[key] = last + count
+        return last + 1
+
+
+class SqliteStorage:
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS registrations (
+            ubrn TEXT PRIMARY KEY,
+            baby_name TEXT, dob TEXT, sex TEXT, region_code TEXT, district_code TEXT,
+            mother_nin TEXT, father_nin TEXT, status TEXT,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS registrations_mother_dob ON registrations (upper(mother_nin), dob);
+        CREATE TABLE IF NOT EXISTS ubrn_sequences (
+            region_code TEXT NOT NULL, district_code TEXT NOT NULL, day TEXT NOT NULL,
+            last_value INTEGER NOT NULL,
+            PRIMARY KEY (region_code, district_code, day)
+        );
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.connection().executescript(self.SCHEMA)
+
+    def connection(self):
+        """Returns this thread's connection, reopening it in a forked child process."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    def insert_registration(self, details):
+        values = [details.get(field) for field in REGISTRATION_FIELDS]
+        values.append(time.time())
+        self.connection().execute(_INSERT_REGISTRATION, values)
+
+    def insert_registrations(self, batch):
+        created_at = time.time()
+        self.connection().executemany(
+            _INSERT_REGISTRATION, ([details.get(field) for field in REGISTRATION_FIELDS] + [created_at] for details in batch))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Makes this thread's writes inside the block one transaction: all committed, or none if it raises."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_registration(self, ubrn):
+        row = self.connection().execute(_SELECT_REGISTRATION, (ubrn,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_mother(self, mother_nin, dobs):
+        rows = self.connection().execute(_SELECT_BY_MOTHER, (mother_nin.upper(), json.dumps(list(dobs))))
+        return [dict(row) for row in rows]
+
+    def count_registrations(self):
+        return self.connection().execute("SELECT COUNT(*) FROM registrations").fetchone()[0]
+
+    def next_sequence(self, region_code, district_code, day, count=1):
+        """Reserves `count` consecutive sequence numbers for a district/day and returns the first.
+
+        A single UPSERT, so concurrent workers can never be handed the same number.
+        """
+        row = self.connection().execute(
+            "INSERT INTO ubrn_sequences (region_code, district_code, day, last_value) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (region_code, district_code, day) DO UPDATE SET last_value = last_value + excluded.last_value "
+            "RETURNING last_value",
+            (region_code, district_code, day, count),
+        ).fetchone()
+        return row[0] - count + 1
+
+
+def create_backend(name=STORAGE_BACKEND):
+    if name == "memory":
+        return MemoryStorage()
+    if name == "sqlite":
+        return SqliteStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND '{name}' (expected 'memory' or 'sqlite').")
+
+
+backend = create_backend()
@@ -0,0 +1,80 @@
+import datetime
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_validation
+
+DISTRICTS = {("01", "027"), ("02", "001")}
+LAST_YEAR = datetime.date.today().year - 1
+HEADER = "baby_name,dob,sex,region_code,district_code,mother_nin,father_nin\n"
+VALID = f"Ama Serwaa,1503{LAST_YEAR},2,01,027,GHA-123456789-0,0\n"
+
+
+def report(text, **kwargs):
+    return bulk_validation.validate_file(io.StringIO(text), DISTRICTS, **kwargs)
+
+
+class BulkValidationTest(unittest.TestCase):
+
+    def test_valid_rows_in_every_accepted_format(self):
+        text = HEADER + VALID + (f"0,15/03/{LAST_YEAR},f,02,001,gha-123456789-0,\n"
+                                 f"Kofi,2902{LAST_YEAR - LAST_YEAR % 4},Male,01,027,GHA-123456789-0,GHA-987654321-X\n")
+        self.assertEqual(report(text), {"rows": 3, "valid_rows": 3, "invalid_rows": 0, "errors": []})
+
+    def test_each_rejected_field_is_reported_against_its_row(self):
+        text = HEADER + VALID + (
+            f"Ama 2,1503{LAST_YEAR},2,01,027,GHA-123456789-0,0\n"
+            f"Ama,3002{LAST_YEAR},2,01,027,GHA-123456789-0,0\n"
+            f"Ama,15031990,2,01,027,GHA-123456789-0,0\n"
+            f"Ama,1503{LAST_YEAR},3,01,027,GHA-123456789-0,0\n"
+            f"Ama,1503{LAST_YEAR},2,01,001,GHA-123456789-0,0\n"
+            f"Ama,1503{LAST_YEAR},2,01,027,GHA-12345678-0,0\n"
+            f"Ama,1503{LAST_YEAR},2,01,027,GHA-123456789-0,123\n"
+            f"Ama 2,1503{LAST_YEAR},x,01,027,GHA-123456789-0,0\n")
+        messages = bulk_validation.ERROR_MESSAGES
+        self.assertEqual(report(text)["errors"], [
+            {"row": 3, "errors": [messages["baby_name"]]},
+            {"row": 4, "errors": [messages["dob"]]},
+            {"row": 5, "errors": [messages["dob"]]},
+            {"row": 6, "errors": [messages["sex"]]},
+            {"row": 7, "errors": [messages["district"]]},
+            {"row": 8, "errors": [messages["mother_nin"]]},
+            {"row": 9, "errors": [messages["father_nin"]]},
+            {"row": 10, "errors": [messages["baby_name"], messages["sex"]]},
+        ])
+
+    def test_short_and_blank_rows(self):
+        result = report(HEADER + VALID + "\nAma Serwaa,1503" + str(LAST_YEAR) + "\n" + VALID)
+        self.assertEqual(result["rows"], 3)
+        self.assertEqual(result["errors"][0]["row"], 4)
+        self.assertEqual(result["errors"][0]["errors"][0], "Too few columns")
+
+    def test_missing_column_is_refused(self):
+        with self.assertRaises(ValueError):
+            report("baby_name,dob\nAma,15032024\n")
+
+    def test_rows_are_numbered_across_chunks(self):
+        text = HEADER + VALID * 5 + "Ama 2" + VALID[len("Ama Serwaa"):] + VALID
+        self.assertEqual([e["row"] for e in report(text, chunk_rows=2)["errors"]], [7])
+
+    def test_jsonl_rows(self):
+        lines = ('{"baby_name": "Ama", "dob": "1503%d", "sex": 2, "region_code": "01", "district_code": "027", '
+                 '"mother_nin": "GHA-123456789-0"}\n' % LAST_YEAR) + "not json\n"
+        rows, columns, malformed = next(bulk_validation.read_jsonl_chunks(io.StringIO(lines)))
+        errors = bulk_validation.row_errors(rows, bulk_validation.validate_columns(columns, DISTRICTS), malformed)
+        self.assertEqual([e["row"] for e in errors], [2])
+        self.assertEqual(errors[0]["errors"][0], "Not a JSON object")
+
+    @unittest.skipIf(bulk_validation.np is None, "NumPy is not installed")
+    def test_numpy_checks_agree_with_the_row_rules(self):
+        text = HEADER + VALID + f"Ama 2,3002{LAST_YEAR},M,01,027,GHA-123456789-0,0\n" + \
+            f" Ama ,1503{LAST_YEAR},female,02,001,gha-123456789-x,GHA-987654321-0\n"
+        self.assertEqual(report(text, use_numpy=True), report(text, use_numpy=False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import duplicates
+import idempotency
+import name_search
+import rate_limit
+import storage
+
+
+def registration(ubrn, baby_name="Ama Serwaa", dob="15/03/2024", mother_nin="GHA-123456789-0",
+                 status="Provisionally Registered"):
+    return {"ubrn": ubrn, "baby_name": baby_name, "dob": dob, "mother_nin": mother_nin, "status": status}
+
+
+class NameAndDateTest(unittest.TestCase):
+
+    def test_names_match_in_any_order_case_and_small_misspellings(self):
+        self.assertTrue(duplicates.names_similar("Ama Serwaa", "serwaa AMA"))
+        self.assertTrue(duplicates.names_similar("Ama Serwaa", "Ama Serwah"))
+        self.assertFalse(duplicates.names_similar("Ama Serwaa", "Kofi Serwaa"))
+
+    def test_an_unnamed_child_only_matches_another_unnamed_child(self):
+        self.assertTrue(duplicates.names_similar("N/A", "0"))
+        self.assertFalse(duplicates.names_similar("N/A", "Ama Serwaa"))
+
+    def test_nearby_dates_of_birth_closest_first(self):
+        self.assertEqual(duplicates.nearby_dobs("01/03/2024", days=1), ["01/03/2024", "29/02/2024", "02/03/2024"])
+        self.assertEqual(duplicates.nearby_dobs("not a date"), ["not a date"])
+
+
+class FindDuplicateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = storage.MemoryStorage()
+
+    def test_finds_the_same_child_of_the_same_mother(self):
+        self.db.insert_registration(registration("U1"))
+        found = duplicates.find_duplicate(self.db, registration(None, baby_name="Serwaa Ama", dob="16/03/2024",
+                                                                mother_nin="gha-123456789-0"))
+        self.assertEqual(found["ubrn"], "U1")
+
+    def test_twins_and_other_mothers_are_not_duplicates(self):
+        self.db.insert_registration(registration("U1"))
+        self.assertIsNone(duplicates.find_duplicate(self.db, registration(None, baby_name="Akosua Serwaa")))
+        self.assertIsNone(duplicates.find_duplicate(self.db, registration(None, mother_nin="GHA-987654321-0")))
+        self.assertIsNone(duplicates.find_duplicate(self.db, registration(None, dob="20/03/2024")))
+
+    def test_prefers_the_original_to_a_flagged_duplicate(self):
+        self.db.insert_registration(registration("U2", status=duplicates.DUPLICATE_STATUS))
+        self.db.insert_registration(registration("U1", dob="16/03/2024"))
+        self.assertEqual(duplicates.find_duplicate(self.db, registration(None))["ubrn"], "U1")
+
+
+class DuplicateModeTest(unittest.TestCase):
+    """What the confirm hop does with a second registration of the same child."""
+
+    ANSWERS = ["1", "Ama Serwaa", "15032024", "2", "1", "1", "GHA-123456789-0", "0", "1"]
+
+    def setUp(self):
+        self.db = storage.MemoryStorage()
+        for target, name, value in ((app, "db", self.db),
+                                    (name_search, "index", name_search.MemoryNameIndex(self.db)),
+                                    (idempotency, "cache", idempotency.MemoryResponseCache()),
+                                    (rate_limit, "limiter", rate_limit.MemoryRateLimiter({}))):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def register(self, session_id):
+        for i in range(1, len(self.ANSWERS) + 1):
+            response = app.handle_ussd(session_id, "+233240000003", "*".join(self.ANSWERS[:i]))
+        return response
+
+    def test_flag_mode_registers_it_for_review(self):
+        with mock.patch.object(duplicates, "DUPLICATE_MODE", "flag"):
+            self.assertEqual(self.register("dup-1"), app.SUBMITTED_RESPONSE)
+            self.assertEqual(self.register("dup-2"), app.SUBMITTED_RESPONSE)
+        statuses = sorted(record["status"] for record in self.db.registrations.values())
+        self.assertEqual(statuses, ["Provisionally Registered", duplicates.DUPLICATE_STATUS])
+
+    def test_reject_mode_tells_the_parent_the_existing_ubrn(self):
+        with mock.patch.object(duplicates, "DUPLICATE_MODE", "reject"):
+            self.register("dup-3")
+            response = self.register("dup-4")
+        (ubrn,) = self.db.registrations
+        self.assertIn(f"already registered with UBRN {ubrn}", response)
+
+    def test_a_resent_confirm_is_not_its_own_duplicate(self):
+        with mock.patch.object(duplicates, "DUPLICATE_MODE", "reject"):
+            self.register("dup-5")
+            resent = app.handle_ussd("dup-5", "+233240000003", "*".join(self.ANSWERS))
+        self.assertEqual(resent, app.SUBMITTED_RESPONSE)
+        self.assertEqual([record["status"] for record in self.db.registrations.values()], ["Provisionally Registered"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import rate_limit
+import reference_data
+
+REGION_STEP = "1*Kwame Mensah*15032024*1"
+
+
+class MenuAnswersTest(unittest.TestCase):
+
+    def test_paging_answers_are_taken_out(self):
+        reference = reference_data.store.current
+        inputs = REGION_STEP.split("*")
+        self.assertEqual(app.menu_answers(inputs + ["98"], reference), (inputs, 1))
+        self.assertEqual(app.menu_answers(inputs + ["98", "0"], reference), (inputs, 0))
+        self.assertEqual(app.menu_answers(inputs + ["98", "13"], reference), (inputs + ["13"], 0))
+        self.assertEqual(app.menu_answers(inputs + ["1", "98", "98", "0"], reference), (inputs + ["1"], 1))
+
+    def test_paging_stops_at_the_first_and_last_pages(self):
+        reference = reference_data.store.current
+        inputs = REGION_STEP.split("*")
+        last = len(reference.region_menu) - 1
+        self.assertEqual(app.menu_answers(inputs + ["0"], reference)[1], 0)
+        self.assertEqual(app.menu_answers(inputs + ["98"] * (last + 3), reference)[1], last)
+
+    def test_other_answers_are_left_alone(self):
+        # 0 and 98 are ordinary answers outside the region and district menus.
+        inputs = ["1", "Kwame Mensah", "15032024", "1", "1", "1", "GHA-123456789-0", "0"]
+        self.assertEqual(app.menu_answers(inputs, reference_data.store.current), (inputs, 0))
+        self.assertEqual(app.menu_answers(["2", "98"], reference_data.store.current), (["2", "98"], 0))
+
+
+class MenuPagingFlowTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(rate_limit, "limiter", rate_limit.MemoryRateLimiter({}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def hops(self, session_id, *texts):
+        return [app.handle_ussd(session_id, "+233240000002", text) for text in texts]
+
+    def test_more_and_back_move_between_pages(self):
+        first, more, back = self.hops("paging-1", REGION_STEP, REGION_STEP + "*98", REGION_STEP + "*98*0")
+        self.assertIn("1. Greater Accra", first)
+        self.assertIn("98. More", first)
+        self.assertNotIn("1. Greater Accra", more)
+        self.assertIn("0. Back", more)
+        self.assertEqual(back, first)
+
+    def test_choice_from_a_later_page_is_the_one_confirmed(self):
+        reference = reference_data.store.current
+        district = reference.district("1", "9")
+        text = REGION_STEP + "*1*98*9"
+        responses = self.hops("paging-2", REGION_STEP, REGION_STEP + "*1", REGION_STEP + "*1*98", text,
+                              text + "*GHA-123456789-0", text + "*GHA-123456789-0*0")
+        self.assertIn(f"9. {district['name']}", responses[2])
+        self.assertIn(f"\nDistrict: {district['name']}\n", responses[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import name_search
+import storage
+
+NAMES = ["Kwame Mensah", "Ama Serwaa", "Kofi Mensah", "Yaw Boateng", "Akosua Kwarteng", "Kwame Nkrumah"]
+
+
+class NameKeysTest(unittest.TestCase):
+
+    def test_spellings_of_a_name_share_a_phonetic_key(self):
+        self.assertEqual({name_search.phonetic_key(word) for word in name_search.name_words("Kwame Kwamé Quame Kwam")},
+                         {"KWM"})
+        self.assertNotEqual(name_search.phonetic_key("kofi"), name_search.phonetic_key("kwame"))
+
+    def test_names_are_folded_to_plain_lower_case_words(self):
+        self.assertEqual(name_search.name_words("Kwamé  MENSAH-Boateng"), ["kwame", "mensah", "boateng"])
+        self.assertEqual(name_search.name_words("N/A"), [])
+
+
+class MemoryNameSearchTest(unittest.TestCase):
+
+    def make_backend(self):
+        return storage.MemoryStorage()
+
+    def make_index(self, backend):
+        return name_search.MemoryNameIndex(backend)
+
+    def setUp(self):
+        self.backend = self.make_backend()
+        self.index = self.make_index(self.backend)
+        for i, name in enumerate(NAMES):
+            self.save(f"GHA-01-027-24075-{i + 1:04d}-0", name)
+
+    def save(self, ubrn, name):
+        details = {"ubrn": ubrn, "baby_name": name, "dob": "15/03/2024", "sex": "Male", "region_code": "01",
+                   "district_code": "027", "mother_nin": "GHA-123456789-0", "father_nin": "N/A",
+                   "status": "Provisionally Registered"}
+        with self.backend.transaction():
+            self.backend.insert_registration(details)
+            self.index.add(ubrn, name)
+
+    def search(self, query, limit=20):
+        return name_search.search(query, limit, name_index=self.index)
+
+    def test_exact_name_comes_first_with_full_score(self):
+        results = self.search("Kwame Mensah")
+        self.assertEqual((results[0]["baby_name"], results[0]["score"]), ("Kwame Mensah", 1.0))
+        self.assertEqual(set(results[0]) - {"score"}, set(name_search.RESULT_FIELDS))
+
+    def test_finds_other_spellings_and_word_orders(self):
+        for query in ("Quame Mensa", "KWAMÉ MENSAH", "Mensah Kwame", "Kwme Mensah"):
+            self.assertEqual(self.search(query)[0]["baby_name"], "Kwame Mensah", query)
+
+    def test_results_are_ranked_and_limited(self):
+        results = self.search("Kwame")
+        self.assertEqual({r["baby_name"] for r in results}, {"Kwame Mensah", "Kwame Nkrumah"})
+        self.assertEqual(len(self.search("Kwame", limit=1)), 1)
+        self.assertEqual(self.search("Zzyzx"), [])
+        self.assertEqual(self.search(""), [])
+
+    def test_adding_a_name_again_does_not_count_it_twice(self):
+        self.index.add_many([("GHA-01-027-24075-0001-0", "Kwame Mensah")])
+        self.assertEqual(dict(self.index.words_with_key(name_search.phonetic_key("kwame"))), {"kwame": 2})
+
+
+class SqliteNameSearchTest(MemoryNameSearchTest):
+
+    def make_backend(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+        return storage.SqliteStorage(os.path.join(self.workdir.name, "names.db"))
+
+    def make_index(self, backend):
+        return name_search.SqliteNameIndex(backend)
+
+    def test_a_rolled_back_name_can_be_indexed_later(self):
+        with self.assertRaises(RuntimeError):
+            with self.backend.transaction():
+                self.index.add("GHA-01-027-24075-0099-0", "Efua Nyarko")
+                raise RuntimeError("save failed")
+        self.assertEqual(self.search("Efua Nyarko"), [])
+        self.save("GHA-01-027-24075-0100-0", "Efua Nyarko")
+        # Spelling matches come from the word's trigrams, which the rollback took away.
+        shared = self.index.words_sharing_trigrams(name_search.trigrams("nyarko"), 1)
+        self.assertIn("nyarko", [word for word, _, _ in shared])
+        self.assertEqual(self.search("Efuah Nyarco")[0]["ubrn"], "GHA-01-027-24075-0100-0")
+
+
+if __name__ == "__main__":
+    unittest.main()
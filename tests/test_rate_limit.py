@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limit
+import storage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+class ParseLimitsTest(unittest.TestCase):
+
+    def test_parses_count_per_seconds_into_interval_and_period(self):
+        self.assertEqual(rate_limit.parse_limits("default=60/60, verify=10/300"),
+                         {"default": (1.0, 60.0), "verify": (30.0, 300.0)})
+        self.assertEqual(rate_limit.parse_limits(""), {})
+
+    def test_rejects_malformed_entries(self):
+        for spec in ("default=60", "default=0/60", "default=ten/60"):
+            with self.assertRaises(ValueError):
+                rate_limit.parse_limits(spec)
+
+
+class MemoryRateLimiterTest(unittest.TestCase):
+
+    def make_limiter(self, spec):
+        return rate_limit.MemoryRateLimiter(rate_limit.parse_limits(spec))
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(rate_limit, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_allows_a_burst_then_one_hop_per_interval(self):
+        limiter = self.make_limiter("default=3/60")
+        self.assertEqual([limiter.allow("+233200000001", "register") for _ in range(4)], [True, True, True, False])
+        self.clock.now += 19
+        self.assertFalse(limiter.allow("+233200000001", "register"))
+        self.clock.now += 1
+        self.assertTrue(limiter.allow("+233200000001", "register"))
+        self.assertFalse(limiter.allow("+233200000001", "register"))
+
+    def test_refused_hops_do_not_push_the_next_allowed_one_back(self):
+        limiter = self.make_limiter("default=1/10")
+        self.assertTrue(limiter.allow("+233200000001", "register"))
+        for _ in range(5):
+            self.assertFalse(limiter.allow("+233200000001", "register"))
+        self.clock.now += 10
+        self.assertTrue(limiter.allow("+233200000001", "register"))
+
+    def test_phones_and_flows_are_limited_separately(self):
+        limiter = self.make_limiter("default=1/60,verify=2/60")
+        self.assertTrue(limiter.allow("+233200000001", "register"))
+        self.assertFalse(limiter.allow("+233200000001", "register"))
+        self.assertTrue(limiter.allow("+233200000002", "register"))
+        self.assertEqual([limiter.allow("+233200000001", "verify") for _ in range(3)], [True, True, False])
+
+    def test_no_limit_without_a_default_or_phone(self):
+        limiter = self.make_limiter("verify=1/60")
+        self.assertTrue(all(limiter.allow("+233200000001", "register") for _ in range(100)))
+        self.assertTrue(all(self.make_limiter("default=1/60").allow(None, "register") for _ in range(3)))
+
+
+class SqliteRateLimiterTest(MemoryRateLimiterTest):
+    """The shared-database limiter gives the same answers."""
+
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+        self.backend = storage.SqliteStorage(os.path.join(self.workdir.name, "limits.db"))
+
+    def make_limiter(self, spec):
+        return rate_limit.SqliteRateLimiter(self.backend, rate_limit.parse_limits(spec))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import rate_limit
+import reference_data
+import storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ReferenceFileMixin:
+    """A copy of the district data file, and a store reading it."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        self.path = os.path.join(self.workdir, "districts.json")
+        shutil.copy(os.path.join(ROOT, "data", "districts.json"), self.path)
+        with open(self.path, encoding="utf-8") as f:
+            self.original = json.load(f)
+        self.store = self.make_store()
+
+    def make_store(self):
+        return reference_data.ReferenceStore(reference_data.MemorySessionPins(), self.path, reload_seconds=0)
+
+    def write_rotated(self, version="rotated"):
+        """A new version in which every region's districts are moved along by one."""
+        document = json.loads(json.dumps(self.original))
+        document["version"] = version
+        for region in document["regions"]:
+            region["districts"] = region["districts"][1:] + region["districts"][:1]
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(document, f)
+
+
+class ReferenceStoreTest(ReferenceFileMixin, unittest.TestCase):
+
+    def test_a_session_keeps_the_version_it_started_with(self):
+        started = self.store.for_session("s1", True)
+        self.write_rotated()
+        self.assertEqual(self.store.reload(), "rotated")
+        self.assertIs(self.store.for_session("s1", False), started)
+        self.assertEqual(self.store.for_session("s2", True).version, "rotated")
+        self.assertNotEqual(self.store.current.district("1", "1"), started.district("1", "1"))
+
+    def test_released_versions_are_dropped(self):
+        self.store.for_session("s1", True)
+        self.write_rotated()
+        self.store.reload()
+        self.assertEqual(self.store.status()["loaded"], sorted([self.original["version"], "rotated"]))
+        self.store.release("s1")
+        self.store.prune()
+        self.assertEqual(self.store.status()["loaded"], ["rotated"])
+        self.assertEqual(self.store.status()["pinned_sessions"], {})
+
+    def test_an_invalid_file_keeps_the_current_version(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("{not json")
+        with self.assertRaises(ValueError):
+            self.store.reload()
+        self.assertEqual(self.store.current.version, self.original["version"])
+
+
+class SqliteReferenceStoreTest(ReferenceStoreTest):
+
+    def make_store(self):
+        self.backend = storage.SqliteStorage(os.path.join(self.workdir, "pins.db"))
+        return reference_data.ReferenceStore(reference_data.SqliteSessionPins(self.backend), self.path, reload_seconds=0)
+
+    def test_another_worker_serves_the_pinned_version(self):
+        started = self.store.for_session("s1", True)
+        self.write_rotated()
+        other = reference_data.ReferenceStore(reference_data.SqliteSessionPins(self.backend), self.path, reload_seconds=0)
+        self.assertEqual(other.current.version, "rotated")
+        pinned = other.for_session("s1", False)
+        self.assertEqual(pinned.version, started.version)
+        self.assertEqual(pinned.district("1", "1"), started.district("1", "1"))
+
+
+class SessionPinningFlowTest(ReferenceFileMixin, unittest.TestCase):
+    """A registration confirms the district shown on its menu, even if the data is reloaded in between."""
+
+    def setUp(self):
+        super().setUp()
+        for target, name, value in ((reference_data, "store", self.store),
+                                    (rate_limit, "limiter", rate_limit.MemoryRateLimiter({}))):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reload_mid_session(self):
+        answers = ["1", "Kwame Mensah", "15032024", "1", "1"]
+        for i in range(len(answers) + 1):
+            menu = app.handle_ussd("pin-1", "+233240000004", "*".join(answers[:i]))
+        chosen = self.store.current.district("1", "2")["name"]
+        self.assertIn(f"2. {chosen}", menu)
+        self.write_rotated()
+        self.store.reload()
+        answers += ["2", "GHA-123456789-0", "0"]
+        for i in range(len(answers) - 2, len(answers) + 1):
+            confirm = app.handle_ussd("pin-1", "+233240000004", "*".join(answers[:i]))
+        self.assertIn(f"\nDistrict: {chosen}\n", confirm)
+        self.assertNotEqual(self.store.current.district("1", "2")["name"], chosen)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+from sms_outbox import SmsOutbox, SqliteOutbox, DELIVERED_STATUS, FAILED_STATUS, PENDING_STATUS
+
+
+class SmsOutboxTest(unittest.TestCase):
+
+    def test_recording_an_id_twice_then_evicting_it(self):
+        outbox = SmsOutbox(max_messages=3)
+        outbox.record("+233200000001", "first", message_id="ATXid_1")
+        outbox.record("+233200000001", "again", message_id="ATXid_1")
+        # The stale first record of ATXid_1 is evicted; the newer one stays.
+        outbox.record("+233200000002", "other", message_id="ATXid_2")
+        outbox.record("+233200000003", "other", message_id="ATXid_3")
+        self.assertEqual(outbox.get("ATXid_1")["message"], "again")
+        undelivered = outbox.undelivered_since(0)
+        self.assertEqual([m["id"] for m in undelivered], ["ATXid_3", "ATXid_2", "ATXid_1"])
+
+        # Evicting the newer record removes the message, and listing still works.
+        outbox.record("+233200000004", "other", message_id="ATXid_4")
+        outbox.record("+233200000005", "other", message_id="ATXid_5")
+        self.assertIsNone(outbox.get("ATXid_1"))
+        self.assertEqual([m["id"] for m in outbox.undelivered_since(0)], ["ATXid_5", "ATXid_4", "ATXid_3"])
+
+    def test_delivered_messages_are_not_listed(self):
+        outbox = SmsOutbox()
+        outbox.record("+233200000001", "hello", message_id="ATXid_1")
+        outbox.record("+233200000001", "hello", message_id="ATXid_1")
+        outbox.apply_reports([("ATXid_1", DELIVERED_STATUS, None, 0)])
+        self.assertEqual(outbox.undelivered_since(0), [])
+
+
+class SqliteOutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.outbox = SqliteOutbox(storage.SqliteStorage(os.path.join(self.workdir.name, "outbox.db")))
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_recording_an_id_twice_replaces_it(self):
+        self.outbox.record("+233200000001", "first", message_id="ATXid_1", status=FAILED_STATUS)
+        self.outbox.apply_reports([("ATXid_1", FAILED_STATUS, "DeliveryFailure", 1)])
+        self.outbox.record("+233200000001", "again", message_id="ATXid_1")
+        message = self.outbox.get("ATXid_1")
+        self.assertEqual((message["message"], message["status"], message["failure_reason"], message["retry_count"]),
+                         ("again", PENDING_STATUS, None, 0))
+        self.assertEqual([m["id"] for m in self.outbox.undelivered_since(0)], ["ATXid_1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
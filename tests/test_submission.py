@@ -0,0 +1,89 @@
+import asyncio
+import http.client
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import asgi
+import idempotency
+import name_search
+import rate_limit
+import sms_gateway
+import storage
+from sms_outbox import SmsOutbox
+
+ANSWERS = ["1", "Ama Serwaa", "15032024", "2", "1", "1", "GHA-123456789-0", "0", "1"]
+CONFIRM = "*".join(ANSWERS)
+
+
+class SubmissionTest(unittest.TestCase):
+    """The confirm hop saves one registration however often the gateway resends it."""
+
+    def setUp(self):
+        db = storage.MemoryStorage()
+        for target, name, value in ((app, "db", db), (app, "outbox", SmsOutbox()),
+                                    (name_search, "index", name_search.MemoryNameIndex(db)),
+                                    (idempotency, "cache", idempotency.MemoryResponseCache()),
+                                    (rate_limit, "limiter", rate_limit.MemoryRateLimiter({}))):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.db = db
+
+    def walk_to_confirm(self, session_id):
+        for i in range(len(ANSWERS)):
+            app.handle_ussd(session_id, "+233240000001", "*".join(ANSWERS[:i]))
+
+    def test_resent_confirm_gets_the_same_response_and_one_ubrn(self):
+        self.walk_to_confirm("s1")
+        first = app.handle_ussd("s1", "+233240000001", CONFIRM)
+        resent = app.handle_ussd("s1", "+233240000001", CONFIRM)
+        self.assertEqual(first, app.SUBMITTED_RESPONSE)
+        self.assertEqual(resent, first)
+        self.assertEqual(self.db.count_registrations(), 1)
+        self.assertEqual(len(app.outbox._messages), 1)
+
+    def test_sms_gateway_failure_still_registers_once(self):
+        self.walk_to_confirm("s2")
+        with mock.patch.object(sms_gateway, "send", side_effect=sms_gateway.SmsGatewayError("down")):
+            first = app.handle_ussd("s2", "+233240000001", CONFIRM)
+        resent = app.handle_ussd("s2", "+233240000001", CONFIRM)
+        self.assertEqual((first, resent), (app.SUBMITTED_RESPONSE, app.SUBMITTED_RESPONSE))
+        self.assertEqual(self.db.count_registrations(), 1)
+        self.assertEqual([m["status"] for m in app.outbox.undelivered_since(0)], [app.FAILED_STATUS])
+
+    def test_unexpected_sms_error_after_the_save_is_not_fatal(self):
+        self.walk_to_confirm("s3")
+        with mock.patch.object(sms_gateway, "send", side_effect=http.client.IncompleteRead(b"")), \
+                mock.patch.object(app.outbox, "record", side_effect=RuntimeError("outbox down")):
+            first = app.handle_ussd("s3", "+233240000001", CONFIRM)
+        resent = app.handle_ussd("s3", "+233240000001", CONFIRM)
+        self.assertEqual((first, resent), (app.SUBMITTED_RESPONSE, app.SUBMITTED_RESPONSE))
+        self.assertEqual(self.db.count_registrations(), 1)
+
+    def test_failed_save_lets_a_resend_try_again(self):
+        self.walk_to_confirm("s4")
+        with mock.patch.object(self.db, "insert_registration", side_effect=RuntimeError("disk full")):
+            first = app.handle_ussd("s4", "+233240000001", CONFIRM)
+        resent = app.handle_ussd("s4", "+233240000001", CONFIRM)
+        self.assertEqual((first, resent), (app.ERROR_RESPONSE, app.SUBMITTED_RESPONSE))
+        self.assertEqual(self.db.count_registrations(), 1)
+
+    def test_async_driver_registers_once_when_sms_fails(self):
+        async def run():
+            for i in range(len(ANSWERS)):
+                await asgi.handle_ussd_async("s5", "+233240000001", "*".join(ANSWERS[:i]))
+            with mock.patch.object(sms_gateway, "send_async", side_effect=http.client.IncompleteRead(b"")):
+                first = await asgi.handle_ussd_async("s5", "+233240000001", CONFIRM)
+            return first, await asgi.handle_ussd_async("s5", "+233240000001", CONFIRM)
+
+        self.assertEqual(asyncio.run(run()), (app.SUBMITTED_RESPONSE, app.SUBMITTED_RESPONSE))
+        self.assertEqual(self.db.count_registrations(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+"""Rebuilds the child name search index from the registrations in the SQLite database.
+
+    STORAGE_BACKEND=sqlite SQLITE_PATH=ebirth.db python tools/build_name_index.py
+
+New registrations are indexed as they are saved; this is for a database
+with registrations saved before name search existed, or to start the index
+afresh. It runs in one transaction, so searches keep seeing the old index
+until it finishes.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import name_search
+import storage
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__.splitlines()[0]).parse_args()
+    if storage.backend.name != "sqlite":
+        sys.exit("The memory backend indexes names as they are saved; set STORAGE_BACKEND=sqlite.")
+    started = time.perf_counter()
+    name_search.index.rebuild()
+    words = storage.backend.connection().execute("SELECT COUNT(*) FROM name_words").fetchone()[0]
+    print(f"Indexed {storage.backend.count_registrations():,} registrations ({words:,} distinct name words) "
+          f"in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
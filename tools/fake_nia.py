@@ -0,0 +1,88 @@
+"""A stand-in for the NIA identity API, for local testing and benchmarks.
+
+    python tools/fake_nia.py [--port 8090] [--latency 0.3] [--unknown-rate 0.05] [--error-rate 0]
+
+Answers GET /<nin> (under any path prefix) the way nin_verification.py
+expects: 200 with a small JSON body if the card exists, 404 if it does not.
+Which cards exist is decided from a hash of the number, so a number gets the
+same answer every time; GHA-000000000-0 never exists. Each answer is delayed
+by --latency seconds (plus up to --jitter more), and --error-rate of requests
+get a 503 instead. Point the app at it with
+
+    NIA_URL=http://127.0.0.1:8090/v1/cards
+
+Prints the number of lookups served when stopped with Ctrl-C.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MISSING_CARD = "GHA-000000000-0"
+
+
+class FakeNia(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, latency=0.3, jitter=0.0, unknown_rate=0.05, error_rate=0.0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.unknown_rate = unknown_rate
+        self.error_rate = error_rate
+        self.lookups = 0
+        self._count_lock = threading.Lock()
+
+    def card_exists(self, nin):
+        if nin == MISSING_CARD: return False
+        return zlib.crc32(nin.encode()) % 10000 >= self.unknown_rate * 10000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server._count_lock:
+            server.lookups += 1
+        nin = urllib.parse.unquote(self.path.rstrip("/").rpartition("/")[2]).upper()
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        if random.random() < server.error_rate:
+            status, body = 503, {"error": "Service unavailable"}
+        elif server.card_exists(nin):
+            status, body = 200, {"nin": nin, "status": "active"}
+        else:
+            status, body = 404, {"error": "Card not found"}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before each answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument("--unknown-rate", type=float, default=0.05, help="fraction of card numbers that do not exist")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    args = parser.parse_args()
+
+    server = FakeNia(args.port, args.latency, args.jitter, args.unknown_rate, args.error_rate)
+    print(f"Fake NIA listening on http://127.0.0.1:{args.port}/v1/cards", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"{server.lookups:,} lookups served.")
+
+
+if __name__ == "__main__":
+    main()
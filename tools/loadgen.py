@@ -0,0 +1,377 @@
+"""Load generator for the USSD callback: virtual subscribers walking real sessions.
+
+    python tools/loadgen.py --url http://127.0.0.1:8000/callback [--subscribers 2000] [--seconds 60]
+    python tools/loadgen.py --in-process [--subscribers 500] [--seconds 30]
+
+Each virtual subscriber dials in, walks a registration (or, for
+--verify-share of sessions, a verification) reading the menus it is sent,
+waits a random think time between hops, makes a typo on --typo-rate of its
+answers and walks away mid-session on --abandon-rate of hops. When a session
+ends it idles for a while and dials again, until --seconds have passed.
+
+With --url the app is driven over HTTP by asyncio, so thousands of subscribers
+need only one process. With --in-process the app is imported here and called
+through the Werkzeug test client on --threads threads.
+
+The generator also acts as the SMS gateway so that issued UBRNs can be checked
+for collisions and looked up again by verification sessions. --in-process
+wires this up itself; with --url, start the server with
+SMS_GATEWAY_URL=http://127.0.0.1:<--sms-port>/version1/messaging.
+
+Reports throughput, p50/p95/p99 latency and errors per step, how sessions
+ended, and duplicate UBRNs. --json writes the same report as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import async_http
+
+FIRST_NAMES = ["Kwame", "Ama", "Kofi", "Akosua", "Yaw", "Abena", "Kwabena", "Adwoa", "Kojo", "Efua", "Esi", "Fiifi"]
+LAST_NAMES = ["Mensah", "Owusu", "Boateng", "Asante", "Osei", "Addo", "Appiah", "Quaye", "Tetteh", "Ofori", "Nkrumah"]
+
+UBRN_PATTERN = re.compile(r"GHA-\d{2}-\d{3}-\d{5}-\d{4}-[\dX]")
+OPTION_PATTERN = re.compile(r"^(\d+)\. ", re.MULTILINE)
+# Paging and navigation entries in the menus, never picked as an answer.
+NAVIGATION_OPTIONS = {"0", "98", "99"}
+
+SUBMITTED = "END Thank you!"
+SYSTEM_ERROR = "END A system error"
+BUSY = "END The service is busy"
+THROTTLED = "END Too many requests"
+IN_PROGRESS = "END Your registration is being processed"
+
+
+# --- Virtual Subscriber Inputs ---
+
+def random_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def random_dob(rng):
+    day = time.time() - rng.uniform(0, 365) * 86400
+    return time.strftime("%d%m%Y", time.localtime(day))
+
+
+def random_nin(rng):
+    return f"GHA-{rng.randrange(10 ** 9):09d}-{rng.randrange(10)}"
+
+
+def random_ubrn(rng):
+    return f"GHA-01-027-{rng.randrange(100000):05d}-{rng.randrange(10000):04d}-{rng.randrange(10)}"
+
+
+def pick_option(rng, response):
+    options = [n for n in OPTION_PATTERN.findall(response) if n not in NAVIGATION_OPTIONS]
+    return rng.choice(options) if options else "1"
+
+
+# Each step: (name, answer from the previous response, typo of that answer).
+REGISTRATION_SCRIPT = [
+    ("register.start", lambda rng, r: "1", None),
+    ("register.child_name", lambda rng, r: random_name(rng), lambda rng, v: v + str(rng.randrange(10))),
+    ("register.dob", lambda rng, r: random_dob(rng), lambda rng, v: "32" + v[2:]),
+    ("register.sex", lambda rng, r: rng.choice("12"), lambda rng, v: "3"),
+    ("register.region", pick_option, lambda rng, v: "97"),
+    ("register.district", pick_option, lambda rng, v: "97"),
+    ("register.mother_nin", lambda rng, r: random_nin(rng), lambda rng, v: v[:-3] + v[-1]),
+    ("register.father_nin", lambda rng, r: random_nin(rng) if rng.random() < 0.7 else "0", lambda rng, v: v[1:]),
+    ("register.confirm", lambda rng, r: "1", None),
+]
+
+
+# --- Transports ---
+
+class HttpTransport:
+    def __init__(self, url, connections, timeout):
+        self.url = url
+        self.timeout = timeout
+        async_http.MAX_IDLE_PER_HOST = connections
+
+    async def post(self, session_id, phone_number, text):
+        body = urllib.parse.urlencode({"sessionId": session_id, "phoneNumber": phone_number, "text": text}).encode()
+        status, _, response = await async_http.request(
+            "POST", self.url, body, {"Content-Type": "application/x-www-form-urlencoded"}, timeout=self.timeout)
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}")
+        return response.decode()
+
+
+class InProcessTransport:
+    def __init__(self, threads):
+        from werkzeug.test import Client
+
+        import wsgi
+        self._client_class, self._application = Client, wsgi.application
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix="loadgen")
+
+    def _post(self, session_id, phone_number, text):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self._client_class(self._application)
+        response = client.post("/callback", data={"sessionId": session_id, "phoneNumber": phone_number, "text": text})
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        return response.get_data(as_text=True)
+
+    async def post(self, session_id, phone_number, text):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._post, session_id, phone_number, text)
+
+
+# --- SMS Capture ---
+
+class SmsCapture:
+    """A stand-in for the SMS gateway that records the UBRN in each message."""
+
+    def __init__(self):
+        self.ubrns = Counter()
+        self.issued = []
+        self.messages = 0
+
+    async def start(self, port):
+        return await asyncio.start_server(self._handle, "127.0.0.1", port)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                length = 0
+                while line not in (b"\r\n", b""):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                    line = await reader.readline()
+                fields = urllib.parse.parse_qs((await reader.readexactly(length)).decode())
+                self.messages += 1
+                for ubrn in UBRN_PATTERN.findall(fields.get("message", [""])[0]):
+                    self.ubrns[ubrn] += 1
+                    self.issued.append(ubrn)
+                body = json.dumps({"SMSMessageData": {"Recipients": [
+                    {"messageId": f"ATXid_{uuid.uuid4().hex}", "status": "Success"}]}}).encode()
+                writer.write(b"HTTP/1.1 201 Created\r\nContent-Type: application/json\r\nContent-Length: "
+                             + str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def collisions(self):
+        return {ubrn: count for ubrn, count in self.ubrns.items() if count > 1}
+
+
+# --- Simulation ---
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.outcomes = Counter()
+        self.hops = 0
+        self.submitted = 0
+
+    def record(self, step, seconds):
+        self.latencies[step].append(seconds)
+        self.hops += 1
+
+
+class Simulation:
+    def __init__(self, transport, args, sms):
+        self.transport = transport
+        self.args = args
+        self.sms = sms
+        self.results = Results()
+        self.stop_at = 0.0
+
+    async def think(self, rng, scale=1.0):
+        await asyncio.sleep(min(rng.expovariate(1000 / self.args.think_ms), 10 * self.args.think_ms / 1000) * scale)
+
+    async def hop(self, session_id, phone_number, step, text):
+        started = time.perf_counter()
+        try:
+            response = await self.transport.post(session_id, phone_number, text)
+        except Exception as e:
+            self.results.errors[step] += 1
+            self.results.outcomes[f"transport_error:{type(e).__name__}"] += 1
+            return None
+        self.results.record(step, time.perf_counter() - started)
+        if response.startswith(SYSTEM_ERROR):
+            self.results.errors[step] += 1
+            self.results.outcomes["system_error"] += 1
+            return None
+        for prefix, outcome in ((BUSY, "shed_busy"), (THROTTLED, "throttled"), (IN_PROGRESS, "in_progress")):
+            if response.startswith(prefix):
+                self.results.outcomes[outcome] += 1
+                return None
+        return response
+
+    async def registration(self, rng, session_id, phone_number):
+        inputs = []
+        response = await self.hop(session_id, phone_number, "main_menu", "")
+        for step, answer, typo in REGISTRATION_SCRIPT:
+            if response is None: return
+            if not response.startswith("CON"):
+                self.results.outcomes["unexpected_end"] += 1
+                self.results.errors[step] += 1
+                return
+            if rng.random() < self.args.abandon_rate:
+                self.results.outcomes["abandoned"] += 1
+                return
+            await self.think(rng)
+            value = answer(rng, response)
+            typed = typo is not None and rng.random() < self.args.typo_rate
+            inputs.append(typo(rng, value) if typed else value)
+            response = await self.hop(session_id, phone_number, step, "*".join(inputs))
+            if typed and response is not None:
+                self.results.outcomes["typo_rejected" if response.startswith("END") else "typo_accepted"] += 1
+                return
+        if response is None: return
+        if response.startswith(SUBMITTED):
+            self.results.outcomes["registered"] += 1
+            self.results.submitted += 1
+        else:
+            self.results.outcomes["unexpected_end"] += 1
+            self.results.errors["register.confirm"] += 1
+
+    async def verification(self, rng, session_id, phone_number):
+        response = await self.hop(session_id, phone_number, "main_menu", "")
+        if response is None: return
+        await self.think(rng)
+        response = await self.hop(session_id, phone_number, "verify.start", "2")
+        if response is None: return
+        await self.think(rng, 2)
+        known = bool(self.sms.issued) and rng.random() < 0.8
+        ubrn = rng.choice(self.sms.issued) if known else random_ubrn(rng)
+        response = await self.hop(session_id, phone_number, "verify.ubrn", f"2*{ubrn}")
+        if response is None: return
+        found = "Not Found" not in response
+        if known and not found:
+            # A UBRN we were sent by SMS must be found, whichever worker answers.
+            self.results.errors["verify.ubrn"] += 1
+            self.results.outcomes["verify_missing"] += 1
+        else:
+            self.results.outcomes["verified" if found else "verify_not_found"] += 1
+
+    async def subscriber(self, index):
+        rng = random.Random(f"{self.args.seed}-{index}")
+        phone_number = f"+23324{index:07d}"
+        # Spread the first dial-ins over one think time so they do not all arrive at once.
+        await asyncio.sleep(rng.uniform(0, self.args.think_ms / 1000))
+        while time.monotonic() < self.stop_at:
+            session_id = f"load-{index}-{uuid.uuid4().hex[:12]}"
+            if rng.random() < self.args.verify_share:
+                await self.verification(rng, session_id, phone_number)
+            else:
+                await self.registration(rng, session_id, phone_number)
+            await self.think(rng, 5)
+
+    async def run(self):
+        started = time.monotonic()
+        self.stop_at = started + self.args.seconds
+        await asyncio.gather(*(self.subscriber(i) for i in range(self.args.subscribers)))
+        return time.monotonic() - started
+
+
+# --- Report ---
+
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def build_report(results, sms, elapsed):
+    steps = {}
+    for step in sorted(set(results.latencies) | set(results.errors)):
+        values = sorted(results.latencies[step])
+        count = len(values) + results.errors[step]
+        steps[step] = {
+            "requests": len(values), "errors": results.errors[step],
+            "error_rate": results.errors[step] / count if count else 0.0,
+            **{f"p{p}_ms": percentile(values, p) * 1000 for p in (50, 95, 99)},
+        }
+    collisions = sms.collisions()
+    return {
+        "seconds": elapsed,
+        "hops": results.hops,
+        "hops_per_second": results.hops / elapsed,
+        "errors": sum(results.errors.values()),
+        "steps": steps,
+        "outcomes": dict(results.outcomes),
+        "registrations_submitted": results.submitted,
+        "sms_received": sms.messages,
+        "ubrns_issued": len(sms.ubrns),
+        "ubrn_collisions": collisions,
+    }
+
+
+def print_report(report):
+    print(f"{report['hops']} hops in {report['seconds']:.1f}s ({report['hops_per_second']:.0f}/s), "
+          f"{report['errors']} errors")
+    print(f"{'step':<22}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for step, s in report["steps"].items():
+        print(f"{step:<22}{s['requests']:>9}{s['errors']:>8}{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}")
+    print("session outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(report["outcomes"].items())))
+    print(f"registrations submitted: {report['registrations_submitted']}, SMS received: {report['sms_received']}, "
+          f"distinct UBRNs: {report['ubrns_issued']}, UBRN collisions: {len(report['ubrn_collisions'])}")
+    for ubrn, count in list(report["ubrn_collisions"].items())[:10]:
+        print(f"  {ubrn} issued {count} times")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="callback URL of a running server")
+    target.add_argument("--in-process", action="store_true", help="import the app and call it in this process")
+    parser.add_argument("--subscribers", type=int, default=1000, help="concurrent virtual subscribers")
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--think-ms", type=float, default=2000, help="mean think time between hops")
+    parser.add_argument("--typo-rate", type=float, default=0.02, help="chance of a typo in each answer")
+    parser.add_argument("--abandon-rate", type=float, default=0.02, help="chance of walking away before each hop")
+    parser.add_argument("--verify-share", type=float, default=0.2, help="share of sessions that verify a UBRN")
+    parser.add_argument("--sms-port", type=int, default=8099, help="port of the SMS capture gateway (0 to disable)")
+    parser.add_argument("--connections", type=int, default=256, help="keep-alive connections to keep (HTTP)")
+    parser.add_argument("--timeout", type=float, default=10, help="request timeout in seconds (HTTP)")
+    parser.add_argument("--threads", type=int, default=8, help="worker threads (in-process)")
+    parser.add_argument("--seed", default="loadgen")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    sms = SmsCapture()
+    gateway = await sms.start(args.sms_port) if args.sms_port else None
+    if args.in_process:
+        if gateway:
+            os.environ.setdefault("SMS_GATEWAY_URL", f"http://127.0.0.1:{args.sms_port}/version1/messaging")
+        os.environ.setdefault("LOG_LEVEL", "ERROR")
+        transport = InProcessTransport(args.threads)
+    else:
+        transport = HttpTransport(args.url, args.connections, args.timeout)
+
+    simulation = Simulation(transport, args, sms)
+    elapsed = await simulation.run()
+    if gateway:
+        gateway.close()
+    report = build_report(simulation.results, sms, elapsed)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
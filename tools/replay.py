@@ -0,0 +1,224 @@
+"""Replays recorded /callback traffic against the app.
+
+    python tools/replay.py traffic.jsonl --url http://127.0.0.1:8000/callback [--speed 1]
+    python tools/replay.py traffic.jsonl --in-process --speed 0
+
+Reads a file written by the traffic recorder (TRAFFIC_RECORD_PATH) and sends
+the same sessions again. --speed 1 keeps the recorded timing, --speed 10
+compresses it tenfold, and --speed 0 sends as fast as the app answers, with
+as many sessions at once as were ever live together in the recording (or
+--concurrency). Hops of one session are always sent in order, each after the
+previous one has been answered.
+
+The recording is redacted, so the user's inputs are rebuilt: menu choices are
+kept, and Ghana Card numbers, UBRNs, names and dates of birth are replaced
+with made-up values of the same kind. These are the same for every run. Where
+the recorded answer was rejected as invalid, the stand-in is made invalid too.
+Phone numbers are derived from the recorded hashes, so rate limits see the
+same callers. Session IDs get a per-run prefix so replays never collide with
+each other.
+
+Reports latency percentiles overall and per step. It also lists responses
+whose first line differs from the recording, grouped by step. Verification
+of a real UBRN is expected to differ, as its made-up stand-in does not exist.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+
+# Only matters with --in-process, where the app logs in this process.
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from loadgen import HttpTransport, InProcessTransport, percentile
+
+from log_config import redact
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def load_sessions(path):
+    """Returns {sessionId: [record, ...]} in arrival order, and the recording's start and end times."""
+    sessions = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                sessions[record["s"]].append(record)
+    for hops in sessions.values():
+        hops.sort(key=lambda r: r["t"])
+    starts = [hops[0]["t"] for hops in sessions.values()]
+    ends = [hops[-1]["t"] + hops[-1].get("ms", 0) / 1000 for hops in sessions.values()]
+    return sessions, min(starts, default=0.0), max(ends, default=0.0)
+
+
+def peak_concurrency(sessions):
+    events = []
+    for hops in sessions.values():
+        events.append((hops[0]["t"], 1))
+        events.append((hops[-1]["t"] + hops[-1].get("ms", 0) / 1000, -1))
+    live = peak = 0
+    for _, change in sorted(events):
+        live += change
+        peak = max(peak, live)
+    return peak
+
+
+# --- Rebuilding Inputs ---
+
+def made_up_value(token, session_id, index, registration, invalid=False):
+    """A stand-in for one redacted input, the same on every run."""
+    rng = random.Random(f"{session_id}-{index}-{token}")
+    if token == "<nin>":
+        return f"GHA-{rng.randrange(10 ** 9):09d}-{rng.randrange(10)}"
+    if token == "<ubrn>":
+        return f"GHA-01-027-{rng.randrange(100000):05d}-{rng.randrange(10000):04d}-{rng.randrange(10)}"
+    length = int(token[1:].split()[0])
+    if registration and index == 2 and length == 8:
+        dob = time.strftime("%d%m%Y", time.localtime(time.time() - rng.uniform(0, 300) * 86400))
+        return "00" + dob[2:] if invalid else dob
+    if registration and index == 1:
+        name = "".join(rng.choice(LETTERS) for _ in range(length))
+        name = name.capitalize() if length < 5 else f"{name[:length // 2].capitalize()} {name[length // 2 + 1:].capitalize()}"
+        return name[:-1] + "1" if invalid else name
+    return "x" * length
+
+
+def rebuild_text(redacted, session_id, invalid=False):
+    """Rebuilds a hop's text; `invalid` makes the last input one that validation rejects."""
+    if not redacted: return redacted or ""
+    values = redacted.split("*")
+    registration = values[0] == "1"
+    last = len(values) - 1
+    return "*".join(value if not value.startswith("<")
+                    else made_up_value(value, session_id, i, registration, invalid and i == last)
+                    for i, value in enumerate(values))
+
+
+def made_up_phone(phone_hash):
+    if not phone_hash: return None
+    return f"+2339{int(phone_hash[:12], 16) % 10 ** 8:08d}"
+
+
+# --- Replay ---
+
+class Replay:
+    def __init__(self, transport, sessions, started_at, speed, concurrency):
+        self.transport = transport
+        self.sessions = sessions
+        self.started_at = started_at
+        self.speed = speed
+        self.run_id = uuid.uuid4().hex[:8]
+        self._limit = asyncio.Semaphore(concurrency) if concurrency else None
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.diffs = Counter()
+        self.hops = 0
+
+    async def session(self, session_id, hops, wall_start):
+        if self._limit is not None:
+            async with self._limit:
+                await self._send(session_id, hops, wall_start)
+        else:
+            await self._send(session_id, hops, wall_start)
+
+    async def _send(self, session_id, hops, wall_start):
+        replay_id = f"replay-{self.run_id}-{session_id}"
+        phone_number = made_up_phone(hops[0].get("p"))
+        for record in hops:
+            if self.speed:
+                delay = wall_start + (record["t"] - self.started_at) / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            step = record.get("step", "unknown")
+            started = time.perf_counter()
+            try:
+                text = rebuild_text(record["x"], session_id, record.get("r", "").startswith("END Invalid"))
+                response = await self.transport.post(replay_id, phone_number, text)
+            except Exception as e:
+                self.errors[(step, type(e).__name__)] += 1
+                return
+            self.latencies[step].append(time.perf_counter() - started)
+            self.hops += 1
+            first_line = redact(response.partition("\n")[0])
+            if first_line != record.get("r"):
+                self.diffs[(step, record.get("r"), first_line)] += 1
+
+    async def run(self):
+        wall_start = time.monotonic()
+        await asyncio.gather(*(self.session(sid, hops, wall_start) for sid, hops in self.sessions.items()))
+        return time.monotonic() - wall_start
+
+
+def build_report(replay, elapsed, recorded_seconds):
+    everything = sorted(v for values in replay.latencies.values() for v in values)
+    steps = {}
+    for step, values in sorted(replay.latencies.items()):
+        values.sort()
+        steps[step] = {"requests": len(values), **{f"p{p}_ms": percentile(values, p) * 1000 for p in (50, 95, 99)}}
+    return {
+        "sessions": len(replay.sessions),
+        "hops": replay.hops,
+        "seconds": elapsed,
+        "recorded_seconds": recorded_seconds,
+        "hops_per_second": replay.hops / elapsed if elapsed else 0.0,
+        "latency": {f"p{p}_ms": percentile(everything, p) * 1000 for p in (50, 95, 99)},
+        "steps": steps,
+        "errors": [{"step": step, "error": error, "count": count} for (step, error), count in replay.errors.items()],
+        "diffs": [{"step": step, "recorded": recorded, "replayed": replayed, "count": count}
+                  for (step, recorded, replayed), count in replay.diffs.most_common()],
+    }
+
+
+def print_report(report, max_diffs=20):
+    print(f"{report['sessions']} sessions, {report['hops']} hops in {report['seconds']:.1f}s "
+          f"(recorded over {report['recorded_seconds']:.1f}s), {report['hops_per_second']:.0f} hops/s")
+    latency = report["latency"]
+    print(f"latency p50 {latency['p50_ms']:.1f} ms, p95 {latency['p95_ms']:.1f} ms, p99 {latency['p99_ms']:.1f} ms")
+    print(f"{'step':<22}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for step, s in report["steps"].items():
+        print(f"{step:<22}{s['requests']:>9}{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}")
+    for error in report["errors"]:
+        print(f"error: {error['step']} {error['error']} x{error['count']}")
+    total = sum(d["count"] for d in report["diffs"])
+    print(f"{total} responses differ from the recording")
+    for diff in report["diffs"][:max_diffs]:
+        print(f"  {diff['step']} x{diff['count']}: {diff['recorded']!r} -> {diff['replayed']!r}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recording", help="JSONL file written by the traffic recorder")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="callback URL of a running server")
+    target.add_argument("--in-process", action="store_true", help="import the app and call it in this process")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, N = N times faster, 0 = flat out")
+    parser.add_argument("--concurrency", type=int, help="sessions at once when --speed 0 (default: recorded peak)")
+    parser.add_argument("--connections", type=int, default=256, help="keep-alive connections to keep (HTTP)")
+    parser.add_argument("--timeout", type=float, default=10, help="request timeout in seconds (HTTP)")
+    parser.add_argument("--threads", type=int, default=8, help="worker threads (in-process)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    sessions, started_at, ended_at = load_sessions(args.recording)
+    concurrency = (args.concurrency or peak_concurrency(sessions)) if args.speed == 0 else args.concurrency
+    if args.in_process:
+        transport = InProcessTransport(args.threads)
+    else:
+        transport = HttpTransport(args.url, args.connections, args.timeout)
+    replay = Replay(transport, sessions, started_at, args.speed, concurrency)
+    elapsed = await replay.run()
+
+    report = build_report(replay, elapsed, ended_at - started_at)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""Checks a bulk registration file and lists the rows that need fixing.
+
+    python tools/validate_bulk.py births.csv [--json report.json] [--no-numpy]
+
+The file format is described in bulk_validation.py. Prints one line per
+invalid row with its row number as a spreadsheet shows it, and exits with
+status 1 if any row is invalid.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import bulk_validation
+import reference_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="CSV file with a header row")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--no-numpy", action="store_true", help="use the pure-Python checks even if NumPy is installed")
+    parser.add_argument("--max-rows", type=int, default=50, help="invalid rows to print")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with open(args.file, newline="", encoding="utf-8-sig") as f:
+        try:
+            report = bulk_validation.validate_file(f, reference_data.store.current.district_codes, use_numpy=not args.no_numpy)
+        except ValueError as e:
+            sys.exit(f"{args.file}: {e}")
+    elapsed = time.perf_counter() - started
+
+    for error in report["errors"][:args.max_rows]:
+        print(f"row {error['row']}: {'; '.join(error['errors'])}")
+    if report["invalid_rows"] > args.max_rows:
+        print(f"... and {report['invalid_rows'] - args.max_rows} more")
+    print(f"{report['rows']:,} rows checked in {elapsed:.1f}s: {report['valid_rows']:,} valid, "
+          f"{report['invalid_rows']:,} invalid.")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["invalid_rows"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+# --- Session Traces ---
+# A USSD registration is nine or more separate HTTP hops. For every hop we keep
+# when it arrived, which step it was, how long we spent handling it (and how
+# much of that was storage) and how big the response was, grouped by
+# sessionId. Sessions live in a bounded LRU so memory stays flat; finished
+# sessions can also be exported to an OpenTelemetry collector over OTLP/HTTP.
+
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "1") == "1"
+TRACE_MAX_SESSIONS = int(os.environ.get("TRACE_MAX_SESSIONS", "10000"))
+TRACE_MAX_HOPS = int(os.environ.get("TRACE_MAX_HOPS", "32"))
+# e.g. http://localhost:4318 - spans are POSTed to <endpoint>/v1/traces.
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "").rstrip("/")
+OTLP_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "ghana-ebirth-ussd")
+OTLP_QUEUE_SIZE = 1000
+
+log = logging.getLogger("ussd.tracing")
+
+# Storage and SMS time accumulated by the hop currently being handled.
+_current_hop = contextvars.ContextVar("current_hop", default=None)
+
+
+def start_hop():
+    """Marks the start of a hop. Returns a token to pass to finish_hop()."""
+    timer = [0.0, 0.0]
+    _current_hop.set(timer)
+    return (time.time(), timer)
+
+
+def add_storage_time(seconds):
+    """Adds storage time to the hop being handled, if any."""
+    timer = _current_hop.get()
+    if timer is not None:
+        timer[0] += seconds
+
+
+def add_sms_time(seconds):
+    """Adds SMS gateway time to the hop being handled, if any."""
+    timer = _current_hop.get()
+    if timer is not None:
+        timer[1] += seconds
+
+
+def hop_timings(token):
+    """Storage and SMS time, in ms, recorded so far for a hop."""
+    timer = token[1]
+    return {"storage_ms": round(timer[0] * 1000, 3), "sms_ms": round(timer[1] * 1000, 3)}
+
+
+class TraceStore:
+    """Bounded, most-recently-used store of per-session hop timelines."""
+
+    def __init__(self, max_sessions=TRACE_MAX_SESSIONS, max_hops=TRACE_MAX_HOPS):
+        self.max_sessions = max_sessions
+        self.max_hops = max_hops
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, session_id, hop):
+        with self._lock:
+            trace = self._sessions.get(session_id)
+            if trace is None:
+                trace = self._sessions[session_id] = {"session_id": session_id, "hops": []}
+                if len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            if len(trace["hops"]) < self.max_hops:
+                trace["hops"].append(hop)
+            return trace
+
+    def get(self, session_id):
+        with self._lock:
+            trace = self._sessions.get(session_id)
+            return summarise(trace) if trace else None
+
+    def recent(self, limit=50):
+        with self._lock:
+            session_ids = list(reversed(self._sessions))[:limit]
+            traces = [self._sessions[s] for s in session_ids]
+        return [summarise(trace, include_hops=False) for trace in traces]
+
+
+def summarise(trace, include_hops=True):
+    """Adds end-to-end, server and user/network time to a session's hops."""
+    hops = [dict(h) for h in trace["hops"]]
+    previous_end = None
+    for hop in hops:
+        # Time between our previous response and this request: the user
+        # reading and typing plus gateway and network time.
+        hop["think_ms"] = None if previous_end is None else round((hop["arrival"] - previous_end) * 1000, 3)
+        previous_end = hop["arrival"] + hop["handler_ms"] / 1000
+    server_ms = sum(h["handler_ms"] for h in hops)
+    total_ms = (previous_end - hops[0]["arrival"]) * 1000 if hops else 0.0
+    summary = {
+        "session_id": trace["session_id"],
+        "hop_count": len(hops),
+        "started_at": hops[0]["arrival"] if hops else None,
+        "last_step": hops[-1]["step"] if hops else None,
+        "ended": bool(hops and hops[-1]["ended"]),
+        "total_ms": round(total_ms, 3),
+        "server_ms": round(server_ms, 3),
+        "storage_ms": round(sum(h["storage_ms"] for h in hops), 3),
+        "think_ms": round(total_ms - server_ms, 3),
+    }
+    if include_hops:
+        summary["hops"] = hops
+    return summary
+
+
+store = TraceStore()
+
+
+def finish_hop(token, session_id, step, handler_seconds, response_bytes, ended):
+    """Records a finished hop in the session's trace."""
+    _current_hop.set(None)
+    if not TRACE_ENABLED or not session_id: return
+    arrival, timer = token
+    hop = {
+        "arrival": arrival,
+        "step": step,
+        "handler_ms": round(handler_seconds * 1000, 3),
+        "storage_ms": round(timer[0] * 1000, 3),
+        "sms_ms": round(timer[1] * 1000, 3),
+        "response_bytes": response_bytes,
+        "ended": ended,
+    }
+    trace = store.record(session_id, hop)
+    if ended and OTLP_ENDPOINT:
+        exporter.submit(trace)
+
+
+# --- OpenTelemetry Export ---
+
+def _attribute(key, value):
+    if isinstance(value, bool): return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int): return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float): return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(trace):
+    """Converts a session trace to an OTLP/HTTP JSON payload: one root span, one child per hop."""
+    hops = list(trace["hops"])
+    trace_id = hashlib.sha256(trace["session_id"].encode()).hexdigest()[:32]
+    root_id = os.urandom(8).hex()
+    nanos = lambda seconds: str(int(seconds * 1e9))
+    last_end = hops[-1]["arrival"] + hops[-1]["handler_ms"] / 1000
+    spans = [{
+        "traceId": trace_id, "spanId": root_id, "name": "ussd.session", "kind": 2,
+        "startTimeUnixNano": nanos(hops[0]["arrival"]), "endTimeUnixNano": nanos(last_end),
+        "attributes": [_attribute("ussd.session_id", trace["session_id"]), _attribute("ussd.hop_count", len(hops))],
+    }]
+    for index, hop in enumerate(hops):
+        spans.append({
+            "traceId": trace_id, "spanId": os.urandom(8).hex(), "parentSpanId": root_id,
+            "name": f"ussd.hop {hop['step']}", "kind": 2,
+            "startTimeUnixNano": nanos(hop["arrival"]),
+            "endTimeUnixNano": nanos(hop["arrival"] + hop["handler_ms"] / 1000),
+            "attributes": [
+                _attribute("ussd.hop", index + 1), _attribute("ussd.step", hop["step"]),
+                _attribute("ussd.storage_ms", hop["storage_ms"]),
+                _attribute("ussd.response_bytes", hop["response_bytes"]),
+            ],
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", OTLP_SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": "ussd.tracing"}, "spans": spans}],
+    }]}
+
+
+class OtlpExporter:
+    """Posts finished session traces to an OTLP/HTTP collector from a background thread."""
+
+    def __init__(self, endpoint=OTLP_ENDPOINT, maxsize=OTLP_QUEUE_SIZE):
+        self.url = f"{endpoint}/v1/traces"
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, trace):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait({"session_id": trace["session_id"], "hops": list(trace["hops"])})
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            trace = self._queue.get()
+            try:
+                body = json.dumps(to_otlp(trace)).encode()
+                req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(req, timeout=2).close()
+            except Exception as e:
+                self.dropped += 1
+                log.debug("TRACING: OTLP export failed: %s", e)
+
+
+exporter = OtlpExporter()
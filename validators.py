@@ -0,0 +1,103 @@
+import datetime
+import re
+import time
+
+# --- Input Validation ---
+# The checks run on almost every hop, so they avoid per-call work:
+#   * patterns are compiled once here instead of going through re's cache;
+#   * Ghana Card numbers and UBRNs are matched as typed first and only
+#     upper-cased when that fails, since most arrive in upper case already;
+#   * the date of birth is checked against a table of month lengths instead of
+#     building a datetime, and the allowed years (the last ten) are worked out
+#     once a day rather than on every call.
+# Each validator accepts exactly what the original inline versions in app.py
+# did. validate_batch checks many values of one field at once, e.g. for bulk
+# uploads.
+
+NAME_PATTERN = re.compile(r"^[a-zA-Z\s'-]+$")
+NIN_PATTERN = re.compile(r'^GHA-\d{9}-[\dA-Z]$')
+UBRN_PATTERN = re.compile(r'^GHA-\d{2}-\d{3}-\d{5}-\d{4}-[\dX]$')
+
+DOB_MAX_AGE_YEARS = 10
+DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# (valid until, earliest year, latest year); replaced as a whole at local midnight.
+_year_window = (0.0, 0, 0)
+
+
+def year_window():
+    """The earliest and latest year of birth accepted today."""
+    global _year_window
+    until, earliest, latest = _year_window
+    now = time.time()
+    if now < until:
+        return earliest, latest
+    today = datetime.date.today()
+    midnight = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time())
+    _year_window = (midnight.timestamp(), today.year - DOB_MAX_AGE_YEARS, today.year)
+    return today.year - DOB_MAX_AGE_YEARS, today.year
+
+
+def _date_ok(dob, earliest, latest):
+    if not dob or len(dob) != 8 or not dob.isdigit(): return False
+    try:
+        # One int() for all eight digits; it also reads other Unicode digits, as the slices did.
+        number = int(dob)
+    except ValueError:
+        return False
+    day, rest = divmod(number, 1000000)
+    month, year = divmod(rest, 10000)
+    if not (1 <= month <= 12 and earliest <= year <= latest and day >= 1): return False
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return day <= 29
+    return day <= DAYS_IN_MONTH[month]
+
+
+# --- Scalar Validators ---
+
+def validate_name(name):
+    if name == '0': return True
+    if not name: return False
+    clean_name = name.strip()
+    if not (2 <= len(clean_name) <= 50): return False
+    return NAME_PATTERN.match(clean_name) is not None
+
+def validate_date_of_birth(dob):
+    earliest, latest = year_window()
+    return _date_ok(dob, earliest, latest)
+
+def validate_sex_selection(sex_input):
+    return sex_input == '1' or sex_input == '2'
+
+def validate_nin(nin):
+    if not nin: return False
+    return NIN_PATTERN.match(nin) is not None or NIN_PATTERN.match(nin.upper()) is not None
+
+def validate_optional_nin(nin):
+    if nin == '0': return True
+    return validate_nin(nin)
+
+def validate_ubrn(ubrn):
+    if not ubrn: return False
+    return UBRN_PATTERN.match(ubrn) is not None or UBRN_PATTERN.match(ubrn.upper()) is not None
+
+
+# --- Batch Validation ---
+
+VALIDATORS = {
+    "name": validate_name,
+    "dob": validate_date_of_birth,
+    "sex": validate_sex_selection,
+    "nin": validate_nin,
+    "optional_nin": validate_optional_nin,
+    "ubrn": validate_ubrn,
+}
+
+
+def validate_batch(field, values):
+    """Validates many values of one field (a key of VALIDATORS); returns a list of booleans in order."""
+    if field == "dob":
+        earliest, latest = year_window()
+        return [_date_ok(dob, earliest, latest) for dob in values]
+    validate = VALIDATORS[field]
+    return [validate(value) for value in values]
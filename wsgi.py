@@ -0,0 +1,68 @@
+"""WSGI entry point for production servers: gunicorn -c gunicorn.conf.py wsgi:application
+
+`application` answers POST /callback itself and hands every other request to
+the Flask app. A USSD hop is a tiny form post with a short plain-text reply,
+so Flask's request context, form parsing and response object are most of the
+cost of a hop; the fast path parses the form body directly, calls the flow
+engine and returns the encoded reply. Set WSGI_FAST_CALLBACK=0 to serve
+/callback through Flask as well.
+"""
+import os
+from urllib.parse import unquote_plus
+
+import profiler
+from app import app, handle_ussd
+
+WSGI_FAST_CALLBACK = os.environ.get("WSGI_FAST_CALLBACK", "1") != "0"
+MAX_BODY_BYTES = 16 * 1024
+
+# Same headers Flask sends for a view that returns a string.
+_CONTENT_TYPE = ("Content-Type", "text/html; charset=utf-8")
+_FORM_TYPE = "application/x-www-form-urlencoded"
+
+
+def parse_form(data):
+    """Parses an application/x-www-form-urlencoded string into a dict (first value wins, as in Flask)."""
+    values = {}
+    for pair in data.split("&"):
+        if not pair: continue
+        name, _, value = pair.partition("=")
+        if "%" in pair or "+" in pair:
+            name, value = unquote_plus(name), unquote_plus(value)
+        values.setdefault(name, value)
+    return values
+
+
+def _error(start_response, status, message):
+    body = message.encode()
+    start_response(status, [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def fast_callback(environ, start_response):
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return _error(start_response, "400 Bad Request", "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        return _error(start_response, "413 Request Entity Too Large", "Request body too large")
+
+    # Like Flask's request.values: the query string takes precedence over the
+    # form body, and the first of repeated values is used.
+    body = environ["wsgi.input"].read(length).decode("utf-8", "replace") if length else ""
+    values = parse_form(environ.get("QUERY_STRING", "") + "&" + body)
+
+    body = handle_ussd(values.get("sessionId"), values.get("phoneNumber"), values.get("text", "")).encode()
+    start_response("200 OK", [_CONTENT_TYPE, ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def application(environ, start_response):
+    if (WSGI_FAST_CALLBACK
+            and environ["PATH_INFO"] == "/callback"
+            and environ["REQUEST_METHOD"] == "POST"
+            and environ.get("CONTENT_TYPE", _FORM_TYPE).startswith(_FORM_TYPE)
+            # The profiler hooks the Flask view, so route through it while a profile runs.
+            and not profiler.running()):
+        return fast_callback(environ, start_response)
+    return app(environ, start_response)